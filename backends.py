@@ -0,0 +1,206 @@
+import math
+import numpy as np
+
+from relaxation import RelaxationKernel, spring_forces
+from geometry import segments_intersect, segments_intersect_batch
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# the hot loops of SpringSimulator behind one interface: spring force
+# updates, the relaxation displacement step, heater selection and the
+# crossing test for new springs; the reference backend works on particle
+# and spring objects and is the one the others are checked against
+
+class ReferenceBackend:
+    """ Pure Python kernels over particle and spring objects. """
+    name = 'reference'
+    array_backed = False
+
+    def update_forces(self, simulator, springs):
+        for spring in springs:
+            spring.update_force()
+
+    def relaxation_kernel(self, simulator, movable, minimizer = None):
+        # no kernel, relax_heat steps the particles one by one
+        return None
+
+    def particles_near(self, simulator, x, y, radius):
+        particles = simulator.particles
+        return [particles[index] for index in
+                simulator.particle_index.query(x, y, radius).tolist()]
+
+    def crosses(self, simulator, particle, partner, spring_ids):
+        # whether the segment between two particles crosses any of the
+        # springs (given by id) not attached to them
+        edges = simulator.edges
+        for spring in map(edges.spring, spring_ids.tolist()):
+            if spring.particle1 in (particle, partner) or \
+               spring.particle2 in (particle, partner):
+                continue
+            if segments_intersect(particle.point, partner.point,
+                                  spring.particle1.point,
+                                  spring.particle2.point):
+                return True
+        return False
+
+class NumpyBackend(ReferenceBackend):
+    """ Batched NumPy kernels over the arrays of a ParticleStore. """
+    name = 'numpy'
+    array_backed = True
+    kernel = RelaxationKernel
+    spring_forces = staticmethod(spring_forces)
+    # heater selection stays the particle grid query of ReferenceBackend,
+    # which only looks at the cells around the heater
+
+    def update_forces(self, simulator, springs):
+        # every spring with a stale force is flagged dirty in the store
+        store = simulator.store
+        self.spring_forces(store, simulator.settings,
+                           np.flatnonzero(store.dirty & store.alive))
+
+    def relaxation_kernel(self, simulator, movable, minimizer = None):
+        return self.kernel(simulator.store, simulator.settings, movable,
+                           minimizer)
+
+    def crosses(self, simulator, particle, partner, spring_ids):
+        if len(spring_ids) == 0:
+            return False
+        ends = simulator.store.edges[spring_ids]
+        ends = ends[(ends != particle.index).all(axis = 1) &
+                    (ends != partner.index).all(axis = 1)]
+        x = simulator.store.x
+        y = simulator.store.y
+        return bool(segments_intersect_batch(
+            x[particle.index], y[particle.index],
+            x[partner.index], y[partner.index],
+            x[ends[:, 0]], y[ends[:, 0]],
+            x[ends[:, 1]], y[ends[:, 1]]).any())
+
+def _spring_forces_loop(x, y, radii, edges, rest_length, stiffness,
+                        spring_ids, force, actual_length, dirty):
+    for spring in spring_ids:
+        first = edges[spring, 0]
+        second = edges[spring, 1]
+        length = rest_length[spring]
+        current = math.hypot(x[first] - x[second], y[first] - y[second]) - \
+                  radii[first] - radii[second]
+        if current < length:
+            force[spring] = (1 / current - 1 / length) * \
+                            stiffness * length * length / 2
+        else:
+            force[spring] = stiffness * (length - current)
+        actual_length[spring] = current
+        dirty[spring] = False
+
+def _spring_sums_loop(x, y, radii, force, movable, owner, neighbour,
+                      spring_ids, corner_owner, corner_side,
+                      x_displacement, y_displacement, max_allowable_move):
+    # relaxation.spring_sums one particle and spring at a time, summing
+    # in the same order so both give the same results
+    for slot in range(len(owner)):
+        local = owner[slot]
+        particle = movable[local]
+        other = neighbour[slot]
+        delta_x = x[other] - x[particle]
+        delta_y = y[other] - y[particle]
+        delta_length = math.hypot(delta_x, delta_y)
+        # make sure not to divide by a zero value
+        if delta_length < 1e-5:
+            continue
+        scale = -force[spring_ids[slot]] / delta_length
+        x_displacement[local] += delta_x * scale
+        y_displacement[local] += delta_y * scale
+        max_allowable_move[local] = min(
+            max_allowable_move[local],
+            (delta_length - radii[particle] - radii[other]) / 4)
+
+    for slot in range(len(corner_owner)):
+        local = corner_owner[slot]
+        corner = movable[local]
+        side1 = corner_side[slot, 0]
+        side2 = corner_side[slot, 1]
+        if math.hypot(x[side1] - x[corner], y[side1] - y[corner]) < 1e-5 or \
+           math.hypot(x[side2] - x[corner], y[side2] - y[corner]) < 1e-5:
+            continue
+        # same line equation and normalization as geometry.line_distances
+        if y[side1] == y[side2]:
+            a = 0.0
+            b = 1.0
+            c = -y[side1]
+        else:
+            a = 1.0
+            b = -(x[side2] - x[side1]) / (y[side2] - y[side1])
+            c = -x[side1] - b * y[side1]
+        separation = abs(a * x[corner] + b * y[corner] + c) / \
+                     math.sqrt(a * a + b * b)
+        max_allowable_move[local] = min(max_allowable_move[local],
+                                        separation / 2)
+
+def _clamp_loop(x_displacement, y_displacement, max_allowable_move):
+    for local in range(len(x_displacement)):
+        particle_move = math.hypot(x_displacement[local],
+                                   y_displacement[local])
+        if particle_move > max_allowable_move[local]:
+            shrink = max_allowable_move[local] / particle_move
+            x_displacement[local] *= shrink
+            y_displacement[local] *= shrink
+
+if numba is not None:
+    _jit = numba.njit(cache = True, error_model = 'numpy')
+    _spring_forces_loop = _jit(_spring_forces_loop)
+    _spring_sums_loop = _jit(_spring_sums_loop)
+    _clamp_loop = _jit(_clamp_loop)
+
+def jit_spring_forces(store, settings, spring_ids):
+    _spring_forces_loop(store.x, store.y, store.radii(settings), store.edges,
+                        store.rest_length, settings.spring_default_stiffness,
+                        np.asarray(spring_ids, dtype = np.int64), store.force,
+                        store.actual_length, store.dirty)
+
+def jit_spring_sums(x, y, radii, force, movable, owner, neighbour,
+                    spring_ids, corner_owner, corner_side, max_move):
+    x_displacement = np.zeros(len(movable))
+    y_displacement = np.zeros(len(movable))
+    max_allowable_move = np.full(len(movable), float(max_move))
+    _spring_sums_loop(x, y, radii, force, movable, owner, neighbour,
+                      spring_ids, corner_owner, corner_side.reshape(-1, 2),
+                      x_displacement, y_displacement, max_allowable_move)
+    return x_displacement, y_displacement, max_allowable_move
+
+def jit_displacements(x, y, radii, force, movable, owner, neighbour,
+                      spring_ids, corner_owner, corner_side, max_move):
+    x_displacement, y_displacement, max_allowable_move = jit_spring_sums(
+        x, y, radii, force, movable, owner, neighbour, spring_ids,
+        corner_owner, corner_side, max_move)
+    _clamp_loop(x_displacement, y_displacement, max_allowable_move)
+    return x_displacement, y_displacement
+
+class JitRelaxationKernel(RelaxationKernel):
+    """ RelaxationKernel running compiled loops instead of numpy calls. """
+    _displacements = staticmethod(jit_displacements)
+    _spring_sums = staticmethod(jit_spring_sums)
+    _spring_forces = staticmethod(jit_spring_forces)
+
+class NumbaBackend(NumpyBackend):
+    """ NumpyBackend with the force and displacement loops compiled. """
+    name = 'numba'
+    kernel = JitRelaxationKernel
+    spring_forces = staticmethod(jit_spring_forces)
+
+BACKENDS = {
+    'reference': ReferenceBackend,
+    'numpy': NumpyBackend,
+    'numba': NumbaBackend,
+}
+
+def get_backend(name):
+    if not name in BACKENDS:
+        raise ValueError("Unknown backend %s, expected one of %s" %
+                         (name, ', '.join(BACKENDS)))
+    if name == 'numba' and numba is None:
+        print("Warning: numba is not installed, using the numpy backend")
+        name = 'numpy'
+    return BACKENDS[name]()
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+import argparse
+import contextlib
+import copy
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+from geometry import Point
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+from backends import BACKENDS
+
+from PIL import Image, ImageDraw
+
+# sizes in lattice intervals, so scenarios scale with the settings: the
+# circle radius, and the width of the synthetic elliptic masks
+CIRCLE_RADIUS = 6
+MASK_SIZES = (8, 16, 32)
+
+# reference results, run from the repository root with the default
+# options; runs compare against it unless given another baseline
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'benchmarks', 'baseline.json')
+
+# metrics where lower is better, compared against the baseline
+TIMED_METRICS = ('init_seconds', 'relax_seconds', 'pass_seconds',
+                 'passes_seconds', 'coalesced_seconds', 'peak_memory_kb')
+
+def _interval(settings):
+    return settings.particle_default_radius * 2 + \
+           settings.spring_default_length
+
+def scenarios(settings_files, backends, mask_sizes = MASK_SIZES,
+              coalesce = False):
+    # (name, settings file, backend, shape, size, coalesce) of every
+    # scenario; the default settings come first, then every settings file
+    found = []
+    for filename in [None] + list(settings_files):
+        for backend in backends:
+            found.append(('circle', filename, backend, 'circle',
+                          CIRCLE_RADIUS, coalesce))
+            for size in mask_sizes:
+                found.append(('mask%d' % size, filename, backend, 'mask',
+                              size, coalesce))
+    return found
+
+def _mask(size, interval):
+    # ellipse with a square hole, size intervals wide and 3/4 as high
+    width = int(size * interval)
+    height = int(size * interval * 3 / 4)
+    image = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((1, 1, width - 2, height - 2), fill = 255)
+    draw.rectangle((width * 2 // 5, height * 2 // 5,
+                    width * 3 // 5, height * 3 // 5), fill = 0)
+    return image
+
+def _initialize(simulator, shape, size):
+    interval = _interval(simulator.settings)
+    if shape == 'circle':
+        radius = size * interval
+        simulator.initialize_circle(Point(radius, radius), radius)
+    else:
+        simulator.initialize_from_image(_mask(size, interval))
+
+def _field_box(simulator):
+    xs = [particle.x for particle in simulator.particles]
+    ys = [particle.y for particle in simulator.particles]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def _count_relaxations(simulator):
+    # iterations of every relax_heat call of simulator are appended to
+    # the returned list
+    relaxations = []
+    relax_heat = simulator.relax_heat
+    def counted_relax_heat():
+        statistics = relax_heat()
+        relaxations.append(statistics['iterations'])
+        return statistics
+    simulator.relax_heat = counted_relax_heat
+    return relaxations
+
+def _positions(simulator):
+    return np.array([(particle.x, particle.y)
+                     for particle in simulator.particles])
+
+def _run_scenario(scenario):
+    name, filename, backend, shape, size, coalesce = scenario
+    settings = SimulatorSettings(filename) if filename else \
+               SimulatorSettings()
+    settings.backend = backend
+    settings.relaxation_processes = 1
+    result = {'scenario': name, 'settings': filename, 'backend': backend}
+
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        field = SpringSimulator(settings)
+        start = time.perf_counter()
+        _initialize(field, shape, size)
+        result['init_seconds'] = time.perf_counter() - start
+        result['particles'] = len(field.particles)
+        result['springs'] = len(field.edges)
+
+        x_min, y_min, x_max, y_max = _field_box(field)
+        y = (y_min + y_max) / 2
+        margin = settings.heater_size
+        start_point = Point(x_min - margin, y)
+        finish_point = Point(x_max + margin, y)
+
+        # a single relax_heat: one heater tick in the middle of the field
+        simulator = field.clone()
+        middle = Point((x_min + x_max) / 2, y)
+        start = time.perf_counter()
+        simulator.run_pass(middle, Point(middle.x + settings.heater_speed / 2,
+                                         middle.y))
+        result['relax_seconds'] = time.perf_counter() - start
+        result['relax_iterations'] = simulator.last_relaxation['iterations']
+
+        # one pass across the field, timing every relax_heat of it
+        simulator = field.clone()
+        relaxations = _count_relaxations(simulator)
+        start = time.perf_counter()
+        simulator.run_pass(start_point, finish_point)
+        result['pass_seconds'] = time.perf_counter() - start
+        result['ticks'] = len(relaxations)
+        result['ticks_per_second'] = len(relaxations) / result['pass_seconds']
+        result['iterations_per_tick'] = float(np.mean(relaxations))
+
+        # the full pass with the final cooldown and relaxation
+        simulator = field.clone()
+        relaxations = _count_relaxations(simulator)
+        start = time.perf_counter()
+        simulator.run_linear_passes([start_point, finish_point])
+        result['passes_seconds'] = time.perf_counter() - start
+        result['relaxations'] = len(relaxations)
+        result['final_springs'] = len(simulator.edges)
+
+        if coalesce:
+            # the same with adaptive ticks, and how far the particles end
+            # up from where the full run put them
+            coalesced = field.clone()
+            coalesced.settings = copy.copy(settings)
+            coalesced.settings.heater_coalesce = True
+            relaxations = _count_relaxations(coalesced)
+            start = time.perf_counter()
+            coalesced.run_linear_passes([start_point, finish_point])
+            result['coalesced_seconds'] = time.perf_counter() - start
+            result['coalesced_relaxations'] = len(relaxations)
+            drift = np.hypot(*(_positions(coalesced) -
+                               _positions(simulator)).T)
+            result['coalesced_drift_max'] = float(drift.max())
+            result['coalesced_drift_mean'] = float(drift.mean())
+
+    result['peak_memory_kb'] = \
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def run_benchmarks(scenario_list, repeat = 1, output = sys.stdout):
+    # every scenario runs in a fresh process, one at a time, so timings do
+    # not compete and peak memory is that of the scenario alone; of the
+    # repeats, the fastest run of each timed metric is kept
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        context = multiprocessing.get_context()
+    results = []
+    with context.Pool(1, maxtasksperchild = 1) as pool:
+        for scenario in scenario_list:
+            runs = pool.map(_run_scenario, [scenario] * repeat,
+                            chunksize = 1)
+            result = runs[0]
+            for metric in TIMED_METRICS:
+                if metric in result:
+                    result[metric] = min(run[metric] for run in runs)
+            result['ticks_per_second'] = max(run['ticks_per_second']
+                                             for run in runs)
+            output.write("%-8s %-32s %-9s %6d particles  pass %.3fs  "
+                         "%.2f ticks/s\n" %
+                         (result['scenario'], result['settings'],
+                          result['backend'], result['particles'],
+                          result['pass_seconds'],
+                          result['ticks_per_second']))
+            output.flush()
+            results.append(result)
+    return results
+
+def environment():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def _key(result):
+    return (result['scenario'], result['settings'], result['backend'])
+
+def compare(results, baseline):
+    # (key, metric, baseline, current, ratio) of every timed metric found
+    # in both, ratios above 1 are slower
+    previous = {_key(result): result for result in baseline['results']}
+    changes = []
+    for result in results:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        for metric in TIMED_METRICS:
+            if old.get(metric) and metric in result:
+                changes.append((_key(result), metric, old[metric],
+                                result[metric], result[metric] / old[metric]))
+    return changes
+
+def report(changes, threshold, output = sys.stdout):
+    # prints the metrics which changed by more than threshold, returns the
+    # number of regressions
+    regressions = 0
+    for key, metric, old, new, ratio in changes:
+        if ratio > 1 + threshold:
+            verdict = 'slower'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            continue
+        output.write("%s %s %s %s %s: %.4g -> %.4g (%.2fx)\n" %
+                     (key + (metric, verdict, old, new, ratio)))
+    output.write("%d of %d metrics regressed by more than %d%%\n" %
+                 (regressions, len(changes), threshold * 100))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Simulator benchmark suite',
+        formatter_class = argparse.RawDescriptionHelpFormatter,
+        epilog = '''\
+Example usage:
+  python benchmark.py
+  python benchmark.py -o results.json -b results_before.json -t 0.1
+  python benchmark.py -r 3 -b '' -o benchmarks/baseline.json''')
+    parser.add_argument('-o', dest = 'output', help = 'results file (JSON)')
+    parser.add_argument('-b', dest = 'baseline', default = BASELINE,
+                        help = 'baseline results file to compare against, '
+                               "'' for none (default: "
+                               "benchmarks/baseline.json)")
+    parser.add_argument('-t', dest = 'threshold', type = float,
+                        default = 0.1,
+                        help = 'relative change reported (default: 0.1)')
+    parser.add_argument('-s', dest = 'settings', default = '*.cfg',
+                        help = 'settings files (glob pattern, default: *.cfg)')
+    parser.add_argument('-m', dest = 'masks', nargs = '+', type = int,
+                        default = list(MASK_SIZES),
+                        help = 'mask widths in lattice intervals')
+    parser.add_argument('-B', dest = 'backends', nargs = '+',
+                        choices = list(BACKENDS), default = ['reference'],
+                        help = 'compute backends (default: reference)')
+    parser.add_argument('-C', dest = 'coalesce', action = 'store_true',
+                        help = 'also run with adaptive ticks, recording '
+                               'relaxations and drift')
+    parser.add_argument('-r', dest = 'repeat', type = int, default = 1,
+                        help = 'runs per scenario, fastest kept (default: 1)')
+    args = parser.parse_args(sys.argv[1:])
+
+    results = run_benchmarks(
+        scenarios(sorted(glob.glob(args.settings)), args.backends,
+                  args.masks, args.coalesce), args.repeat)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'environment': environment(), 'results': results},
+                      output, indent = 1)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = report(compare(results, json.load(baseline)),
+                                 args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,63 @@
+import heapq
+
+class CooldownScheduler:
+    """ Molten particles queued by melting timeout, and movable ones. """
+    # a particle heated again gets a new heap entry, the old one is skipped
+    # when popped; particles are ordered by index, which is their position
+    # in SpringSimulator.particles
+    def __init__(self):
+        self._heap = []
+        self._timeouts = {}
+        self._movable = set()
+
+    def __len__(self):
+        # number of molten particles
+        return len(self._timeouts)
+
+    def clear(self):
+        self._heap = []
+        self._timeouts = {}
+        self._movable = set()
+
+    def rebuild(self, particles):
+        # from the molten, melting_timeout and movable flags of particles
+        self.clear()
+        for particle in particles:
+            if particle.molten:
+                self.heat(particle, particle.melting_timeout)
+            if particle.movable:
+                self._movable.add(particle)
+
+    def heat(self, particle, timeout):
+        self._timeouts[particle] = timeout
+        # a molten particle without a positive timeout stays molten until
+        # the final cooldown, as in run_pass
+        if timeout > 0:
+            heapq.heappush(self._heap, (timeout, particle.index, particle))
+        self._movable.add(particle)
+
+    def due(self, time):
+        # molten particles whose timeout has passed, taken off the queue
+        found = []
+        while self._heap and self._heap[0][0] <= time:
+            timeout, _, particle = heapq.heappop(self._heap)
+            if self._timeouts.get(particle) == timeout:
+                del self._timeouts[particle]
+                found.append(particle)
+        return found
+
+    def molten(self):
+        # all molten particles, taken off the queue
+        found = list(self._timeouts)
+        self._heap = []
+        self._timeouts = {}
+        return found
+
+    def move(self, particle):
+        self._movable.add(particle)
+
+    def settle(self, particle):
+        self._movable.discard(particle)
+
+    def movable(self):
+        return sorted(self._movable, key = lambda particle: particle.index)
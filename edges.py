@@ -0,0 +1,92 @@
+import numpy as np
+
+class EdgeIndex:
+    """ All springs by id, in creation order. """
+    # a spring is found from its ends by looking through the springs at
+    # one of them, so there is no separate key per spring. Springs of a
+    # ParticleStore are numbered by the store, others here; removed ones
+    # leave a hole until compact() closes them up
+    def __init__(self, store = None):
+        self._store = store
+        self._springs = []
+        self._count = 0
+
+    def __len__(self):
+        if self._store is not None:
+            return self._store.spring_count
+        return self._count
+
+    def __iter__(self):
+        if self._store is not None:
+            spring = self._store.spring
+            return (spring(index)
+                    for index in np.flatnonzero(self._store.alive).tolist())
+        return (spring for spring in self._springs if spring is not None)
+
+    @property
+    def next_index(self):
+        # id of the next spring added
+        if self._store is not None:
+            return self._store.edge_count
+        return len(self._springs)
+
+    def contains(self, p1, p2):
+        return self.get(p1, p2) is not None
+
+    def get(self, p1, p2):
+        if self._store is not None:
+            neighbours = self._store.adjacent(p1.index).tolist()
+            if not p2.index in neighbours:
+                return None
+            return self._store.spring(
+                self._store.incident(p1.index)[neighbours.index(p2.index)])
+        for spring, neighbour in p1.links:
+            if neighbour is p2:
+                return spring
+        return None
+
+    def spring(self, index):
+        if self._store is not None:
+            return self._store.spring(index)
+        return self._springs[index]
+
+    def add(self, spring):
+        if self._store is None:
+            self._springs.append(spring)
+            self._count += 1
+
+    def extend(self, springs):
+        # add for a list of springs numbered in order
+        if self._store is None:
+            self._springs.extend(springs)
+            self._count += len(springs)
+
+    def remove(self, spring):
+        if self._store is None and self._springs[spring.index] is spring:
+            self._springs[spring.index] = None
+            self._count -= 1
+
+    def compact(self):
+        # close up the holes of removed springs, keeping the order; returns
+        # the new id of each old one (-1 for removed ones), or None if no
+        # spring was removed
+        if self._store is not None:
+            return self._store.compact()
+        if self._count == len(self._springs):
+            return None
+        mapping = np.full(len(self._springs), -1, dtype = np.int64)
+        springs = []
+        for index, spring in enumerate(self._springs):
+            if spring is not None:
+                mapping[index] = len(springs)
+                spring.index = len(springs)
+                springs.append(spring)
+        self._springs = springs
+        return mapping
+
+    @property
+    def holes(self):
+        # slots of removed springs not yet closed up
+        if self._store is not None:
+            return self._store.edge_count - self._store.spring_count
+        return len(self._springs) - self._count
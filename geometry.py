@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 class Point:
     def __init__(self, x = 0, y = 0):
         self.x = x
@@ -7,7 +9,7 @@ class Point:
 
     def distance_to_line(self, line):
         perpendicular = abs(line.a * self.x + line.b * self.y + line.c) / \
-            math.sqrt(line.a * line.a + line.b * line.b + line.c * line.c)
+            math.sqrt(line.a * line.a + line.b * line.b)
         return perpendicular
 
 class Line:
@@ -67,3 +69,54 @@ def segments_intersect(p1, p2, p3, p4):
             in_second = (x - p3.x) * (x - p4.x) < 0
 
         return in_first and in_second
+
+# batched counterparts of the functions above over arrays of coordinates,
+# with the same line equations and epsilons; arguments broadcast, so
+# passing x1[:, None] and x2[None, :] gives all pairs of two sets
+
+def lines(x1, y1, x2, y2):
+    # coefficients a, b, c of Line for each pair of points
+    horizontal = y1 == y2
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        b = np.where(horizontal, 1.0, -(x2 - x1) / (y2 - y1))
+    a = np.where(horizontal, 0.0, 1.0)
+    c = np.where(horizontal, -y1, -x1 - b * y1)
+    return a, b, c
+
+def squared_distances(x1, y1, x2, y2):
+    return (x1 - x2) * (x1 - x2) + (y1 - y2) * (y1 - y2)
+
+def distances(x1, y1, x2, y2):
+    return np.sqrt(squared_distances(x1, y1, x2, y2))
+
+def line_distances(px, py, x1, y1, x2, y2):
+    # Point.distance_to_line of each point and the line through x1, y1
+    # and x2, y2
+    a, b, c = lines(x1, y1, x2, y2)
+    return np.abs(a * px + b * py + c) / np.sqrt(a * a + b * b)
+
+def segments_intersect_batch(x1, y1, x2, y2, x3, y3, x4, y4):
+    # segments_intersect of each pair of segments
+    a1, b1, c1 = lines(x1, y1, x2, y2)
+    a2, b2, c2 = lines(x3, y3, x4, y4)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        # parallel lines overlap if they are the same line
+        vertical_overlap = \
+            np.minimum(np.maximum(y1, y2), np.maximum(y3, y4)) > \
+            np.maximum(np.minimum(y1, y2), np.minimum(y3, y4))
+        same_line = np.abs(c2 / b2 - c1 / b1) < 1e-5
+        overlap = np.minimum(np.maximum(x1, x2), np.maximum(x3, x4)) > \
+                  np.maximum(np.minimum(x1, x2), np.minimum(x3, x4))
+        parallel_intersect = np.where(np.abs(b1) < 1e-5, vertical_overlap,
+                                      same_line & overlap)
+
+        # intersection point; Cramer's rule
+        D = a1 * b2 - b1 * a2
+        x = (b1 * c2 - c1 * b2) / D
+        y = (c1 * a2 - a1 * c2) / D
+        in_first = np.where(np.abs(b1) < 1e-5, (y - y1) * (y - y2) < 0,
+                            (x - x1) * (x - x2) < 0)
+        in_second = np.where(np.abs(b2) < 1e-5, (y - y3) * (y - y4) < 0,
+                             (x - x3) * (x - x4) < 0)
+    return np.where(np.abs(D) < 1e-5, parallel_intersect,
+                    in_first & in_second)
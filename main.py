@@ -6,6 +6,12 @@ import argparse
 from geometry import Point
 from settings import SimulatorSettings
 from simulator import SpringSimulator
+from backends import BACKENDS
+from sweep import parse_grid, run_sweep, sweep_runs
+from planner import PassPlanner, read_outline, write_moves
+from snapshot import is_snapshot, read_snapshot, write_snapshot, write_xml
+from trajectory import TrajectoryWriter
+from profiler import Profiler
 
 from PIL import Image
 
@@ -13,69 +19,169 @@ parser = argparse.ArgumentParser(description = 'Simulator control script',
              formatter_class = argparse.RawDescriptionHelpFormatter,
              epilog = '''\
 Example usage:
-  python main.py -c init -i mask.png -o initialized.xml
-  python main.py -c pass -i state.xml -p 0 0 50 50 100 40 -o newstate.xml
-  python main.py -c predict -i mask.png -t target.txt -o moves.txt''')
+  python main.py -c init -i mask.png -o initialized.snap
+  python main.py -c pass -i state.snap -p 0 0 50 50 100 40 -o newstate.snap
+  python main.py -c pass -i state.snap -p 0 0 50 50 -o newstate.xml
+  python main.py -c pass -i mask.png -p 0 0 50 50 -r pass.traj -k 50
+  python main.py -c pass -i mask.png -p 0 0 50 50 -P profile.json \\
+      -T trace.json
+  python main.py -c predict -i mask.png -t target.txt -w 3 -n 4 -l 600 \\
+      -o moves.txt
+  python main.py -c sweep -i mask.png -p 0 0 50 50 -s '*.cfg' \\
+      -g spring_default_stiffness=0.01,0.02 -j 8 -o runs.jsonl''')
 
 parser.add_argument('-c', dest = 'command',
-                    choices = ['init', 'pass', 'predict'],
+                    choices = ['init', 'pass', 'predict', 'sweep'],
                     help = 'command to run')
-parser.add_argument('-i', dest = 'input', help = 'input file (PNG or XML)')
+parser.add_argument('-i', dest = 'input',
+                    help = 'input file (PNG or state snapshot)')
 parser.add_argument('-p', dest = 'params', help = 'laser pass coordinates',
                     nargs = '+', type = int)
 parser.add_argument('-t', dest = 'target',
                     help = 'target file (shape outline XY coordinates)')
-parser.add_argument('-s', dest = 'settings', help = 'settings file')
+parser.add_argument('-s', dest = 'settings',
+                    help = 'settings file (glob pattern for sweep)')
 parser.add_argument('-o', dest = 'output',
-                    help = 'output file (moves for predict, XML for pass)')
+                    help = 'output file (moves for predict, state snapshot '
+                           'or .xml for init and pass)')
+parser.add_argument('-b', dest = 'backend', choices = list(BACKENDS),
+                    help = 'compute backend (overrides the settings file)')
+parser.add_argument('-g', dest = 'grid', nargs = '+', default = [],
+                    help = 'sweep parameter grid, as setting=value,value')
+parser.add_argument('-j', dest = 'processes', type = int,
+                    help = 'sweep processes (default: all cores)')
+parser.add_argument('-r', dest = 'trajectory',
+                    help = 'trajectory file recording every tick of pass')
+parser.add_argument('-k', dest = 'keyframe_interval', type = int, default = 50,
+                    help = 'trajectory ticks between keyframes (default: 50)')
+parser.add_argument('-P', dest = 'profile',
+                    help = 'per-tick phase timers and counters (JSON)')
+parser.add_argument('-T', dest = 'trace',
+                    help = 'per-tick phase trace (Chrome trace JSON)')
+parser.add_argument('-w', dest = 'beam_width', type = int, default = 3,
+                    help = 'predict beam width (default: 3)')
+parser.add_argument('-n', dest = 'max_passes', type = int, default = 5,
+                    help = 'predict maximum number of passes (default: 5)')
+parser.add_argument('-l', dest = 'time_budget', type = float,
+                    help = 'predict time budget in seconds (default: none)')
 
 args = parser.parse_args(sys.argv[1:])
 
-if args.command:
-    if args.settings:
-        settings = SimulatorSettings(args.settings)
-        sim = SpringSimulator(settings)
+def pass_points(params):
+    if not params:
+        print("Error: no coordinates of laser pass provided (use -p)")
+        sys.exit()
+    count = len(params)
+    if count < 4:
+        print("Error: too few coordinates provided (at least 2 points)")
+        sys.exit()
+    if count & 1:
+        print("Error: odd number of coordinates provided (2 per point)")
+        sys.exit()
+    return [Point(x, y) for x, y in zip(params[::2], params[1::2])]
+
+if args.command == 'sweep':
+    if not args.input:
+        print("Error: no input file provided to initialize from")
+        sys.exit()
+    points = pass_points(args.params)
+    try:
+        runs = sweep_runs([args.settings] if args.settings else [],
+                          parse_grid(args.grid))
+    except ValueError as error:
+        print("Error: %s" % error)
+        sys.exit()
+    for run in runs:
+        if args.backend:
+            run[2].backend = args.backend
+    if args.output:
+        with open(args.output, 'w') as output:
+            run_sweep(args.input, points, runs, output, args.processes)
     else:
-        sim = SpringSimulator()
-        print("Warning: no settings file provided, using default (use -s)")
+        run_sweep(args.input, points, runs, sys.stdout, args.processes)
+
+elif args.command:
+    if not args.input:
+        print("Error: no input file provided to initialize from")
+        sys.exit()
 
-    if args.input:
+    state = None
+    settings = None
+    if is_snapshot(args.input):
         try:
-            image = Image.open(args.input)
-            pixels = image.load()
-            sim.initialize_from_image(image)
-        except:
+            state, settings = read_snapshot(args.input)
+        except (OSError, ValueError, KeyError):
             print("Error: failed reading input file")
             sys.exit()
-    else:
-        print("Error: no input file provided to initialize from")
-        sys.exit()
-    
-    if args.command == 'pass':
-        if args.params:
-            count = len(args.params)
-            if count < 4:
-                print("Error: too few coordinates provided (at least 2 points)")
-                sys.exit()
-            if count & 1:
-                print("Error: odd number of coordinates provided (2 per point)")
+    # a settings file overrides the ones saved with a snapshot
+    if args.settings:
+        settings = SimulatorSettings(args.settings)
+    elif not settings:
+        settings = SimulatorSettings()
+        print("Warning: no settings file provided, using default (use -s)")
+    if args.backend:
+        settings.backend = args.backend
+    sim = SpringSimulator(settings)
+    # the trajectory is flushed, relaxation workers stopped and shared
+    # memory freed also when a command fails
+    try:
+        if state is not None:
+            sim.load_state(state)
+        else:
+            try:
+                image = Image.open(args.input)
+                pixels = image.load()
+                sim.initialize_from_image(image)
+            except:
+                print("Error: failed reading input file")
                 sys.exit()
-            points = [Point(x, y) for x, y in zip(args.params[::2],
-                                                  args.params[1::2])]
+
+        if args.profile or args.trace:
+            sim.profiler = Profiler()
+
+        if args.command == 'pass':
+            points = pass_points(args.params)
+            if args.trajectory:
+                sim.recorder = TrajectoryWriter(args.trajectory,
+                                                args.keyframe_interval)
             sim.run_linear_passes(points)
-        else:
-            print("Error: no coordinates of laser pass provided (use -p)")
-            sys.exit()
 
-    if args.output:
-        if args.command in ('pass', 'init'):
-            # todo: output xml
-            pass
-        elif args.command == 'predict':
-            # todo: output moves
-            pass
-    if not args.output:
-        print("Warning: no output file provided (use -o)")
+        if args.command == 'predict':
+            if not args.target:
+                print("Error: no target file provided (use -t)")
+                sys.exit()
+            try:
+                outline = read_outline(args.target)
+            except (OSError, ValueError):
+                print("Error: failed reading target file")
+                sys.exit()
+            planner = PassPlanner(sim, outline, beam_width = args.beam_width,
+                                  max_passes = args.max_passes,
+                                  time_budget = args.time_budget)
+            moves, score = planner.search()
+            print("%d passes, score %.3f, %d evaluated" %
+                  (len(moves), score, planner.evaluated))
+
+        if args.profile:
+            sim.profiler.write_json(args.profile)
+        if args.trace:
+            sim.profiler.write_trace(args.trace)
+
+        if args.output:
+            if args.command in ('pass', 'init'):
+                if args.output.lower().endswith('.xml'):
+                    write_xml(args.output, sim.save_state(), sim.settings)
+                else:
+                    write_snapshot(args.output, sim.save_state(), sim.settings)
+            elif args.command == 'predict':
+                with open(args.output, 'w') as output:
+                    write_moves(planner.moves(moves), output)
+        if not args.output:
+            print("Warning: no output file provided (use -o)")
+    finally:
+        if sim.recorder is not None:
+            sim.recorder.close()
+        sim.close()
 
 else:
     print("No command provided (use -c)")
@@ -0,0 +1,164 @@
+from math import atan2
+
+class HalfEdgeMesh:
+    """ Planar embedding of the spring graph as half-edges and faces. """
+    # every spring (u, v) is a pair of half-edges (u, v) and (v, u); the
+    # neighbours of a particle are kept in counter-clockwise order, and the
+    # half-edge following (u, v) around its face is (v, w), w being the
+    # neighbour of v just clockwise of u; bounded faces are then traced
+    # counter-clockwise and the outer face clockwise
+    def __init__(self, particles):
+        self._rotation = {}
+        self._face_of = {}
+        self._faces = {}
+        self._next_face = 0
+        self._particles = list(particles)
+        self.rebuild()
+
+    def rebuild(self):
+        # recompute the embedding from the current particle positions
+        self._rotation = {}
+        self._face_of = {}
+        self._faces = {}
+        for particle in self._particles:
+            self._rotation[particle] = sorted(
+                particle.neighbours, key = lambda neighbour:
+                atan2(neighbour.y - particle.y, neighbour.x - particle.x))
+        for particle, neighbours in self._rotation.items():
+            for neighbour in neighbours:
+                if not (particle, neighbour) in self._face_of:
+                    self._trace((particle, neighbour))
+
+    @property
+    def faces(self):
+        # face id -> list of half-edges in traversal order
+        return self._faces
+
+    def face(self, u, v):
+        # id of the face to the left of the half-edge (u, v)
+        return self._face_of.get((u, v))
+
+    def face_length(self, face):
+        return len(self._faces[face])
+
+    def face_particles(self, face):
+        return [half_edge[0] for half_edge in self._faces[face]]
+
+    def _next(self, half_edge):
+        u, v = half_edge
+        rotation = self._rotation[v]
+        return (v, rotation[rotation.index(u) - 1])
+
+    def _trace(self, start):
+        face = self._next_face
+        self._next_face += 1
+        half_edges = []
+        half_edge = start
+        while True:
+            half_edges.append(half_edge)
+            self._face_of[half_edge] = face
+            half_edge = self._next(half_edge)
+            if half_edge == start:
+                break
+        self._faces[face] = half_edges
+        return face
+
+    def _insert_rotation(self, particle, neighbour):
+        rotation = self._rotation.setdefault(particle, [])
+        angle = atan2(neighbour.y - particle.y, neighbour.x - particle.x)
+        position = 0
+        while position < len(rotation) and \
+              atan2(rotation[position].y - particle.y,
+                    rotation[position].x - particle.x) < angle:
+            position += 1
+        rotation.insert(position, neighbour)
+        # the neighbour now just counter-clockwise of the new one
+        if len(rotation) > 1:
+            return rotation[(position + 1) % len(rotation)]
+        return None
+
+    def add_edge(self, u, v):
+        if not u in self._rotation:
+            self._particles.append(u)
+        if not v in self._rotation:
+            self._particles.append(v)
+        after_u = self._insert_rotation(u, v)
+        after_v = self._insert_rotation(v, u)
+        if after_u is None or after_v is None:
+            # an end was isolated, the edge joins a face from outside
+            self.rebuild()
+            return
+        # the new edge splits the face holding the corners it is put into;
+        # if those are in different faces the edge crosses another one and
+        # the embedding has to be recomputed
+        face = self._face_of[(after_u, u)]
+        if self._face_of[(after_v, v)] != face:
+            self.rebuild()
+            return
+        for half_edge in self._faces.pop(face):
+            del self._face_of[half_edge]
+        self._trace((u, v))
+        if not (v, u) in self._face_of:
+            self._trace((v, u))
+
+    def remove_edge(self, u, v):
+        face1 = self._face_of.pop((u, v))
+        face2 = self._face_of.pop((v, u))
+        half_edges1 = self._faces.pop(face1)
+        half_edges2 = self._faces.pop(face2, None)
+        self._rotation[u].remove(v)
+        self._rotation[v].remove(u)
+
+        if face1 != face2:
+            # local merge of the two adjacent faces into one
+            first = half_edges1.index((u, v))
+            second = half_edges2.index((v, u))
+            merged = half_edges1[first + 1:] + half_edges1[:first] + \
+                     half_edges2[second + 1:] + half_edges2[:second]
+            for half_edge in half_edges2:
+                if half_edge in self._face_of:
+                    self._face_of[half_edge] = face1
+            if merged:
+                self._faces[face1] = merged
+        else:
+            # a bridge, its face falls apart into the walks on either side
+            for half_edge in half_edges1:
+                self._face_of.pop(half_edge, None)
+            for half_edge in half_edges1:
+                if half_edge != (u, v) and half_edge != (v, u) and \
+                   not half_edge in self._face_of:
+                    self._trace(half_edge)
+
+    def merged_face_length(self, u, v):
+        # length of the face that removing spring (u, v) would open
+        face1 = self._face_of[(u, v)]
+        face2 = self._face_of[(v, u)]
+        if face1 == face2:
+            return len(self._faces[face1]) - 2
+        return len(self._faces[face1]) + len(self._faces[face2]) - 2
+
+    def shortest_detour(self, u, v):
+        # particles on the shorter way around a face adjacent to (u, v),
+        # from v back to u, or None for a bridge
+        face1 = self._face_of[(u, v)]
+        face2 = self._face_of[(v, u)]
+        if face1 == face2:
+            return None
+        if len(self._faces[face1]) <= len(self._faces[face2]):
+            half_edges = self._faces[face1]
+            start = half_edges.index((u, v))
+            walk = half_edges[start + 1:] + half_edges[:start]
+            return [half_edge[0] for half_edge in walk] + [u]
+        half_edges = self._faces[face2]
+        start = half_edges.index((v, u))
+        walk = half_edges[start + 1:] + half_edges[:start]
+        return [half_edge[1] for half_edge in reversed(walk)] + [u]
+
+    def triangles(self, particle):
+        # opposite sides of the triangular faces around a particle
+        sides = []
+        for neighbour in self._rotation.get(particle, ()):
+            half_edges = self._faces[self._face_of[(particle, neighbour)]]
+            if len(half_edges) == 3:
+                sides.append((neighbour, self._next((particle, neighbour))[1]))
+        return sides
@@ -0,0 +1,164 @@
+import numpy as np
+
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:
+    scipy = None
+
+# implicit relaxation: damped Newton steps on the spring energy implied by
+# Spring.update_force. With L the actual length of a spring (distance less
+# both radii), l its rest length and k the stiffness, the force is
+#   f = k * l^2 / 2 * (1 / L - 1 / l)   when compressed (L < l),
+#   f = k * (l - L)                     otherwise,
+# pushing the ends apart when positive, so the energy E(L) has E' = -f and
+#   E = k * l^2 / 2 * (L / l - 1 - log(L / l))   when compressed,
+#   E = k / 2 * (L - l)^2                         otherwise.
+
+def spring_energy(actual_length, length, stiffness):
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        compressed = stiffness * length * length / 2 * \
+            (actual_length / length - 1 - np.log(actual_length / length))
+    stretched = stiffness / 2 * (actual_length - length) ** 2
+    return np.where(actual_length < length, compressed, stretched)
+
+def _spring_terms(x, y, radii, ends, length, stiffness):
+    # unit vectors from the second end to the first, distances, and the
+    # first and second derivatives of the energy by the distance
+    delta_x = x[ends[:, 0]] - x[ends[:, 1]]
+    delta_y = y[ends[:, 0]] - y[ends[:, 1]]
+    distance = np.hypot(delta_x, delta_y)
+    actual_length = distance - radii[ends[:, 0]] - radii[ends[:, 1]]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        unit_x = delta_x / distance
+        unit_y = delta_y / distance
+        compressed = actual_length < length
+        slope = np.where(compressed,
+                         -(1 / actual_length - 1 / length) *
+                         stiffness * length * length / 2,
+                         -stiffness * (length - actual_length))
+        curvature = np.where(compressed,
+                             stiffness * length * length /
+                             (2 * actual_length * actual_length),
+                             stiffness)
+    return unit_x, unit_y, distance, actual_length, slope, curvature
+
+class NewtonSolver:
+    """ Damped Newton steps on the spring energy of movable particles. """
+    # the Hessian is assembled over the movable particles only, their
+    # springs to fixed particles pin them in place; a step is scaled to
+    # the largest explicit move and halved until it lowers the energy
+    # without inverting a triangle, otherwise step returns None and the
+    # explicit step is taken instead
+    def __init__(self, settings, halvings = 6):
+        self._settings = settings
+        self._halvings = halvings
+
+    @staticmethod
+    def available():
+        return scipy is not None
+
+    def step(self, x, y, radii, movable, ends, length, triangles):
+        # displacements of the movable particle ids, or None; ends and
+        # triangles are the springs and triangles at movable particles,
+        # others are left out
+        stiffness = self._settings.spring_default_stiffness
+        count = len(movable)
+        if count == 0:
+            return np.zeros(0), np.zeros(0)
+        # the particles involved, numbered compactly, so a step costs the
+        # same however large the field around them is
+        ids = np.unique(np.concatenate((movable, ends.ravel(),
+                                        triangles.ravel())))
+        x = x[ids]
+        y = y[ids]
+        radii = radii[ids]
+        movable = np.searchsorted(ids, movable)
+        ends = np.searchsorted(ids, ends)
+        triangles = np.searchsorted(ids, triangles)
+        local = np.full(len(x), -1, dtype = np.int64)
+        local[movable] = np.arange(count)
+        involved = (local[ends] >= 0).any(axis = 1)
+        ends = ends[involved]
+        length = length[involved]
+        unit_x, unit_y, distance, actual_length, slope, curvature = \
+            _spring_terms(x, y, radii, ends, length, stiffness)
+        if not np.isfinite(slope).all() or (distance < 1e-5).any():
+            return None
+
+        # gradient of the energy, and its Hessian with the negative
+        # curvature across compressed springs left out, so that it stays
+        # positive semi-definite and the step goes downhill
+        first = local[ends[:, 0]]
+        second = local[ends[:, 1]]
+        gradient = np.zeros((count, 2))
+        for ids, sign in ((first, 1), (second, -1)):
+            mine = ids >= 0
+            np.add.at(gradient[:, 0], ids[mine], sign * slope[mine] *
+                      unit_x[mine])
+            np.add.at(gradient[:, 1], ids[mine], sign * slope[mine] *
+                      unit_y[mine])
+        across = np.maximum(slope / distance, 0)
+        uu = np.stack((unit_x * unit_x, unit_x * unit_y,
+                       unit_x * unit_y, unit_y * unit_y), axis = 1)
+        identity = np.array([1.0, 0.0, 0.0, 1.0])
+        blocks = curvature[:, None] * uu + \
+                 across[:, None] * (identity[None, :] - uu)
+
+        rows = []
+        columns = []
+        values = []
+        component_rows = np.array([0, 0, 1, 1])
+        component_columns = np.array([0, 1, 0, 1])
+        for row_ids, column_ids, sign in ((first, first, 1),
+                                          (second, second, 1),
+                                          (first, second, -1),
+                                          (second, first, -1)):
+            mine = (row_ids >= 0) & (column_ids >= 0)
+            rows.append((2 * row_ids[mine, None] +
+                         component_rows[None, :]).ravel())
+            columns.append((2 * column_ids[mine, None] +
+                            component_columns[None, :]).ravel())
+            values.append((sign * blocks[mine]).ravel())
+        # a little regularization for particles free to slide
+        rows.append(np.arange(2 * count))
+        columns.append(np.arange(2 * count))
+        values.append(np.full(2 * count, 1e-6 * stiffness))
+        hessian = scipy.sparse.csr_matrix(
+            (np.concatenate(values),
+             (np.concatenate(rows), np.concatenate(columns))),
+            shape = (2 * count, 2 * count))
+        direction = scipy.sparse.linalg.spsolve(hessian, -gradient.ravel())
+        if not np.isfinite(direction).all():
+            return None
+        direction = direction.reshape(count, 2)
+
+        # no particle moves further than an explicit step could
+        max_move = self._settings.spring_default_length / 4
+        largest = np.hypot(direction[:, 0], direction[:, 1]).max()
+        scale = min(1.0, max_move / largest) if largest > 0 else 1.0
+
+        energy = spring_energy(actual_length, length, stiffness).sum()
+        corners = triangles[(local[triangles] >= 0).any(axis = 1)]
+        area = self._areas(x, y, corners)
+        for _ in range(self._halvings):
+            new_x = x.copy()
+            new_y = y.copy()
+            new_x[movable] += scale * direction[:, 0]
+            new_y[movable] += scale * direction[:, 1]
+            new_length = np.hypot(new_x[ends[:, 0]] - new_x[ends[:, 1]],
+                                  new_y[ends[:, 0]] - new_y[ends[:, 1]]) - \
+                         radii[ends[:, 0]] - radii[ends[:, 1]]
+            if (new_length > 0).all() and \
+               (np.sign(self._areas(new_x, new_y, corners)) ==
+                np.sign(area)).all() and \
+               spring_energy(new_length, length, stiffness).sum() <= energy:
+                return scale * direction[:, 0], scale * direction[:, 1]
+            scale /= 2
+        return None
+
+    @staticmethod
+    def _areas(x, y, triangles):
+        # signed areas of triangles (twice, which does not matter here)
+        a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+        return (x[b] - x[a]) * (y[c] - y[a]) - (x[c] - x[a]) * (y[b] - y[a])
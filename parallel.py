@@ -0,0 +1,202 @@
+import numpy as np
+
+from multiprocessing import Pipe, Process, shared_memory
+
+from relaxation import RelaxationKernel, displacements, spring_force_arrays
+
+def _worker(connection):
+    # relaxes one subdomain: reads positions, molten flags and forces of
+    # all particles (halo included) straight from the shared store arrays
+    # and writes the displacements of its own particles back, and the
+    # forces of the springs it owns
+    blocks = {}
+    arrays = {}
+    subdomain = None
+    while True:
+        command, payload = connection.recv()
+        if command == 'attach':
+            for name, (block_name, shape, dtype) in payload.items():
+                if name in blocks and blocks[name].name == block_name:
+                    continue
+                arrays.pop(name, None)
+                if name in blocks:
+                    blocks.pop(name).close()
+                # workers share the resource tracker of the simulator
+                # process, which unlinks the blocks once the store frees them
+                blocks[name] = shared_memory.SharedMemory(name = block_name)
+                arrays[name] = np.frombuffer(
+                    blocks[name].buf, dtype = dtype,
+                    count = int(np.prod(shape))).reshape(shape)
+        elif command == 'setup':
+            subdomain = payload
+        elif command == 'forces':
+            radius, molten_radius, max_move, stiffness, incidence, springs = \
+                subdomain
+            radii = np.where(arrays['molten'], molten_radius, radius)
+            spring_force_arrays(
+                arrays['x'], arrays['y'], radii, arrays['edges'],
+                arrays['rest_length'], stiffness,
+                springs[arrays['dirty'][springs]], arrays['force'],
+                arrays['actual_length'], arrays['dirty'])
+            connection.send(True)
+        elif command == 'step':
+            radius, molten_radius, max_move, stiffness, incidence, springs = \
+                subdomain
+            radii = np.where(arrays['molten'], molten_radius, radius)
+            x_displacement, y_displacement = displacements(
+                arrays['x'], arrays['y'], radii, arrays['force'],
+                *incidence, max_move = max_move)
+            movable = incidence[0]
+            arrays['dx'][movable] = x_displacement
+            arrays['dy'][movable] = y_displacement
+            connection.send(True)
+        elif command == 'stop':
+            arrays.clear()
+            for block in blocks.values():
+                block.close()
+            connection.send(True)
+            return
+
+class WorkerPool:
+    """ Worker processes for domain-decomposed relaxation. """
+    def __init__(self, processes):
+        self._connections = []
+        self._processes = []
+        for _ in range(processes):
+            connection, worker_connection = Pipe()
+            process = Process(target = _worker, args = (worker_connection,),
+                              daemon = True)
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+        self._attached = None
+
+    def __len__(self):
+        return len(self._processes)
+
+    def attach(self, store):
+        # (re)attach workers to the store arrays, which move on growth
+        arrays = store.shared_arrays()
+        if arrays != self._attached:
+            for connection in self._connections:
+                connection.send(('attach', arrays))
+            self._attached = arrays
+
+    def setup(self, worker, subdomain):
+        self._connections[worker].send(('setup', subdomain))
+
+    def run(self, command, workers):
+        for worker in workers:
+            self._connections[worker].send((command, None))
+        for worker in workers:
+            self._connections[worker].recv()
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(('stop', None))
+        for connection, process in zip(self._connections, self._processes):
+            connection.recv()
+            process.join()
+        self._connections = []
+        self._processes = []
+
+class ParallelRelaxation:
+    """ RelaxationKernel with the force and displacement steps split over
+    processes. """
+    # the movable particles are cut into strips of equal size along the
+    # longer side of their bounding box; each worker computes the
+    # displacements of one strip, reading its halo (neighbours in other
+    # strips) from shared memory, and the forces of the springs at the
+    # strip not already owned by an earlier strip. The moves are applied
+    # here once all strips are done, so results are the same as for the
+    # serial kernel. Each step costs two round trips to every worker, so
+    # it only pays off for large heated regions; below MIN_PARTICLES
+    # movable particles the simulator keeps to the serial kernel
+    MIN_PARTICLES = 20000
+
+    def __init__(self, store, settings, movable, pool):
+        self._store = store
+        self._settings = settings
+        self._pool = pool
+        self._kernel = RelaxationKernel(store, settings, movable)
+
+        movable = self._kernel.movable
+        x = store.x[movable]
+        y = store.y[movable]
+        axis = x if len(movable) and np.ptp(x) >= np.ptp(y) else y
+        self._strips = np.array_split(np.argsort(axis, kind = 'stable'),
+                                      len(pool))
+        self._kernels = [RelaxationKernel(store, settings, movable[strip])
+                         for strip in self._strips]
+        self._versions = [None] * len(pool)
+        self._springs = [None] * len(pool)
+        self._springs_version = None
+        self._active = np.ones(len(movable), dtype = bool)
+
+    @property
+    def movable(self):
+        return self._kernel.movable
+
+    @property
+    def moves(self):
+        return self._kernel.moves
+
+    def set_active(self, active):
+        if np.array_equal(active, self._active):
+            return
+        self._kernel.set_active(active)
+        for kernel, strip in zip(self._kernels, self._strips):
+            kernel.set_active(np.asarray(active)[strip])
+        self._active = np.array(active, dtype = bool)
+        self._versions = [None] * len(self._kernels)
+
+    def neighbours(self, local_ids):
+        return self._kernel.neighbours(local_ids)
+
+    def local(self, indices):
+        return self._kernel.local(indices)
+
+    def _owned_springs(self):
+        # every spring at a movable particle goes to the first strip it
+        # touches, so each force is computed once
+        version = self._store.topology_version
+        if version == self._springs_version:
+            return
+        taken = np.zeros(self._store.edge_count, dtype = bool)
+        for worker, kernel in enumerate(self._kernels):
+            springs = kernel.incident_springs
+            self._springs[worker] = springs[~taken[springs]]
+            taken[springs] = True
+        self._springs_version = version
+
+    def _setup(self):
+        # attach to the store arrays and resend the subdomains whose
+        # topology or active set changed
+        self._pool.attach(self._store)
+        self._owned_springs()
+        version = self._store.topology_version
+        for worker, kernel in enumerate(self._kernels):
+            if version != self._versions[worker]:
+                self._pool.setup(worker, (
+                    self._settings.particle_default_radius,
+                    self._settings.molten_particle_default_radius,
+                    self._settings.spring_default_length / 4,
+                    self._settings.spring_default_stiffness,
+                    kernel.incidence(), self._springs[worker]))
+                self._versions[worker] = version
+
+    def step(self):
+        self._setup()
+        self._pool.run('step', [worker for worker, kernel
+                                in enumerate(self._kernels)
+                                if len(kernel.movable)])
+
+        movable = self._kernel.movable
+        x_displacement = np.where(self._active, self._store.dx[movable], 0)
+        y_displacement = np.where(self._active, self._store.dy[movable], 0)
+        return self._kernel.apply(x_displacement, y_displacement)
+
+    def update_forces(self):
+        self._setup()
+        self._pool.run('forces', [worker for worker, springs
+                                  in enumerate(self._springs) if len(springs)])
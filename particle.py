@@ -1,9 +1,13 @@
 from geometry import Point
 
 class Particle:
-    def __init__(self, settings, x = 0, y = 0):
+    __slots__ = ('_x', '_y', '_index', '_settings', '_displacement',
+                 '_molten', '_melting_timeout', '_movable', '_springs')
+
+    def __init__(self, settings, x = 0, y = 0, index = None):
         self._x = x
         self._y = y
+        self._index = index
         self._settings = settings
 
         self._displacement = Point()
@@ -11,14 +15,19 @@ class Particle:
         self._melting_timeout = 0
         self._movable = False
 
-        self._springs = []
+        # spring -> particle at its other end, in attachment order
+        self._springs = {}
 
     def __del__(self):
-        for spring in self._springs:
-            spring.other_end(self).springs.remove(spring)
-            del spring
+        for spring, neighbour in self._springs.items():
+            neighbour.detach_spring(spring)
         self._springs.clear()
 
+    # id used to key springs by their ends, assigned by the simulator
+    @property
+    def index(self):
+        return self._index
+
     @property
     def point(self):
         return Point(self._x, self._y)
@@ -45,8 +54,14 @@ class Particle:
         self._displacement = Point(vector.x, vector.y)
 
     def apply_displacement(self):
-        self._x += self._displacement.x
-        self._y += self._displacement.y
+        if self._displacement.x or self._displacement.y:
+            self._x += self._displacement.x
+            self._y += self._displacement.y
+            self.invalidate_springs()
+
+    def invalidate_springs(self):
+        for spring in self._springs:
+            spring.invalidate()
 
     # molten implies larger radius; mobility is set separately
     @property
@@ -55,7 +70,9 @@ class Particle:
 
     @molten.setter
     def molten(self, is_molten):
-        self._molten = is_molten
+        if self._molten != is_molten:
+            self._molten = is_molten
+            self.invalidate_springs()
         if not is_molten:
             self.melting_timeout = -1
 
@@ -78,7 +95,22 @@ class Particle:
 
     @property
     def springs(self):
-        return self._springs
+        return self._springs.keys()
+
+    @property
+    def neighbours(self):
+        return self._springs.values()
+
+    # (spring, particle at its other end) pairs
+    @property
+    def links(self):
+        return self._springs.items()
+
+    def attach_spring(self, spring, neighbour):
+        self._springs[spring] = neighbour
+
+    def detach_spring(self, spring):
+        del self._springs[spring]
 
     @property
     def settings(self):
@@ -87,4 +119,5 @@ class Particle:
     @settings.setter
     def settings(self, new_settings):
         self._settings = new_settings
+        self.invalidate_springs()
 
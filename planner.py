@@ -0,0 +1,219 @@
+import contextlib
+import heapq
+import math
+import os
+import time
+
+import numpy as np
+
+from geometry import Point, squared_distances
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# pairs of points and outline vertices or segments compared at a time,
+# which bounds the memory of the pairwise arrays
+_CHUNK = 1 << 20
+
+def read_outline(filename):
+    # target shape outline, one "x y" pair per line
+    points = []
+    with open(filename) as target:
+        for line in target:
+            values = line.replace(',', ' ').split()
+            if len(values) >= 2:
+                points.append((float(values[0]), float(values[1])))
+    if len(points) < 3:
+        raise ValueError("Too few outline points in %s" % filename)
+    return np.array(points, dtype = np.float64)
+
+def write_moves(passes, output):
+    # one pass per line, as the "-p" coordinates of the pass command
+    for start, finish in passes:
+        output.write("%g %g %g %g\n" % (start.x, start.y,
+                                         finish.x, finish.y))
+
+def _chunks(points, targets):
+    # slices of points to compare with all of targets at once
+    step = max(1, _CHUNK // max(len(targets), 1))
+    return [slice(begin, begin + step)
+            for begin in range(0, len(points), step)]
+
+def _nearest_distances(points, targets):
+    # distance from each point to the nearest of targets
+    if cKDTree is not None:
+        return cKDTree(targets).query(points)[0]
+    nearest = np.empty(len(points))
+    for chunk in _chunks(points, targets):
+        nearest[chunk] = squared_distances(
+            points[chunk, 0, None], points[chunk, 1, None],
+            targets[:, 0], targets[:, 1]).min(axis = 1)
+    return np.sqrt(nearest)
+
+def _segment_distances(points, outline):
+    # distance from each point to the closed outline polyline
+    a = outline
+    b = np.roll(outline, -1, axis = 0)
+    ab = b - a
+    lengths = np.maximum((ab * ab).sum(axis = 1), 1e-12)
+    nearest = np.empty(len(points))
+    for chunk in _chunks(points, outline):
+        ap = points[chunk, None, :] - a[None, :, :]
+        t = np.clip((ap * ab[None, :, :]).sum(axis = 2) / lengths, 0, 1)
+        closest = a[None, :, :] + t[:, :, None] * ab[None, :, :]
+        nearest[chunk] = ((points[chunk, None, :] - closest) ** 2) \
+                         .sum(axis = 2).min(axis = 1)
+    return np.sqrt(nearest)
+
+def outline_score(state, outline):
+    # symmetric outline mismatch, lower is better: how far the target
+    # outline is from the particles, and how far the boundary particles
+    # (fewer than the 6 springs of the inside of the lattice) are from it
+    particles = np.stack((state.x, state.y), axis = 1)
+    if not len(particles):
+        return math.inf
+    degree = np.bincount(state.springs.ravel(),
+                         minlength = state.particle_count)
+    boundary = particles[degree < 6]
+    if not len(boundary):
+        boundary = particles
+    return float(_nearest_distances(outline, particles).mean() +
+                 _segment_distances(boundary, outline).mean())
+
+def candidate_passes(state, heater_size, angles = 8, offsets = 5):
+    # straight chords across the field at evenly spaced angles, each set of
+    # parallel chords spread over the field extent; the heater starts and
+    # ends outside of the field
+    x_min, x_max = float(state.x.min()), float(state.x.max())
+    y_min, y_max = float(state.y.min()), float(state.y.max())
+    centre_x = (x_min + x_max) / 2
+    centre_y = (y_min + y_max) / 2
+    reach = math.hypot(x_max - x_min, y_max - y_min) / 2 + heater_size
+    passes = []
+    for i in range(angles):
+        angle = math.pi * i / angles
+        dx, dy = math.cos(angle), math.sin(angle)
+        # half extent of the field across the chord direction
+        spread = (abs(dy) * (x_max - x_min) + abs(dx) * (y_max - y_min)) / 2
+        for j in range(offsets):
+            offset = spread * ((2 * j + 1) / offsets - 1)
+            x = centre_x - dy * offset
+            y = centre_y + dx * offset
+            passes.append((Point(x - dx * reach, y - dy * reach),
+                           Point(x + dx * reach, y + dy * reach)))
+    return passes
+
+class _OutOfTime(Exception):
+    pass
+
+class PassPlanner:
+    """ Beam search over laser passes towards a target outline. """
+    # every evaluated pass prefix keeps the simulator state after it, so a
+    # candidate is one pass run from its parent's snapshot rather than a
+    # replay of the whole prefix from the initial mask
+    def __init__(self, simulator, outline, candidates = None, beam_width = 3,
+                 max_passes = 5, time_budget = None):
+        self._simulator = simulator
+        self._outline = outline
+        self._initial = simulator.save_state()
+        self._candidates = candidates if candidates is not None else \
+            candidate_passes(self._initial, simulator.settings.heater_size)
+        self._beam_width = beam_width
+        self._max_passes = max_passes
+        self._time_budget = time_budget
+        # pass prefix (tuple of candidate numbers) -> (score, state)
+        self._cache = {(): (outline_score(self._initial, outline),
+                            self._initial)}
+        self._evaluated = 0
+        # perf_counter() time the running search has to end by, or None
+        self._deadline = None
+
+    @property
+    def candidates(self):
+        return self._candidates
+
+    @property
+    def evaluated(self):
+        # passes simulated so far, one per evaluated prefix
+        return self._evaluated
+
+    def moves(self, prefix):
+        return [self._candidates[i] for i in prefix]
+
+    def _evaluate(self, prefix):
+        # score of the prefix, None if the time budget ran out while its
+        # last pass was being simulated
+        if prefix in self._cache:
+            return self._cache[prefix][0]
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            return None
+        parent_score, parent = self._cache[prefix[:-1]]
+        simulator = self._simulator
+        simulator.load_state(parent)
+        callback = simulator.tick_callback
+        if self._deadline is not None:
+            # checked every tick, a single pass may outlast the budget
+            def check_deadline(simulator):
+                if callback is not None:
+                    callback(simulator)
+                if time.perf_counter() > self._deadline:
+                    raise _OutOfTime()
+            simulator.tick_callback = check_deadline
+        try:
+            with open(os.devnull, 'w') as devnull, \
+                 contextlib.redirect_stdout(devnull):
+                start, finish = self._candidates[prefix[-1]]
+                simulator.run_linear_passes([start, finish])
+        except _OutOfTime:
+            return None
+        finally:
+            simulator.tick_callback = callback
+        state = simulator.save_state()
+        score = outline_score(state, self._outline)
+        self._cache[prefix] = (score, state)
+        self._evaluated += 1
+        return score
+
+    def search(self):
+        # returns (best prefix, its score); the simulator is left in the
+        # state after the best prefix
+        if self._time_budget is not None:
+            self._deadline = time.perf_counter() + self._time_budget
+        best = ()
+        best_score = self._cache[()][0]
+        beam = [()]
+        out_of_time = False
+        for depth in range(self._max_passes):
+            scored = []
+            for prefix in beam:
+                for i in range(len(self._candidates)):
+                    child = prefix + (i,)
+                    score = self._evaluate(child)
+                    if score is None:
+                        out_of_time = True
+                        break
+                    scored.append((score, child))
+                if out_of_time:
+                    break
+            if not scored:
+                break
+            beam = [child for _, child in
+                    heapq.nsmallest(self._beam_width, scored)]
+            depth_score, depth_best = min(scored)
+            if depth_score < best_score:
+                best_score, best = depth_score, depth_best
+            else:
+                # no prefix of this length beats a shorter one
+                break
+            if out_of_time:
+                break
+            # only the beam is extended further, drop the other snapshots
+            keep = set(beam) | {best, ()}
+            for prefix in [prefix for prefix in self._cache
+                           if not prefix in keep]:
+                del self._cache[prefix]
+        self._deadline = None
+        self._simulator.load_state(self._cache[best][1])
+        return best, best_score
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+
+class NullProfiler:
+    """ Profiler interface doing nothing, the default of a simulator. """
+    enabled = False
+
+    def begin_tick(self, tick):
+        pass
+
+    def end_tick(self):
+        pass
+
+    def start(self):
+        return None
+
+    def stop(self, phase, mark):
+        pass
+
+    def count(self, counter, amount = 1):
+        pass
+
+NULL_PROFILER = NullProfiler()
+
+class Profiler(NullProfiler):
+    """ Per-phase timers and counters of every simulator tick. """
+    # phases are timed between start() and stop(); a phase may run many
+    # times per tick, each run becomes a trace event and adds to the total
+    enabled = True
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._ticks = []
+        self._tick = None
+
+    @property
+    def ticks(self):
+        return self._ticks
+
+    def begin_tick(self, tick):
+        self._tick = {'tick': tick, 'start': time.perf_counter(),
+                      'seconds': 0, 'phases': {}, 'counters': {},
+                      'events': []}
+
+    def end_tick(self):
+        if self._tick is not None:
+            self._tick['seconds'] = time.perf_counter() - self._tick['start']
+            self._ticks.append(self._tick)
+            self._tick = None
+
+    def start(self):
+        return time.perf_counter()
+
+    def stop(self, phase, mark):
+        if self._tick is None:
+            return
+        now = time.perf_counter()
+        phases = self._tick['phases']
+        phases[phase] = phases.get(phase, 0) + now - mark
+        self._tick['events'].append((phase, mark, now - mark))
+
+    def count(self, counter, amount = 1):
+        if self._tick is None:
+            return
+        counters = self._tick['counters']
+        counters[counter] = counters.get(counter, 0) + amount
+
+    def totals(self):
+        # phase seconds and counters summed over all ticks
+        phases = {}
+        counters = {}
+        for tick in self._ticks:
+            for phase, seconds in tick['phases'].items():
+                phases[phase] = phases.get(phase, 0) + seconds
+            for counter, amount in tick['counters'].items():
+                counters[counter] = counters.get(counter, 0) + amount
+        return {'ticks': len(self._ticks),
+                'seconds': sum(tick['seconds'] for tick in self._ticks),
+                'phases': phases, 'counters': counters}
+
+    def to_json(self):
+        return {'totals': self.totals(),
+                'ticks': [{'tick': tick['tick'], 'seconds': tick['seconds'],
+                           'phases': tick['phases'],
+                           'counters': tick['counters']}
+                          for tick in self._ticks]}
+
+    def _microseconds(self, seconds):
+        return (seconds - self._origin) * 1e6
+
+    def to_trace(self):
+        # Chrome trace events (chrome://tracing, Perfetto): a slice per
+        # tick with its phase slices nested in it, and the tick counters
+        events = []
+        for tick in self._ticks:
+            events.append({'name': 'tick %d' % tick['tick'], 'ph': 'X',
+                           'ts': self._microseconds(tick['start']),
+                           'dur': tick['seconds'] * 1e6,
+                           'pid': os.getpid(), 'tid': 0,
+                           'args': tick['counters']})
+            for phase, start, seconds in tick['events']:
+                events.append({'name': phase, 'ph': 'X',
+                               'ts': self._microseconds(start),
+                               'dur': seconds * 1e6,
+                               'pid': os.getpid(), 'tid': 0})
+            if tick['counters']:
+                events.append({'name': 'counters', 'ph': 'C',
+                               'ts': self._microseconds(tick['start']),
+                               'pid': os.getpid(),
+                               'args': tick['counters']})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_json(self, filename):
+        with open(filename, 'w') as output:
+            json.dump(self.to_json(), output, indent = 1)
+
+    def write_trace(self, filename):
+        with open(filename, 'w') as output:
+            json.dump(self.to_trace(), output)
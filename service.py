@@ -0,0 +1,373 @@
+#!/usr/bin/python
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import os
+import sys
+import time
+
+from geometry import Point, distance
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+from snapshot import is_snapshot, read_snapshot, write_snapshot, write_xml
+
+from PIL import Image
+
+# long-running simulation service: simulators stay in memory as named
+# sessions between commands, so a controller sending many passes pays for
+# reading the mask and building the lattice once. Commands and replies
+# are JSON lines, over a Unix socket or stdin and stdout:
+#
+#   {"id": 1, "command": "init", "session": "a", "input": "mask.png"}
+#   {"id": 2, "command": "pass", "session": "a", "points": [0, 0, 50, 50]}
+#   {"id": 3, "command": "query", "session": "a"}
+#   {"id": 4, "command": "snapshot", "session": "a", "output": "a.snap"}
+#
+# every command gets one reply, {"id": ..., "ok": true, "result": {...}}
+# or {"id": ..., "ok": false, "error": "..."}; a pass also streams
+# {"id": ..., "event": "progress", ...} lines while it runs. Heavy work
+# runs in an executor, one command per session at a time, and queries are
+# answered from the state saved after the last command, so they do not
+# wait for a running pass.
+
+class Session:
+    """ A simulator kept in memory by the service, with its last state. """
+    def __init__(self, simulator):
+        # printing every particle after each pass would only slow the
+        # service down
+        simulator.verbose = False
+        self.simulator = simulator
+        # one heavy command at a time
+        self.lock = asyncio.Lock()
+        self.busy = None
+        self.publish()
+
+    def publish(self):
+        # read-only state for queries, taken between commands
+        self.state = self.simulator.save_state()
+        self.relaxation = self.simulator.last_relaxation
+
+class ProgressRecorder:
+    """ Simulator recorder sending a progress event every few ticks. """
+    # record() runs in the executor thread, the events are handed to the
+    # event loop thread
+    def __init__(self, loop, send, ticks, every):
+        self._loop = loop
+        self._send = send
+        self._ticks = ticks
+        self._every = max(1, every)
+        self._tick = 0
+
+    def record(self, simulator):
+        self._tick += 1
+        if self._tick % self._every and self._tick != self._ticks:
+            return
+        event = {'event': 'progress', 'tick': self._tick,
+                 'ticks': self._ticks, 'time': simulator.time}
+        relaxation = simulator.last_relaxation
+        if relaxation is not None:
+            event['iterations'] = relaxation['iterations']
+            event['converged'] = relaxation['converged']
+        self._loop.call_soon_threadsafe(self._send, event)
+
+    def close(self):
+        pass
+
+def override_settings(settings, backend = None, overrides = None):
+    # overrides are {setting name: value}, as in a sweep grid
+    for name, value in (overrides or {}).items():
+        if not hasattr(settings, name):
+            raise ValueError("Unknown setting %s" % name)
+        setattr(settings, name, value)
+    if backend:
+        settings.backend = backend
+
+def load_simulator(filename, settings_file = None, backend = None,
+                   overrides = None, scale = 1.0, verbose = True):
+    # a simulator from a snapshot or a mask image, as main.py does; a
+    # settings file overrides the settings saved with a snapshot, verbose
+    # is set on the simulator before it initializes
+    state = None
+    settings = None
+    if is_snapshot(filename):
+        try:
+            state, settings = read_snapshot(filename)
+        except (OSError, ValueError, KeyError):
+            raise ValueError("failed reading input file %s" % filename)
+    if settings_file:
+        settings = SimulatorSettings(settings_file)
+    elif not settings:
+        settings = SimulatorSettings()
+    override_settings(settings, backend, overrides)
+    simulator = SpringSimulator(settings)
+    simulator.verbose = verbose
+    if state is not None:
+        simulator.load_state(state)
+    else:
+        try:
+            image = Image.open(filename)
+            image.load()
+        except OSError:
+            raise ValueError("failed reading input file %s" % filename)
+        simulator.initialize_from_image(image, scale)
+    return simulator
+
+def pass_points(values):
+    # [x1, y1, x2, y2, ...] -> points of a linear pass
+    if not values:
+        raise ValueError("no coordinates of laser pass provided")
+    if len(values) < 4:
+        raise ValueError("too few coordinates provided (at least 2 points)")
+    if len(values) & 1:
+        raise ValueError("odd number of coordinates provided (2 per point)")
+    return [Point(x, y) for x, y in zip(values[::2], values[1::2])]
+
+def pass_ticks(simulator, points):
+    # ticks run_linear_passes takes, with the final cooldown
+    speed = simulator.settings.heater_speed
+    return sum(int(distance(start, finish) / speed) + 1
+               for start, finish in zip(points, points[1:])) + 1
+
+class SimulationService:
+    """ Named simulator sessions driven by JSON commands. """
+    def __init__(self, executor):
+        self._executor = executor
+        self._sessions = {}
+        self._commands = {'init': self._init, 'clone': self._clone,
+                          'pass': self._pass, 'snapshot': self._snapshot,
+                          'query': self._query, 'close': self._close}
+
+    async def _run(self, function, *args):
+        # heavy work goes to the executor, keeping the event loop free
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    def _session(self, request):
+        name = request.get('session', 'default')
+        if name not in self._sessions:
+            raise ValueError("Unknown session %s" % name)
+        return self._sessions[name]
+
+    async def handle(self, request, send):
+        # run one command, send its progress events and reply
+        reply = {'id': request.get('id')}
+        def send_event(event):
+            event['id'] = request.get('id')
+            send(event)
+        try:
+            command = self._commands.get(request.get('command'))
+            if command is None:
+                raise ValueError("Unknown command %s" %
+                                 request.get('command'))
+            reply['result'] = await command(request, send_event)
+            reply['ok'] = True
+        except Exception as error:
+            reply['ok'] = False
+            reply['error'] = str(error)
+        send(reply)
+
+    async def _init(self, request, send):
+        name = request.get('session', 'default')
+        if name in self._sessions:
+            raise ValueError("Session %s exists" % name)
+        if 'input' not in request:
+            raise ValueError("no input file provided to initialize from")
+        start = time.perf_counter()
+        simulator = await self._run(
+            load_simulator, request['input'], request.get('settings'),
+            request.get('backend'), request.get('overrides'),
+            float(request.get('scale', 1.0)), False)
+        # another init of the same name may have finished meanwhile
+        if name in self._sessions:
+            simulator.close()
+            raise ValueError("Session %s exists" % name)
+        session = Session(simulator)
+        self._sessions[name] = session
+        return dict(self._summary(session), session = name,
+                    seconds = time.perf_counter() - start)
+
+    async def _clone(self, request, send):
+        # a new session forked from the current state of another one
+        source = self._session(request)
+        name = request.get('name')
+        if not name or name in self._sessions:
+            raise ValueError("Session %s exists or has no name" % name)
+        async with source.lock:
+            simulator = source.simulator.clone()
+        self._sessions[name] = Session(simulator)
+        return {'session': name}
+
+    async def _pass(self, request, send):
+        session = self._session(request)
+        points = pass_points(request.get('points'))
+        async with session.lock:
+            simulator = session.simulator
+            ticks = pass_ticks(simulator, points)
+            simulator.recorder = ProgressRecorder(
+                asyncio.get_running_loop(), send, ticks,
+                int(request.get('every', 10)))
+            session.busy = 'pass'
+            start = time.perf_counter()
+            try:
+                await self._run(self._run_pass, session, points)
+            finally:
+                simulator.recorder = None
+                session.busy = None
+            seconds = time.perf_counter() - start
+        return dict(self._summary(session), seconds = seconds)
+
+    @staticmethod
+    def _run_pass(session, points):
+        session.simulator.run_linear_passes(points)
+        session.publish()
+
+    async def _snapshot(self, request, send):
+        session = self._session(request)
+        output = request.get('output')
+        if not output:
+            raise ValueError("no output file provided")
+        async with session.lock:
+            state = session.state
+            settings = session.simulator.settings
+            writer = write_xml if output.lower().endswith('.xml') \
+                     else write_snapshot
+            await self._run(writer, output, state, settings)
+        return {'output': output, 'time': state.time}
+
+    async def _query(self, request, send):
+        # answered from the published state right away, even while the
+        # session runs a pass
+        if 'session' not in request:
+            return {'sessions': {name: self._summary(session)
+                                 for name, session
+                                 in self._sessions.items()}}
+        session = self._session(request)
+        summary = self._summary(session)
+        if request.get('particles'):
+            state = session.state
+            summary['x'] = state.x.tolist()
+            summary['y'] = state.y.tolist()
+            summary['molten'] = state.molten.tolist()
+        if request.get('springs'):
+            summary['ends'] = session.state.springs.tolist()
+        return summary
+
+    async def _close(self, request, send):
+        session = self._session(request)
+        del self._sessions[request['session']]
+        async with session.lock:
+            session.simulator.close()
+        return {'session': request['session']}
+
+    @staticmethod
+    def _summary(session):
+        state = session.state
+        return {'time': state.time, 'particles': state.particle_count,
+                'springs': state.spring_count,
+                'molten': int(state.molten.sum()), 'busy': session.busy,
+                'relaxation': session.relaxation}
+
+    def close(self):
+        for session in self._sessions.values():
+            session.simulator.close()
+        self._sessions = {}
+
+async def _after(previous, command):
+    if previous is not None:
+        await asyncio.wait([previous])
+    await command
+
+async def serve_lines(service, reader, write):
+    # commands of one client run in the order sent, except queries, which
+    # are answered right away even while a pass is running; clients
+    # wanting passes to run side by side use a connection each
+    def send(message):
+        write((json.dumps(message) + '\n').encode())
+    tasks = set()
+    previous = None
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a command is a JSON object")
+        except ValueError as error:
+            send({'id': None, 'ok': False, 'error': str(error)})
+            continue
+        if request.get('command') == 'query':
+            task = asyncio.ensure_future(service.handle(request, send))
+        else:
+            task = asyncio.ensure_future(
+                _after(previous, service.handle(request, send)))
+            previous = task
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+async def serve_socket(service, path):
+    async def client(reader, writer):
+        try:
+            await serve_lines(service, reader, writer.write)
+        finally:
+            writer.close()
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(client, path)
+    async with server:
+        await server.serve_forever()
+
+class StdinReader:
+    """ Line reader over stdin, which may be a file, a pipe or a tty. """
+    # lines are read by a thread of the default executor
+    def __init__(self, stdin):
+        self._stdin = stdin
+
+    async def readline(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._stdin.readline)
+
+async def serve_stdin(service, output):
+    def write(data):
+        output.write(data)
+        output.flush()
+    await serve_lines(service, StdinReader(sys.stdin.buffer), write)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Simulation service',
+        formatter_class = argparse.RawDescriptionHelpFormatter,
+        epilog = '''\
+Example usage:
+  python service.py -u /tmp/simulator.sock
+  python service.py < commands.jsonl > replies.jsonl''')
+    parser.add_argument('-u', dest = 'socket',
+                        help = 'Unix socket to listen on (default: stdin)')
+    parser.add_argument('-j', dest = 'workers', type = int, default = 1,
+                        help = 'commands run at once (default: 1)')
+    parser.add_argument('-v', dest = 'verbose', action = 'store_true',
+                        help = 'simulator output to stderr')
+    args = parser.parse_args(sys.argv[1:])
+
+    # replies own stdout; what the simulators print goes elsewhere
+    output = sys.stdout.buffer
+    log = sys.stderr if args.verbose else open(os.devnull, 'w')
+    service = SimulationService(
+        concurrent.futures.ThreadPoolExecutor(args.workers))
+    with contextlib.redirect_stdout(log):
+        try:
+            if args.socket:
+                asyncio.run(serve_socket(service, args.socket))
+            else:
+                asyncio.run(serve_stdin(service, output))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
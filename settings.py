@@ -1,7 +1,8 @@
 import configparser
 import collections
+import collections.abc
 
-class CaseInsensitiveDict(collections.MutableMapping):
+class CaseInsensitiveDict(collections.abc.MutableMapping):
     """ Ordered case insensitive mutable mapping class. """
     def __init__(self, *args, **kwargs):
         self._d = collections.OrderedDict(*args, **kwargs)
@@ -34,9 +35,19 @@ class SimulatorSettings:
 
         self._relaxation_iteration_limit = 2000
         self._relaxation_convergence_limit = 0.001
+        self._relaxation_active_set = False
+        self._relaxation_freeze_iterations = 5
+        self._relaxation_wake_threshold = 0.001
+        self._relaxation_processes = 1
+        self._relaxation_method = 'steepest'
 
         self._heater_speed = 2.0
         self._heater_size = 20.0
+        self._heater_coalesce = False
+        self._heater_coalesce_fraction = 0.1
+        self._heater_coalesce_ticks = 4
+
+        self._backend = 'reference'
  
         if filename != "":
             self.load_from_file(filename)
@@ -113,6 +124,54 @@ class SimulatorSettings:
     def relaxation_convergence_limit(self, convergence):
         self._relaxation_convergence_limit = convergence
 
+    # active-set relaxation: particles that moved less than the convergence
+    # limit for freeze_iterations in a row stop being updated until a
+    # neighbour moves more than wake_threshold or their springs change
+    @property
+    def relaxation_active_set(self):
+        return self._relaxation_active_set
+
+    @relaxation_active_set.setter
+    def relaxation_active_set(self, enabled):
+        self._relaxation_active_set = enabled
+
+    @property
+    def relaxation_freeze_iterations(self):
+        return self._relaxation_freeze_iterations
+
+    @relaxation_freeze_iterations.setter
+    def relaxation_freeze_iterations(self, iterations):
+        self._relaxation_freeze_iterations = iterations
+
+    @property
+    def relaxation_wake_threshold(self):
+        return self._relaxation_wake_threshold
+
+    @relaxation_wake_threshold.setter
+    def relaxation_wake_threshold(self, threshold):
+        self._relaxation_wake_threshold = threshold
+
+    # number of processes sharing the displacement step of an array-backed
+    # simulator, 1 relaxes in the calling process
+    @property
+    def relaxation_processes(self):
+        return self._relaxation_processes
+
+    @relaxation_processes.setter
+    def relaxation_processes(self, processes):
+        self._relaxation_processes = processes
+
+    # minimizer of relax_heat: 'steepest' moves particles by their forces,
+    # 'fire' integrates velocities with the FIRE scheme (relaxation.py),
+    # 'newton' takes implicit steps where it can (newton.py, needs scipy)
+    @property
+    def relaxation_method(self):
+        return self._relaxation_method
+
+    @relaxation_method.setter
+    def relaxation_method(self, method):
+        self._relaxation_method = method
+
     @property
     def heater_speed(self):
         return self._heater_speed
@@ -128,6 +187,42 @@ class SimulatorSettings:
     @heater_size.setter
     def heater_size(self, size):
         self._heater_size = size
+
+    # adaptive ticks: relax_heat is skipped on a tick while the particles
+    # which melted or cooled since the last relaxation are at most
+    # coalesce_fraction of the heated ones, for up to coalesce_ticks ticks
+    @property
+    def heater_coalesce(self):
+        return self._heater_coalesce
+
+    @heater_coalesce.setter
+    def heater_coalesce(self, enabled):
+        self._heater_coalesce = enabled
+
+    @property
+    def heater_coalesce_fraction(self):
+        return self._heater_coalesce_fraction
+
+    @heater_coalesce_fraction.setter
+    def heater_coalesce_fraction(self, fraction):
+        self._heater_coalesce_fraction = fraction
+
+    @property
+    def heater_coalesce_ticks(self):
+        return self._heater_coalesce_ticks
+
+    @heater_coalesce_ticks.setter
+    def heater_coalesce_ticks(self, ticks):
+        self._heater_coalesce_ticks = ticks
+
+    # compute backend of the simulator hot loops, see backends.py
+    @property
+    def backend(self):
+        return self._backend
+
+    @backend.setter
+    def backend(self, name):
+        self._backend = name
     
     def load_from_file(self, filename):
         config = configparser.ConfigParser(dict_type=CaseInsensitiveDict)
@@ -158,6 +253,26 @@ class SimulatorSettings:
                 float(config['heater']['speed'])
             self.heater_size = \
                 float(config['heater']['size'])
+
+            # optional keys, older files do not have them
+            self.relaxation_active_set = config['relaxation'].getboolean(
+                'activeset', self.relaxation_active_set)
+            self.relaxation_freeze_iterations = config['relaxation'].getint(
+                'freezeiterations', self.relaxation_freeze_iterations)
+            self.relaxation_wake_threshold = config['relaxation'].getfloat(
+                'wakethreshold', self.relaxation_wake_threshold)
+            self.relaxation_processes = config['relaxation'].getint(
+                'processes', self.relaxation_processes)
+            self.relaxation_method = config['relaxation'].get(
+                'method', self.relaxation_method)
+            self.heater_coalesce = config['heater'].getboolean(
+                'coalesce', self.heater_coalesce)
+            self.heater_coalesce_fraction = config['heater'].getfloat(
+                'coalescefraction', self.heater_coalesce_fraction)
+            self.heater_coalesce_ticks = config['heater'].getint(
+                'coalesceticks', self.heater_coalesce_ticks)
+            self.backend = config.get('simulator', 'backend',
+                                      fallback = self.backend)
         except:
             print("Failed reading config file %s" % filename)
 
@@ -177,11 +292,22 @@ class SimulatorSettings:
 
             config['relaxation'] = {}
             config['relaxation']['iterationlimit'] = str(self.relaxation_iteration_limit)
-            config['relaxation']['convergencelimit'] = '%.4f' % self.relaxation_convergence_limit
+            config['relaxation']['convergencelimit'] = repr(self.relaxation_convergence_limit)
+            config['relaxation']['activeset'] = str(self.relaxation_active_set)
+            config['relaxation']['freezeiterations'] = str(self.relaxation_freeze_iterations)
+            config['relaxation']['wakethreshold'] = repr(self.relaxation_wake_threshold)
+            config['relaxation']['processes'] = str(self.relaxation_processes)
+            config['relaxation']['method'] = self.relaxation_method
 
             config['heater'] = {}
             config['heater']['speed'] = '%.2f' % self.heater_speed
             config['heater']['size'] = '%.2f' % self.heater_size
+            config['heater']['coalesce'] = str(self.heater_coalesce)
+            config['heater']['coalescefraction'] = repr(self.heater_coalesce_fraction)
+            config['heater']['coalesceticks'] = str(self.heater_coalesce_ticks)
+
+            config['simulator'] = {}
+            config['simulator']['backend'] = self.backend
 
             with open(filename, 'w') as config_file:
                 config.write(config_file)
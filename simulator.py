@@ -1,14 +1,30 @@
-from PIL import Image, ImageOps
+import copy
+
+import numpy as np
+
+from PIL import Image
 
 from particle import Particle
 from spring import Spring
+from store import ParticleStore
+from relaxation import ActiveSet, Fire
+from newton import NewtonSolver
+from parallel import ParallelRelaxation, WorkerPool
+from backends import get_backend
+from spatial import UniformGrid, SegmentGrid
+from edges import EdgeIndex
+from mesh import HalfEdgeMesh
 from settings import SimulatorSettings
-from geometry import Point, Line, distance, segments_intersect
+from state import SimulatorState
+from profiler import NULL_PROFILER
+from cooldown import CooldownScheduler
+from geometry import Point, Line, distance
 from math import sqrt
 from collections import deque
+from contextlib import contextmanager
 from itertools import combinations
-from functools import cmp_to_key
 
+# returns the number of particles visited
 def _particle_bfs(start, min_depth, max_depth, neighbourhood):
     bfs_queue = deque([start])
     depth = {start: 0}
@@ -20,12 +36,13 @@ def _particle_bfs(start, min_depth, max_depth, neighbourhood):
         if depth[current] > max_depth:
             break
 
-        for spring in current.springs:
-            following = spring.other_end(current)
+        for following in current.neighbours:
             if not following in depth:
                 bfs_queue.append(following)
                 depth[following] = depth[current] + 1
 
+    return len(depth)
+
 # check if removal of the spring will create a long cycle (potential void)
 # return value is (can_be_removed, if_yes_is_cycle_fixable_by_a_new_spring)
 def _spring_can_be_removed(spring, min_cycle_length, max_cycle_length, cycle):
@@ -36,8 +53,7 @@ def _spring_can_be_removed(spring, min_cycle_length, max_cycle_length, cycle):
 
     while bfs_queue:
         current = bfs_queue.popleft()
-        for adjacent_spring in current.springs:
-            following = adjacent_spring.other_end(current)
+        for adjacent_spring, following in current.links:
             if not following in depth:
                 bfs_queue.append(following)
                 link_to_previous[following] = adjacent_spring
@@ -68,9 +84,8 @@ def _spring_can_be_removed(spring, min_cycle_length, max_cycle_length, cycle):
 
     while bfs_queue:
         current = bfs_queue.popleft()
-        for adjacent_spring in current.springs:
+        for adjacent_spring, following in current.links:
             if not adjacent_spring in forbidden_springs:
-                following = adjacent_spring.other_end(current)
                 if not following in depth:
                     bfs_queue.append(following)
                     link_to_previous[following] = adjacent_spring
@@ -103,8 +118,8 @@ def _spring_can_be_removed(spring, min_cycle_length, max_cycle_length, cycle):
 
     for i in range(half_cycle_size - 1):
         for j in range(half_cycle_size, len(cycle) - 1):
-            for cycle_spring in cycle[i].spring:
-                if cycle_spring.other_end(cycle[i]) == cycle[j]:
+            for neighbour in cycle[i].neighbours:
+                if neighbour == cycle[j]:
                     # we can split the cycle
                     sub_cycle_size1 = j - i + 1
                     sub_cycle_size2 = len(cycle) - sub_cycle_size1 + 2
@@ -117,17 +132,105 @@ def _spring_can_be_removed(spring, min_cycle_length, max_cycle_length, cycle):
     else:
         return (False, True)
 
+# same answers as _spring_can_be_removed, read off the two faces next to the
+# spring: the shortest way around between its ends (in a triangulation
+# without separating triangles) goes along the smaller of them. Where the
+# BFS answer depends on the order of the links, that is when the way round
+# is one longer than max_cycle_length or when both faces are as long and
+# the cycle is used for a fix, the BFS is asked instead
+def _spring_can_be_removed_on_mesh(mesh, spring, min_cycle_length,
+                                   max_cycle_length, cycle):
+    p1 = spring.particle1
+    p2 = spring.particle2
+    detour = mesh.shortest_detour(p1, p2)
+    if detour is not None and \
+       min_cycle_length <= len(detour) <= max_cycle_length + 1 and \
+       (len(detour) > max_cycle_length or
+        mesh.face_length(mesh.face(p1, p2)) ==
+        mesh.face_length(mesh.face(p2, p1))):
+        return _spring_can_be_removed(spring, min_cycle_length,
+                                      max_cycle_length, cycle)
+    if detour is None or len(detour) > max_cycle_length:
+        # no other path between the ends or only a long one
+        return (spring.elongation > 1.6, False)
+
+    cycle.extend(detour)
+    if len(detour) < min_cycle_length:
+        return (True, True)
+    else:
+        return (False, True)
+
+def _pair(p1, p2):
+    # key of the spring between p1 and p2, whichever way round
+    return (min(p1.index, p2.index), max(p1.index, p2.index))
+
 class SpringSimulator:
-    def __init__(self, settings = None):
+    def __init__(self, settings = None, array_backed = False,
+                 planar_mesh = False):
         if settings:
             self._settings = settings
         else:
             self._settings = SimulatorSettings()
 
         self._time = 0
-        self._particles = []
+        # hot loops run on the backend named in the settings; array_backed
+        # asks for the numpy one over the reference
+        self._backend = get_backend(self._settings.backend)
+        if array_backed and not self._backend.array_backed:
+            self._backend = get_backend('numpy')
+        # structure-of-arrays storage for the array backends, particles
+        # become views over it
+        self._store = self._new_store() if self._backend.array_backed \
+                      else None
+        self._particles = self._store.particles if self._store is not None \
+                          else []
+        # worker processes for the relaxation, started on first use
+        self._workers = None
+        # optional half-edge mesh of the springs, built after initialization
+        self._planar_mesh = planar_mesh
+        self._mesh = None
+        # particle positions bucketed for "particles near a point" queries
+        self._particle_index = UniformGrid(self._index_cell_size())
+        # spring segments bucketed for the crossing checks of new springs
+        self._spring_index = SegmentGrid(self._default_interval())
         self._recently_added_springs = set()
         self._recently_removed_springs = set()
+        # springs whose force may be out of date outside of relax_heat
+        self._stale_springs = set()
+        # all springs by id
+        self._edges = EdgeIndex(self._store)
+        # ends of springs added or removed, to wake frozen particles
+        self._touched_particles = set()
+        # spring triangles around particles, by particle, for the move
+        # limits of the reference step; entries are dropped when a spring
+        # at or next to the particle is added or removed
+        self._triangle_cache = {}
+        self._last_relaxation = None
+        # optional per-tick recorder, see trajectory.py
+        self._recorder = None
+        # springs added and removed since the recorder was last called, by
+        # unordered particle pair; a spring added and removed in between
+        # is in neither
+        self._tick_added_springs = {}
+        self._tick_removed_springs = {}
+        # optional function called with the simulator after every tick,
+        # after the recorder; it may raise to stop the pass
+        self._tick_callback = None
+        # whether initialization and run_linear_passes print the particle
+        # positions, see debug()
+        self._verbose = True
+        # per-phase timers and counters, see profiler.py
+        self._profiler = NULL_PROFILER
+        # molten particles by timeout and the movable ones; rebuilt from the
+        # particle flags on entry to run_pass, run_linear_passes and
+        # relax_heat, as they may have been set from outside in between,
+        # and kept up to date inside them
+        self._scheduler = CooldownScheduler()
+        self._scheduling = False
+        # read-only snapshot of the current state while it is unchanged,
+        # shared with clones; a clone keeps it as pending until first used
+        self._frozen_state = None
+        self._pending_state = None
 
     @property
     def settings(self):
@@ -135,19 +238,112 @@ class SpringSimulator:
 
     @settings.setter
     def settings(self, new_settings):
+        # particles and springs share the simulator settings, forces are
+        # redone with the new ones on the next update
         self._settings = new_settings
+        if self._store is not None:
+            self._store.settings = new_settings
+            return
+        for particle in self._particles:
+            particle.settings = new_settings
+            for spring in particle.springs:
+                spring.settings = new_settings
+                self._stale_springs.add(spring)
 
     @property
     def time(self):
         return self._time
 
     def increment_time(self):
+        self._frozen_state = None
         self._time += 1
 
     @property
     def particles(self):
+        # handed out particles may be moved by the caller, so the saved
+        # state is dropped; the cooldown queue and the triangle cache only
+        # change with the lattice and stay
+        self._materialize()
+        self._frozen_state = None
         return self._particles
 
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def store(self):
+        self._materialize()
+        self._frozen_state = None
+        return self._store
+
+    @property
+    def last_relaxation(self):
+        # statistics of the latest relax_heat call
+        return self._last_relaxation
+
+    @property
+    def edges(self):
+        self._materialize()
+        self._frozen_state = None
+        return self._edges
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, recorder):
+        self._recorder = recorder
+
+    @property
+    def verbose(self):
+        return self._verbose
+
+    @verbose.setter
+    def verbose(self, verbose):
+        self._verbose = verbose
+
+    @property
+    def tick_callback(self):
+        return self._tick_callback
+
+    @tick_callback.setter
+    def tick_callback(self, callback):
+        self._tick_callback = callback
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        self._profiler = profiler if profiler is not None else NULL_PROFILER
+
+    @property
+    def mesh(self):
+        self._materialize()
+        return self._mesh
+
+    @property
+    def particle_index(self):
+        self._materialize()
+        return self._particle_index
+
+    def particles_near(self, point, radius):
+        self._materialize()
+        return self._backend.particles_near(self, point.x, point.y, radius)
+
+    @property
+    def tick_added_springs(self):
+        # pair -> ((id1, id2), rest length)
+        return self._tick_added_springs
+
+    @property
+    def tick_removed_springs(self):
+        # pair -> (id1, id2)
+        return self._tick_removed_springs
+
     @property
     def recently_added_springs(self):
         return self._recently_added_springs
@@ -157,11 +353,63 @@ class SpringSimulator:
         return self._recently_removed_springs
 
     def clear(self):
-        pass
+        self._frozen_state = None
+        self._pending_state = None
+        self._scheduler.clear()
+        self._particles = []
+        self._particle_index = UniformGrid(self._index_cell_size())
+        self._spring_index = SegmentGrid(self._default_interval())
+        self._stale_springs = set()
+        self._triangle_cache = {}
+        self._mesh = None
+        self.clear_recent()
+        self._tick_added_springs = {}
+        self._tick_removed_springs = {}
+        if self._store is not None:
+            self._store.close()
+            self._store = self._new_store()
+            self._particles = self._store.particles
+        self._edges = EdgeIndex(self._store)
+
+    def close(self):
+        # stop the relaxation workers and release shared store memory
+        if self._workers is not None:
+            self._workers.close()
+            self._workers = None
+        if self._store is not None:
+            self._store.close()
+
+    def _new_store(self):
+        # workers read the store arrays, so they go to shared memory
+        return ParticleStore(shared = self._settings.relaxation_processes > 1,
+                             settings = self._settings)
+
+    def _relaxation_kernel(self, movable, minimizer = None):
+        # the worker processes only take plain steepest descent steps, and
+        # only make up for their overhead on large heated regions
+        processes = self._settings.relaxation_processes
+        if processes > 1 and minimizer is None and \
+           len(movable) >= ParallelRelaxation.MIN_PARTICLES:
+            if not self._store.shared:
+                # relaxation_processes was raised after the store was made
+                self._store.share()
+            if self._workers is not None and len(self._workers) != processes:
+                self._workers.close()
+                self._workers = None
+            if self._workers is None:
+                self._workers = WorkerPool(processes)
+            return ParallelRelaxation(self._store, self._settings, movable,
+                                      self._workers)
+        return self._backend.relaxation_kernel(self, movable, minimizer)
 
     def debug(self):
-        for particle in self._particles:
-            print("%.3f %.3f" % (particle.x, particle.y))
+        self._materialize()
+        if self._store is not None:
+            points = zip(self._store.x.tolist(), self._store.y.tolist())
+        else:
+            points = ((particle.x, particle.y) for particle in self._particles)
+        for x, y in points:
+            print("%.3f %.3f" % (x, y))
         print("================")
 
 
@@ -169,21 +417,135 @@ class SpringSimulator:
         self._recently_added_springs.clear()
         self._recently_removed_springs.clear()
 
-    def _add_spring(self, p1, p2):
+    def _tick_done(self):
+        # hand the finished tick to the recorder and the tick callback
+        if self._recorder is not None:
+            self._recorder.record(self)
+        self._tick_added_springs.clear()
+        self._tick_removed_springs.clear()
+        if self._tick_callback is not None:
+            self._tick_callback(self)
+
+    def _add_spring(self, p1, p2, length = None):
         if p1 and p2:
-            for spring in p1.springs:
-                if spring.other_end(p1) == p2:
-                    return None
-            return Spring(p1, p2,
-                          self._settings.spring_default_length, self._settings)
+            if self._edges.contains(p1, p2):
+                return None
+            if length is None:
+                length = self._settings.spring_default_length
+            if self._store is not None:
+                spring = self._store.new_spring(p1, p2, length)
+            else:
+                spring = Spring(p1, p2, length, self._settings,
+                                self._edges.next_index)
+            self._edges.add(spring)
+            if self._mesh is not None:
+                self._mesh.add_edge(p1, p2)
+            self._spring_index.insert(spring.index, p1.x, p1.y, p2.x, p2.y)
+            self._stale_springs.add(spring)
+            self._touched_particles.update((p1, p2))
+            self._drop_triangles(p1, p2)
+            if self._recorder is not None:
+                self._tick_added_springs[_pair(p1, p2)] = \
+                    ((p1.index, p2.index), length)
+            return spring
         else:
             return None
 
+    def _remove_spring(self, spring):
+        if self._recorder is not None:
+            pair = _pair(spring.particle1, spring.particle2)
+            if self._tick_added_springs.pop(pair, None) is None:
+                self._tick_removed_springs[pair] = \
+                    (spring.particle1.index, spring.particle2.index)
+        self._spring_index.remove(spring.index)
+        self._edges.remove(spring)
+        spring.detach()
+        if self._mesh is not None:
+            self._mesh.remove_edge(spring.particle1, spring.particle2)
+        self._touched_particles.update((spring.particle1, spring.particle2))
+        self._drop_triangles(spring.particle1, spring.particle2)
+
+    def _compact(self):
+        # give the ids of removed springs back once they outnumber the
+        # springs in use
+        if self._edges.holes > len(self._edges):
+            self._spring_index.renumber(self._edges.compact())
+
+    def _drop_triangles(self, p1, p2):
+        # the spring between p1 and p2 changed the triangles at both ends
+        # and at their neighbours
+        if self._triangle_cache:
+            for particle in (p1, p2):
+                self._triangle_cache.pop(particle, None)
+                for neighbour in particle.neighbours:
+                    self._triangle_cache.pop(neighbour, None)
+
+    def _triangles_around(self, particle):
+        # (neighbour, neighbour2) of each spring triangle at particle, in
+        # the order the step used to find them by walking the neighbours
+        triangles = self._triangle_cache.get(particle)
+        if triangles is None:
+            neighbours = set()
+            for neighbour in particle.neighbours:
+                neighbours.add(neighbour)
+            triangles = []
+            checked_neighbours = set()
+            for neighbour in neighbours:
+                checked_neighbours.add(neighbour)
+                for neighbour2 in neighbour.neighbours:
+                    if neighbour2 in neighbours and \
+                       not neighbour2 in checked_neighbours:
+                        triangles.append((neighbour, neighbour2))
+            self._triangle_cache[particle] = triangles
+        return triangles
+
+    def _spring_can_be_removed(self, spring, min_cycle_length,
+                               max_cycle_length, cycle):
+        if self._mesh is not None:
+            return _spring_can_be_removed_on_mesh(
+                self._mesh, spring, min_cycle_length, max_cycle_length, cycle)
+        return _spring_can_be_removed(spring, min_cycle_length,
+                                      max_cycle_length, cycle)
+
+    def _update_forces(self):
+        # recompute each spring whose end moved or changed radius once
+        self._backend.update_forces(self, self._stale_springs)
+        self._stale_springs.clear()
+
+    def _update_spring_index(self, particles):
+        # re-bucket the springs at particles, which may have moved
+        if self._store is not None:
+            springs = self._store.springs_at(
+                [particle.index for particle in particles])
+            ends = self._store.edges[springs]
+            x = self._store.x
+            y = self._store.y
+        else:
+            springs = {spring for particle in particles
+                       for spring in particle.springs}
+            self._spring_index.move_many(
+                [spring.index for spring in springs],
+                *np.array([(spring.particle1.x, spring.particle1.y,
+                            spring.particle2.x, spring.particle2.y)
+                           for spring in springs]).reshape(-1, 4).T)
+            return
+        self._spring_index.move_many(springs, x[ends[:, 0]], y[ends[:, 0]],
+                                     x[ends[:, 1]], y[ends[:, 1]])
+
     def _default_interval(self):
         return self._settings.particle_default_radius * 2 + \
                self._settings.spring_default_length
 
-    def _initialize_field(self, centre, width, height, interval, include_point):
+    def _index_cell_size(self):
+        # a heater query then spans about 5x5 cells
+        return max(self._settings.heater_size / 2, self._default_interval())
+
+    def _initialize_field(self, centre, width, height, interval, include,
+                          tile_rows = 256):
+        # hexagonal lattice over the width x height box around centre;
+        # include(x, y) gets arrays of node coordinates and returns which
+        # nodes get a particle. Lattice rows are handled tile_rows at a time
+        # so that memory stays bounded for very large fields
         self.clear()
 
         x_interval = interval
@@ -194,192 +556,544 @@ class SpringSimulator:
         if size_x <= 0 or size_y <= 0:
             return False
 
-        grid = [[None] * (2 * size_x + 1) for _ in range(2 * size_y + 1)]
-
-        for i in range(-size_y, size_y + 1):
-            for j in range(-size_x, size_x + 1):
-                x = centre.x + j * x_interval
-                if i & 1:
-                    x -= x_interval / 2
-                y = centre.y + i * y_interval 
-                if include_point(x, y):
-                    grid[i + size_y][j + size_x] = Particle(self._settings,
-                                                            x, y)
-
-        for i in range(2 * size_y + 1):
-            for j in range(2 * size_x + 1):
-                if grid[i][j]:
-                    if j > 0:
-                        self._add_spring(grid[i][j], grid[i][j - 1])
-                    if i > 0:
-                        self._add_spring(grid[i][j], grid[i - 1][j])
-                        if (i - size_y) & 1:
-                            if j > 0:
-                                self._add_spring(grid[i][j], grid[i - 1][j - 1])
-                        else:
-                            if j < 2 * size_x:
-                                self._add_spring(grid[i][j], grid[i - 1][j + 1])
-                    self._particles.append(grid[i][j])
+        columns = np.arange(-size_x, size_x + 1)
+        # particle ids of the previous lattice row, -1 where there is none
+        previous = np.full(len(columns), -1, dtype = np.int64)
+        count = 0
+        for first in range(-size_y, size_y + 1, tile_rows):
+            rows = np.arange(first, min(first + tile_rows, size_y + 1))
+            x = centre.x + columns[None, :] * x_interval - \
+                (rows[:, None] & 1) * (x_interval / 2)
+            y = np.broadcast_to(centre.y + rows[:, None] * y_interval, x.shape)
+            included = np.asarray(include(x, y), dtype = bool)
+
+            ids = np.full(x.shape, -1, dtype = np.int64)
+            ids[included] = np.arange(count, count + np.count_nonzero(included))
+            count += np.count_nonzero(included)
+
+            # neighbours to the left, above and diagonally above; odd rows
+            # are shifted left, so their upper diagonal neighbour is on the
+            # left and that of even rows on the right
+            above = np.vstack((previous[None, :], ids[:-1]))
+            left = np.full(ids.shape, -1, dtype = np.int64)
+            left[:, 1:] = ids[:, :-1]
+            upper_left = np.full(ids.shape, -1, dtype = np.int64)
+            upper_left[:, 1:] = above[:, :-1]
+            upper_right = np.full(ids.shape, -1, dtype = np.int64)
+            upper_right[:, :-1] = above[:, 1:]
+            diagonal = np.where((rows[:, None] & 1).astype(bool),
+                                upper_left, upper_right)
+            # springs in node order, each node's left, upper, diagonal ones
+            partners = np.stack((left, above, diagonal), axis = 2)
+            ends = np.stack((np.broadcast_to(ids[:, :, None], partners.shape),
+                             partners), axis = 3).reshape(-1, 2)
+            ends = ends[(ends >= 0).all(axis = 1)]
+
+            self._add_lattice(x[included], y[included], ends)
+            previous = ids[-1]
+
+        if self._planar_mesh:
+            self._mesh = HalfEdgeMesh(self._particles)
+
+    def _add_lattice(self, x, y, ends, lengths = None):
+        # particles at x, y get the next ids; ends are id pairs to connect,
+        # with springs of the given or default rest lengths. Everything is
+        # added in bulk: the caller makes sure no pair is connected twice
+        if lengths is None:
+            lengths = np.full(len(ends), self._settings.spring_default_length)
+        first = len(self._particles)
+        first_spring = self._edges.next_index
+        if self._store is not None:
+            self._store.add_particles(x, y)
+            self._store.add_springs(ends, lengths)
+        else:
+            self._particles.extend(
+                Particle(self._settings, particle_x, particle_y, index)
+                for index, particle_x, particle_y in
+                zip(range(first, first + len(x)), x.tolist(), y.tolist()))
+            particles = self._particles
+            springs = [Spring(particles[i], particles[j], length,
+                              self._settings, index)
+                       for index, (i, j), length in
+                       zip(range(first_spring, first_spring + len(ends)),
+                           ends.tolist(), np.asarray(lengths).tolist())]
+            self._edges.extend(springs)
+            self._stale_springs.update(springs)
+
+        self._particle_index.extend(np.arange(first, first + len(x)), x, y)
+        x, y = self._particle_index.positions(ends)
+        self._spring_index.extend(
+            np.arange(first_spring, first_spring + len(ends)),
+            x[:, 0], y[:, 0], x[:, 1], y[:, 1])
 
     def initialize_circle(self, centre, radius):
         interval = self._default_interval()
         self._initialize_field(
             centre, radius * 2, radius * 2, interval, lambda x, y:
-            distance(Point(x, y), centre) + interval / 2 <= radius + 1e-5)
-        self.debug()
+            np.sqrt((x - centre.x) * (x - centre.x) +
+                    (y - centre.y) * (y - centre.y)) + interval / 2 <=
+            radius + 1e-5)
+        if self._verbose:
+            self.debug()
 
     def initialize_from_image(self, image, scale = 1.0):
+        # the field spans the image scaled by scale, a node is included if
+        # the mask pixel under it is set; a mask with a set corner pixel is
+        # taken as inverted
         image = image.convert("L")
         interval = self._default_interval()
         width = image.width * scale
         height = image.height * scale
-        pixels = image.load()
-        if pixels[0,0]:
-            image = ImageOps.invert(image)
-            pixels = image.load()
+        inverted = bool(image.getpixel((0, 0)))
+
+        def include(x, y):
+            # only the band of image rows under these lattice rows is read
+            columns = np.clip((x / scale).astype(np.int64), 0, image.width - 1)
+            rows = np.clip((y / scale).astype(np.int64), 0, image.height - 1)
+            top = int(rows.min())
+            band = np.asarray(image.crop((0, top, image.width,
+                                          int(rows.max()) + 1)))
+            values = band[rows - top, columns]
+            return values != 255 if inverted else values != 0
+
+        self._initialize_field(Point(width / 2, height / 2), width, height,
+                               interval, include)
+        if self._verbose:
+            self.debug()
+
+    def save_state(self):
+        # the returned state is read-only and stays valid, it is reused
+        # until the simulator changes
+        if self._pending_state is not None:
+            return self._pending_state
+        if self._frozen_state is not None:
+            return self._frozen_state
+        # springs in id order, which is creation order
+        if self._store is not None:
+            store = self._store
+            alive = store.alive
+            state = SimulatorState(
+                store.x.copy(), store.y.copy(), store.molten.copy(),
+                store.movable.copy(), store.melting_timeout.copy(),
+                store.edges[alive], store.rest_length[alive], self._time)
+        else:
+            springs = list(self._edges)
+            state = SimulatorState(
+                [particle.x for particle in self._particles],
+                [particle.y for particle in self._particles],
+                [particle.molten for particle in self._particles],
+                [particle.movable for particle in self._particles],
+                [particle.melting_timeout for particle in self._particles],
+                [(spring.particle1.index, spring.particle2.index)
+                 for spring in springs],
+                [spring.length for spring in springs], self._time)
+        state.freeze()
+        self._frozen_state = state
+        return state
+
+    def load_state(self, state):
+        # particles and springs are added in bulk, in the order of the state
+        self.clear()
+        self._time = state.time
+        self._add_lattice(state.x, state.y, state.springs, state.rest_length)
+        if self._store is not None:
+            self._store.molten[:] = state.molten
+            self._store.movable[:] = state.movable
+            self._store.melting_timeout[:] = state.melting_timeout
+        else:
+            flagged = state.molten | state.movable | \
+                      (state.melting_timeout != 0)
+            for i in np.flatnonzero(flagged).tolist():
+                particle = self._particles[i]
+                particle.molten = bool(state.molten[i])
+                particle.melting_timeout = int(state.melting_timeout[i])
+                particle.movable = bool(state.movable[i])
+        if self._planar_mesh:
+            self._mesh = HalfEdgeMesh(self._particles)
+
+    def clone(self):
+        # a simulator in the same state with its own copy of the settings;
+        # it shares a read-only snapshot with this one and only builds its
+        # own particles and springs from it, in bulk, once it is used. No
+        # data stays shared after that: a first pass on a clone costs one
+        # load_state more than on the original
+        child = SpringSimulator(copy.deepcopy(self._settings),
+                                array_backed = self._store is not None,
+                                planar_mesh = self._planar_mesh)
+        child._pending_state = self.save_state()
+        child._time = self._time
+        child._verbose = self._verbose
+        return child
+
+    def _materialize(self):
+        if self._pending_state is not None:
+            state = self._pending_state
+            self.load_state(state)
+            self._frozen_state = state
+
+    def _flagged_particles(self):
+        # the molten or movable particles, all the scheduler needs to see
+        if self._store is not None:
+            flagged = np.flatnonzero(self._store.molten | self._store.movable)
+            return [self._store.particle(index) for index in flagged.tolist()]
+        return self._particles
 
-        self._initialize_field(Point(width * scale / 2, height * scale / 2),
-                               width * scale, height * scale, interval,
-                               lambda x, y : pixels[x, y])
-        self.debug()
+    @contextmanager
+    def _scheduled(self):
+        # the outermost of nested run_pass, run_linear_passes and
+        # relax_heat calls rebuilds the scheduler from the particle flags
+        self._materialize()
+        self._frozen_state = None
+        if self._scheduling:
+            yield
+            return
+        self._scheduler.rebuild(self._flagged_particles())
+        self._scheduling = True
+        try:
+            yield
+        finally:
+            self._scheduling = False
 
     def run_pass(self, start, finish):
+        with self._scheduled():
+            self._run_pass(start, finish)
+
+    def _run_pass(self, start, finish):
+        scheduler = self._scheduler
         length = distance(start, finish)
         ticks = int(length / self._settings.heater_speed) + 1
         speed = self._settings.heater_speed
         size = self._settings.heater_size
         cooldown_time = self._settings.molten_particle_cooldown_time
+        profiler = self._profiler
+        # with coalescing, particles melted or cooled since the last
+        # relaxation and the ticks that skipped it
+        coalesce = self._settings.heater_coalesce
+        changed = 0
+        skipped = 0
         for i in range(ticks):
+            profiler.begin_tick(self._time)
             x = start.x + (finish.x - start.x) / length * speed * i
             y = start.y + (finish.y - start.y) / length * speed * i
             heater_position = Point(x, y)
 
             # cool timed out particles
-            for particle in self._particles:
-                if 0 < particle.melting_timeout <= self._time:
-                    particle.molten = False
-                    particle.movable = True
+            mark = profiler.start()
+            for particle in scheduler.due(self._time):
+                particle.molten = False
+                particle.movable = True
+                scheduler.move(particle)
+                self._stale_springs.update(particle.springs)
+                changed += 1
+            profiler.stop('cooling', mark)
 
             # heat around x, y
-            for particle in self._particles:
-                if distance(heater_position, particle.point) <= size:
-                    particle.molten = True
-                    particle.melting_timeout = self._time + cooldown_time
-                    particle.movable = True
-
-            for particle in self._particles:
-                for spring in particle.springs:
-                    spring.update_force()
-
-            self.relax_heat()
-
-            for particle in self._particles:
+            mark = profiler.start()
+            heated = self.particles_near(heater_position, size)
+            for particle in heated:
                 if not particle.molten:
-                    particle.movable = False
-
+                    self._stale_springs.update(particle.springs)
+                    changed += 1
+                particle.molten = True
+                particle.melting_timeout = self._time + cooldown_time
+                particle.movable = True
+                scheduler.heat(particle, particle.melting_timeout)
+            profiler.stop('heating', mark)
+            profiler.count('heated', len(heated))
+
+            if coalesce and i < ticks - 1 and \
+               skipped < self._settings.heater_coalesce_ticks and \
+               changed <= self._settings.heater_coalesce_fraction * \
+                          len(heated):
+                # few particles changed, leave them to the next relaxation
+                skipped += 1
+                profiler.count('coalesced')
+            else:
+                mark = profiler.start()
+                self._update_forces()
+                profiler.stop('forces', mark)
+
+                self.relax_heat()
+                changed = 0
+                skipped = 0
+
+            self._tick_done()
+
+            profiler.end_tick()
             self.increment_time()
 
     def run_linear_passes(self, points):
+        with self._scheduled():
+            self._run_linear_passes(points)
+
+    def _run_linear_passes(self, points):
         for start, finish in zip(points, points[1:]):
             self.run_pass(start, finish)
 
         # after-pass cooldown
-        for particle in self._particles:
-            if particle.molten:
-                particle.molten = False
-                particle.movable = True
-
-        for particle in self._particles:
-            for spring in particle.springs:
-                spring.update_force()
+        profiler = self._profiler
+        profiler.begin_tick(self._time)
+        mark = profiler.start()
+        for particle in self._scheduler.molten():
+            particle.molten = False
+            particle.movable = True
+            self._scheduler.move(particle)
+            self._stale_springs.update(particle.springs)
+        profiler.stop('cooling', mark)
+
+        mark = profiler.start()
+        self._update_forces()
+        profiler.stop('forces', mark)
 
         self.relax_heat()
-        self.debug()
+        self._tick_done()
+        profiler.end_tick()
+        if self._verbose:
+            self.debug()
+
+    def _relax_step(self, movable_particles, minimizer = None, active = None):
+        # with a minimizer, the forces and move limits of the particles
+        # (the active ones of the movable list) are handed to it
+        if isinstance(minimizer, NewtonSolver):
+            moves = self._implicit_step(movable_particles, minimizer)
+            if moves is not None:
+                return moves
+            minimizer = None
+
+        max_displacement = 0
+        forces = []
+        for particle in movable_particles:
+            x_displacement = 0
+            y_displacement = 0
+            max_allowable_move = self._settings.spring_default_length / 4
+            neighbours = set()
+
+            for spring, neighbour in particle.links:
+                delta_x = neighbour.x - particle.x
+                delta_y = neighbour.y - particle.y
+                if spring.force > 0:
+                    delta_x = -delta_x
+                    delta_y = -delta_y
+                delta_length = sqrt(delta_x * delta_x + delta_y * delta_y)
+                # make sure not to divide by a zero value
+                if delta_length < 1e-5:
+                    continue
+                delta_x /= delta_length
+                delta_y /= delta_length
+                delta_x *= abs(spring.force)
+                delta_y *= abs(spring.force)
+                x_displacement += delta_x
+                y_displacement += delta_y
+
+                max_allowable_move = min(max_allowable_move,
+                                         spring.actual_length / 4)
+                neighbours.add(neighbour)
+
+            if self._mesh is not None:
+                # triangles around the particle are its triangular faces
+                for neighbour, neighbour2 in self._mesh.triangles(particle):
+                    if neighbour in neighbours and neighbour2 in neighbours:
+                        separation = particle.point.distance_to_line(
+                            Line(neighbour, neighbour2))
+                        max_allowable_move = min(max_allowable_move,
+                                                 separation / 2)
+            else:
+                for neighbour, neighbour2 in self._triangles_around(particle):
+                    if neighbour in neighbours and neighbour2 in neighbours:
+                        separation = particle.point.distance_to_line(
+                            Line(neighbour, neighbour2))
+                        max_allowable_move = min(max_allowable_move,
+                                                 separation / 2)
+
+            if minimizer is not None:
+                forces.append((x_displacement, y_displacement,
+                               max_allowable_move))
+                continue
+
+            particle_move = sqrt(x_displacement * x_displacement +
+                                 y_displacement * y_displacement)
+            if particle_move > max_allowable_move:
+                scale_factor = particle_move / max_allowable_move
+                x_displacement /= scale_factor
+                y_displacement /= scale_factor
+                particle_move = sqrt(x_displacement * x_displacement +
+                                     y_displacement * y_displacement)
+            max_displacement = max(max_displacement, particle_move)
+            particle.displacement = Point(x_displacement, y_displacement)
+
+        if minimizer is not None:
+            count = len(active) if active is not None \
+                    else len(movable_particles)
+            slots = np.flatnonzero(active) if active is not None \
+                    else np.arange(count)
+            x_force, y_force, max_allowable_move = np.zeros((3, count))
+            max_allowable_move[:] = np.inf
+            if forces:
+                x_force[slots], y_force[slots], max_allowable_move[slots] = \
+                    np.array(forces).T
+            x_displacement, y_displacement = minimizer.step(
+                x_force, y_force, max_allowable_move, active)
+            for particle, particle_x, particle_y in zip(
+                    movable_particles, x_displacement[slots].tolist(),
+                    y_displacement[slots].tolist()):
+                particle.displacement = Point(particle_x, particle_y)
+                max_displacement = max(max_displacement,
+                                       sqrt(particle_x * particle_x +
+                                            particle_y * particle_y))
+
+        for particle in movable_particles:
+            particle.apply_displacement()
+
+        return max_displacement
+
+    def _implicit_step(self, movable_particles, solver):
+        # one Newton step over the movable particles, their springs and
+        # the triangles at them, numbered locally with the neighbours
+        # after the movable ones; returns the largest move, or None if the
+        # explicit step has to be taken
+        local = {particle: i for i, particle in enumerate(movable_particles)}
+        particles = list(movable_particles)
+        springs = {}
+        triangles = set()
+        for particle in movable_particles:
+            for spring, neighbour in particle.links:
+                springs[spring] = None
+                if neighbour not in local:
+                    local[neighbour] = len(particles)
+                    particles.append(neighbour)
+            for neighbour, neighbour2 in self._triangles_around(particle):
+                triangles.add(tuple(sorted((local[particle], local[neighbour],
+                                            local[neighbour2]))))
+        ends = np.array([(local[spring.particle1], local[spring.particle2])
+                         for spring in springs],
+                        dtype = np.int64).reshape(-1, 2)
+        implicit = solver.step(
+            np.array([particle.x for particle in particles]),
+            np.array([particle.y for particle in particles]),
+            np.array([particle.radius for particle in particles]),
+            np.arange(len(movable_particles)), ends,
+            np.array([spring.length for spring in springs]),
+            np.array(sorted(triangles), dtype = np.int64).reshape(-1, 3))
+        if implicit is None:
+            return None
+        max_displacement = 0
+        for particle, particle_x, particle_y in zip(
+                movable_particles, implicit[0].tolist(),
+                implicit[1].tolist()):
+            particle.displacement = Point(particle_x, particle_y)
+            particle.apply_displacement()
+            max_displacement = max(max_displacement,
+                                   sqrt(particle_x * particle_x +
+                                        particle_y * particle_y))
+        return max_displacement
+
+    def _update_active_set(self, active_set, kernel, movable_particles, local):
+        # freeze settled particles, wake the neighbours of ones that moved
+        # far and the ends of springs that were added or removed
+        if kernel:
+            movers = active_set.update(kernel.moves)
+            active_set.wake(kernel.neighbours(movers))
+            active_set.wake(kernel.local([particle.index for particle in
+                                          self._touched_particles]))
+        else:
+            moves = [sqrt(particle.displacement.x ** 2 +
+                          particle.displacement.y ** 2) if active else 0
+                     for particle, active in zip(movable_particles,
+                                                 active_set.active)]
+            woken = [local[particle] for particle in self._touched_particles
+                     if particle in local]
+            for mover in active_set.update(moves):
+                for neighbour in movable_particles[mover].neighbours:
+                    if neighbour in local:
+                        woken.append(local[neighbour])
+            active_set.wake(woken)
+        self._touched_particles.clear()
 
     def relax_heat(self):
+        with self._scheduled():
+            return self._relax_heat()
+
+    def _relax_heat(self):
         iteration_count = 0
 
-        movable_particles = []
-        for particle in self._particles:
-            if particle.movable:
-                movable_particles.append(particle)
+        movable_particles = self._scheduler.movable()
+        # springs at particles moved from outside need their forces redone
+        # before the first step, the others were updated by run_pass
+        for particle in movable_particles:
+            self._stale_springs.update(particle.springs)
+        self._update_forces()
+
+        # with the array store, the displacement step and force updates run
+        # batched over all movable particles at once
+        minimizer = None
+        if self._settings.relaxation_method == 'fire':
+            minimizer = Fire(
+                len(movable_particles),
+                tolerance = self._settings.relaxation_convergence_limit)
+        elif self._settings.relaxation_method == 'newton':
+            if NewtonSolver.available():
+                minimizer = NewtonSolver(self._settings)
+            else:
+                print("Warning: scipy is not installed, relaxing explicitly")
+        elif self._settings.relaxation_method != 'steepest':
+            raise ValueError("Unknown relaxation method %s" %
+                             self._settings.relaxation_method)
+        kernel = None
+        if self._store is not None:
+            kernel = self._relaxation_kernel(
+                [p.index for p in movable_particles], minimizer)
+
+        # optionally only keep updating particles which have not settled yet
+        active_set = None
+        if self._settings.relaxation_active_set:
+            active_set = ActiveSet(len(movable_particles),
+                                   self._settings.relaxation_freeze_iterations,
+                                   self._settings.relaxation_convergence_limit,
+                                   self._settings.relaxation_wake_threshold)
+            local = {particle: i for i, particle in enumerate(movable_particles)}
+        self._touched_particles.clear()
+        particle_updates = 0
+        max_displacement = 0
+        converged = False
+        profiler = self._profiler
+        relaxation_mark = profiler.start()
 
         #print("%d movable" % len(movable_particles))
         while iteration_count < self._settings.relaxation_iteration_limit:
-            max_displacement = 0
-            for particle in movable_particles:
-                x_displacement = 0
-                y_displacement = 0
-                max_allowable_move = self._settings.spring_default_length / 4
-                neighbours = set()
-
-                for spring in particle.springs:
-                    delta_x = spring.other_end(particle).x - particle.x
-                    delta_y = spring.other_end(particle).y - particle.y
-                    if spring.force > 0:
-                        delta_x = -delta_x
-                        delta_y = -delta_y
-                    delta_length = sqrt(delta_x * delta_x + delta_y * delta_y)
-                    # make sure not to divide by a zero value
-                    if delta_length < 1e-5:
-                        continue
-                    delta_x /= delta_length
-                    delta_y /= delta_length
-                    delta_x *= abs(spring.force)
-                    delta_y *= abs(spring.force)
-                    x_displacement += delta_x
-                    y_displacement += delta_y
-
-                    max_allowable_move = min(max_allowable_move,
-                                             spring.actual_length / 4)
-                    neighbours.add(spring.other_end(particle))
-
-                checked_neighbours = set()
-                for neighbour in neighbours:
-                    checked_neighbours.add(neighbour)
-                    for neighbour_spring in neighbour.springs:
-                        neighbour2 = neighbour_spring.other_end(neighbour)
-                        if neighbour2 in neighbours and \
-                           not neighbour2 in checked_neighbours:
-                            separation = particle.point.distance_to_line(
-                                Line(neighbour, neighbour2))
-                            max_allowable_move = min(max_allowable_move,
-                                                     separation / 2)
-
-                particle_move = sqrt(x_displacement * x_displacement +
-                                     y_displacement * y_displacement)
-                if particle_move > max_allowable_move:
-                    scale_factor = particle_move / max_allowable_move
-                    x_displacement /= scale_factor
-                    y_displacement /= scale_factor
-                    particle_move = sqrt(x_displacement * x_displacement +
-                                         y_displacement * y_displacement)
-                max_displacement = max(max_displacement, particle_move)
-                particle.displacement = Point(x_displacement, y_displacement)
-
-            for particle in movable_particles:
-                particle.apply_displacement()
+            active_particles = movable_particles
+            if active_set:
+                active_particles = [particle for particle, active in
+                                    zip(movable_particles, active_set.active)
+                                    if active]
+            particle_updates += len(active_particles)
+
+            mark = profiler.start()
+            if kernel:
+                if active_set:
+                    kernel.set_active(active_set.active)
+                max_displacement = kernel.step()
+            else:
+                max_displacement = self._relax_step(
+                    active_particles, minimizer,
+                    active_set.active if active_set else None)
+            profiler.stop('displacement', mark)
 
             min_cycle_length = 4
             max_cycle_length = 4
 
             # delete too long springs
             if iteration_count % 50 == 0:
-                springs = [s for s in particle.springs
-                             for particle in movable_particles
-                             if s.elongation >
-                                self._settings.spring_disconnection_threshold]
-
-                #for particle in movable_particles:
-                #    for spring in particle.springs:
-                #        if spring.elongation >
-                #           self._settings.spring_disconnection_threshold:
-                #            springs.append(spring)
-
-                def compare_spring_elongation(spring1, spring2):
-                    return spring1.elongation > spring2.elongation
+                mark = profiler.start()
+                springs = set()
+                for particle in movable_particles:
+                    for spring in particle.springs:
+                        if spring.elongation > \
+                           self._settings.spring_disconnection_threshold:
+                            springs.add(spring)
 
-                springs.sort(key = cmp_to_key(compare_spring_elongation))
+                # most stretched first
+                springs = sorted(springs, key = lambda spring: spring.elongation,
+                                 reverse = True)
 
                 for spring in springs:
                     # check if spring removal creates any leaves/isolated nodes
@@ -389,8 +1103,9 @@ class SpringSimulator:
 
                     # check if spring removal creates any long cycles (voids)
                     cycle = []
-                    can_remove, can_fix = _spring_can_be_removed(
+                    can_remove, can_fix = self._spring_can_be_removed(
                         spring, min_cycle_length, max_cycle_length, cycle)
+                    profiler.count('removal_checks')
                     if (not can_remove and can_fix):
                         # if a long cycle is created, can it be fixed
                         # with a shorter spring?
@@ -403,81 +1118,104 @@ class SpringSimulator:
                                 continue
 
                             if new_spring.elongation < spring.elongation and \
-                               _spring_can_be_removed(spring, min_cycle_length,
-                                                      max_cycle_length, []):
+                               self._spring_can_be_removed(
+                                   spring, min_cycle_length,
+                                   max_cycle_length, []):
                                 # can eliminate the formed long cycle with
                                 # a shorter spring, keep it
                                 self._recently_added_springs.add(new_spring)
                                 break
                             else:
-                                p1.springs.remove(new_spring)
-                                p2.springs.remove(new_spring)
+                                self._remove_spring(new_spring)
 
                         if new_spring:
                             can_remove = True
 
                     if can_remove:
-                        spring.particle1.springs.remove(spring)
-                        spring.particle2.springs.remove(spring)
+                        self._remove_spring(spring)
+                        profiler.count('springs_removed')
                         if spring in self._recently_added_springs:
                             self._recently_added_springs.remove(spring)
                         else:
                             self._recently_removed_springs.add(spring)
+                profiler.stop('spring_removal', mark)
 
             # create new springs between close particles, but make sure
             # there are no overlaps
             if iteration_count % 50 == 0:
+                mark = profiler.start()
+                self._update_spring_index(movable_particles)
                 for particle in movable_particles:
                     new_partners = set()
-                    _particle_bfs(particle, 2, max_cycle_length, new_partners)
-                    neighbourhood = new_partners.copy()
-                    _particle_bfs(particle, 1, 1, neighbourhood)
+                    profiler.count('bfs_nodes', _particle_bfs(
+                        particle, 2, max_cycle_length, new_partners))
 
                     for partner in new_partners:
                         if distance(particle.point, partner.point) - \
                            particle.radius - partner.radius < \
                            self._settings.spring_default_length * \
                            self._settings.spring_connection_threshold:
-                            # check if new spring will intersect with some other
-                            intersect = False
-                            for other_particle in neighbourhood:
-                                if other_particle == partner:
-                                    continue
-                                for spring in other_particle.springs:
-                                    if spring.other_end(other_particle) in \
-                                       {particle, partner}:
-                                       continue
-
-                                    # check intersection
-                                    if segments_intersect(
-                                        particle.point, partner.point,
-                                        other_particle.point,
-                                        spring.other_end(other_particle).point):
-                                            intersect = True
-                                            break
-
-                                if intersect:
-                                    break
-
-                            if not intersect:
+                            # check if new spring will intersect with some
+                            # other, only testing springs in nearby cells
+                            nearby = self._spring_index.candidates(
+                                particle.x, particle.y, partner.x, partner.y)
+                            profiler.count('intersection_tests', len(nearby))
+                            if not self._backend.crosses(self, particle,
+                                                         partner, nearby):
                                 spring = self._add_spring(particle, partner)
                                 if spring:
                                     self._recently_added_springs.add(spring)
-
-            for particle in movable_particles:
-                for spring in particle.springs:
-                    spring.update_force()
+                                    profiler.count('springs_added')
+                profiler.stop('spring_creation', mark)
+
+            if active_set:
+                mark = profiler.start()
+                self._update_active_set(active_set, kernel, movable_particles,
+                                        local)
+                profiler.stop('active_set', mark)
+
+            mark = profiler.start()
+            if kernel:
+                kernel.update_forces()
+            else:
+                for particle in movable_particles:
+                    for spring in particle.springs:
+                        spring.update_force()
+            profiler.stop('force_update', mark)
 
             iteration_count += 1
 
-            if max_displacement < self._settings.relaxation_convergence_limit:
+            residual = max_displacement
+            if isinstance(minimizer, Fire):
+                residual = minimizer.residual
+            if residual < self._settings.relaxation_convergence_limit:
+                converged = True
                 break
 
+        profiler.stop('relaxation', relaxation_mark)
+        profiler.count('iterations', iteration_count)
+        self._last_relaxation = {
+            'movable': len(movable_particles),
+            'iterations': iteration_count,
+            'converged': converged,
+            'max_displacement': max_displacement,
+            'particle_updates': particle_updates,
+            'frozen': len(movable_particles) - active_set.active_count
+                      if active_set else 0}
+
+        self._update_spring_index(movable_particles)
+        self._particle_index.move_many(
+            [particle.index for particle in movable_particles],
+            [particle.x for particle in movable_particles],
+            [particle.y for particle in movable_particles])
         for particle in movable_particles:
             if not particle.molten:
                 particle.movable = False
+                self._scheduler.settle(particle)
+        self._compact()
 
         #print("%d steps" % iteration_count)
+        return self._last_relaxation
 
     def to_shape(self):
         # return shape
@@ -0,0 +1,124 @@
+import json
+import struct
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+from settings import SimulatorSettings
+from state import SimulatorState
+
+# binary snapshot layout:
+#   magic, format version (uint32), header length (uint32), JSON header,
+#   padding, then the raw arrays, each starting at a multiple of ALIGNMENT;
+# the header holds the time, the settings and the dtype, shape and offset
+# of every array, so loading maps the file and takes views into it
+MAGIC = b'SPRSNAP\0'
+VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sII')
+
+# SimulatorState property -> stored dtype (little-endian)
+_ARRAYS = (('x', '<f8'), ('y', '<f8'), ('molten', '|b1'),
+           ('movable', '|b1'), ('melting_timeout', '<i8'),
+           ('springs', '<i8'), ('rest_length', '<f8'))
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _settings_values(settings):
+    # all settings are stored as "_name" attributes behind a "name" property
+    return {name[1:]: value for name, value in vars(settings).items()}
+
+def is_snapshot(filename):
+    try:
+        with open(filename, 'rb') as snapshot:
+            return snapshot.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def write_snapshot(filename, state, settings = None):
+    arrays = [(name, np.ascontiguousarray(getattr(state, name),
+                                          dtype = dtype))
+              for name, dtype in _ARRAYS]
+    descriptions = {}
+    offset = 0
+    for name, array in arrays:
+        descriptions[name] = {'dtype': array.dtype.str,
+                              'shape': list(array.shape),
+                              'offset': offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({
+        'time': state.time,
+        'settings': _settings_values(settings) if settings else None,
+        'arrays': descriptions}).encode('utf-8')
+    data_offset = _align(_PREAMBLE.size + len(header))
+
+    with open(filename, 'wb') as snapshot:
+        snapshot.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        snapshot.write(header)
+        for name, array in arrays:
+            snapshot.write(b'\0' * (data_offset +
+                                    descriptions[name]['offset'] -
+                                    snapshot.tell()))
+            snapshot.write(array.tobytes())
+
+def read_snapshot(filename):
+    # returns (state, settings or None); the state arrays are read-only
+    # views of the memory-mapped file, nothing is parsed or copied
+    with open(filename, 'rb') as snapshot:
+        magic, version, header_length = \
+            _PREAMBLE.unpack(snapshot.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a simulator snapshot" % filename)
+        if version > VERSION:
+            raise ValueError("Snapshot %s has unsupported version %d" %
+                             (filename, version))
+        header = json.loads(snapshot.read(header_length).decode('utf-8'))
+    data_offset = _align(_PREAMBLE.size + header_length)
+
+    data = np.memmap(filename, dtype = np.uint8, mode = 'r')
+    arrays = {}
+    for name, _ in _ARRAYS:
+        description = header['arrays'][name]
+        dtype = np.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        start = data_offset + description['offset']
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(data, dtype = dtype, count = count,
+                                     offset = start).reshape(shape)
+
+    settings = None
+    if header['settings'] is not None:
+        settings = SimulatorSettings()
+        for name, value in header['settings'].items():
+            if hasattr(settings, name):
+                setattr(settings, name, value)
+    state = SimulatorState(arrays['x'], arrays['y'], arrays['molten'],
+                           arrays['movable'], arrays['melting_timeout'],
+                           arrays['springs'], arrays['rest_length'],
+                           header['time'])
+    return state, settings
+
+def write_xml(filename, state, settings = None):
+    # plain XML for interchange, the binary snapshot is the fast path
+    root = ElementTree.Element('simulator', time = str(state.time))
+    if settings:
+        ElementTree.SubElement(root, 'settings', {
+            name: str(value)
+            for name, value in _settings_values(settings).items()})
+    particles = ElementTree.SubElement(root, 'particles')
+    for i in range(state.particle_count):
+        ElementTree.SubElement(particles, 'particle', {
+            'id': str(i),
+            'x': repr(float(state.x[i])),
+            'y': repr(float(state.y[i])),
+            'molten': str(bool(state.molten[i])).lower(),
+            'movable': str(bool(state.movable[i])).lower(),
+            'timeout': str(int(state.melting_timeout[i]))})
+    springs = ElementTree.SubElement(root, 'springs')
+    for (i, j), length in zip(state.springs, state.rest_length):
+        ElementTree.SubElement(springs, 'spring', {
+            'p1': str(int(i)), 'p2': str(int(j)),
+            'length': repr(float(length))})
+    ElementTree.ElementTree(root).write(filename, encoding = 'utf-8',
+                                        xml_declaration = True)
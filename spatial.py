@@ -0,0 +1,272 @@
+import numpy as np
+
+from math import floor
+
+class UniformGrid:
+    """ Uniform-grid spatial hash of points supporting radius queries. """
+    # points are integer ids, bucketed as segments of zero length
+    def __init__(self, cell_size):
+        self._cells = SegmentGrid(cell_size)
+        self._x = np.zeros(0)
+        self._y = np.zeros(0)
+
+    @property
+    def cell_size(self):
+        return self._cells.cell_size
+
+    def __len__(self):
+        return len(self._cells)
+
+    def __contains__(self, item):
+        return item in self._cells
+
+    def _reserve(self, size):
+        if size > len(self._x):
+            capacity = max(size, 2 * len(self._x), 1024)
+            for name in ('_x', '_y'):
+                grown = np.zeros(capacity)
+                grown[:len(getattr(self, name))] = getattr(self, name)
+                setattr(self, name, grown)
+
+    def clear(self):
+        self.__init__(self.cell_size)
+
+    def insert(self, item, x, y):
+        self._reserve(item + 1)
+        self._cells.insert(item, x, y, x, y)
+        self._x[item] = x
+        self._y[item] = y
+
+    def extend(self, items, x, y):
+        # bulk insert of new items, given as arrays
+        items = np.asarray(items, dtype = np.int64)
+        if len(items) == 0:
+            return
+        self._reserve(int(items.max()) + 1)
+        self._cells.extend(items, x, y, x, y)
+        self._x[items] = x
+        self._y[items] = y
+
+    def remove(self, item):
+        self._cells.remove(item)
+
+    def move(self, item, x, y):
+        # only re-bucket when the item actually crosses a cell border
+        self._cells.move(item, x, y, x, y)
+        self._x[item] = x
+        self._y[item] = y
+
+    def move_many(self, items, x, y):
+        # move for arrays of items
+        self._cells.move_many(items, x, y, x, y)
+        self._x[items] = x
+        self._y[items] = y
+
+    def position(self, item):
+        return (float(self._x[item]), float(self._y[item]))
+
+    def positions(self, items):
+        # x and y arrays of the given items
+        return self._x[items], self._y[items]
+
+    def candidates(self, x, y, radius):
+        # ids of the items of all cells overlapping the square around the
+        # circle
+        return self._cells.candidates(x - radius, y - radius,
+                                      x + radius, y + radius)
+
+    def query(self, x, y, radius):
+        # ids of all items within radius of (x, y), border included
+        found = self.candidates(x, y, radius)
+        item_x = self._x[found]
+        item_y = self._y[found]
+        return found[np.sqrt((x - item_x) * (x - item_x) +
+                             (y - item_y) * (y - item_y)) <= radius]
+
+class SegmentGrid:
+    """ Uniform grid of segments bucketed by their bounding boxes. """
+    # segments are integer ids. Most entries sit in a table of (cell, id)
+    # pairs sorted by cell, built in one go from the bounding boxes of all
+    # segments; those inserted or moved since then go to per-cell lists,
+    # which are folded into the table once they hold enough entries
+    _OFFSET = 1 << 20
+
+    def __init__(self, cell_size):
+        self._cell_size = cell_size
+        self._count = 0
+        # per id: cell range (min x, min y, max x, max y), whether it is in
+        # the grid and whether its table entries are current
+        self._ranges = np.zeros((0, 4), dtype = np.int32)
+        self._present = np.zeros(0, dtype = bool)
+        self._packed = np.zeros(0, dtype = bool)
+        self._keys = np.zeros(0, dtype = np.int64)
+        self._ids = np.zeros(0, dtype = np.int64)
+        self._cells = {}
+        self._loose = 0
+        # set when segments were added in bulk, the table is rebuilt on
+        # the next query
+        self._stale = False
+
+    @property
+    def cell_size(self):
+        return self._cell_size
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, item):
+        return item < len(self._present) and bool(self._present[item])
+
+    def _key(self, cell_x, cell_y):
+        return (cell_x + self._OFFSET) * (2 * self._OFFSET) + \
+               cell_y + self._OFFSET
+
+    def _range(self, x1, y1, x2, y2):
+        return (floor(min(x1, x2) / self._cell_size),
+                floor(min(y1, y2) / self._cell_size),
+                floor(max(x1, x2) / self._cell_size),
+                floor(max(y1, y2) / self._cell_size))
+
+    def _ranges_of(self, x1, y1, x2, y2):
+        return np.column_stack((
+            np.floor(np.minimum(x1, x2) / self._cell_size),
+            np.floor(np.minimum(y1, y2) / self._cell_size),
+            np.floor(np.maximum(x1, x2) / self._cell_size),
+            np.floor(np.maximum(y1, y2) / self._cell_size))).astype(np.int32)
+
+    def _keys_of(self, cell_range):
+        min_x, min_y, max_x, max_y = cell_range
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                yield self._key(cell_x, cell_y)
+
+    def _reserve(self, size):
+        if size > len(self._present):
+            capacity = max(size, 2 * len(self._present), 1024)
+            ranges = np.zeros((capacity, 4), dtype = np.int32)
+            ranges[:len(self._ranges)] = self._ranges
+            self._ranges = ranges
+            for name in ('_present', '_packed'):
+                grown = np.zeros(capacity, dtype = bool)
+                grown[:len(getattr(self, name))] = getattr(self, name)
+                setattr(self, name, grown)
+
+    def clear(self):
+        self.__init__(self._cell_size)
+
+    def insert(self, item, x1, y1, x2, y2):
+        if item in self:
+            self.move(item, x1, y1, x2, y2)
+            return
+        self._reserve(item + 1)
+        cell_range = self._range(x1, y1, x2, y2)
+        self._ranges[item] = cell_range
+        self._present[item] = True
+        self._packed[item] = False
+        for key in self._keys_of(cell_range):
+            self._cells.setdefault(key, []).append(item)
+            self._loose += 1
+        self._count += 1
+
+    def extend(self, items, x1, y1, x2, y2):
+        # bulk insert of new items, given as arrays
+        items = np.asarray(items, dtype = np.int64)
+        if len(items) == 0:
+            return
+        self._reserve(int(items.max()) + 1)
+        self._ranges[items] = self._ranges_of(x1, y1, x2, y2)
+        self._present[items] = True
+        self._packed[items] = True
+        self._count += len(items)
+        self._stale = True
+
+    def remove(self, item):
+        if not item in self:
+            return
+        if not self._packed[item]:
+            for key in self._keys_of(self._ranges[item].tolist()):
+                bucket = self._cells[key]
+                bucket.remove(item)
+                self._loose -= 1
+                if not bucket:
+                    del self._cells[key]
+        self._present[item] = False
+        self._packed[item] = False
+        self._count -= 1
+
+    def move(self, item, x1, y1, x2, y2):
+        # only re-bucket when the bounding box covers different cells
+        if tuple(self._ranges[item].tolist()) != \
+           self._range(x1, y1, x2, y2):
+            self.remove(item)
+            self.insert(item, x1, y1, x2, y2)
+
+    def move_many(self, items, x1, y1, x2, y2):
+        # move for arrays of items
+        items = np.asarray(items, dtype = np.int64)
+        ranges = self._ranges_of(x1, y1, x2, y2)
+        changed = (ranges != self._ranges[items]).any(axis = 1)
+        for item, x_1, y_1, x_2, y_2 in zip(
+                items[changed].tolist(), np.asarray(x1)[changed].tolist(),
+                np.asarray(y1)[changed].tolist(),
+                np.asarray(x2)[changed].tolist(),
+                np.asarray(y2)[changed].tolist()):
+            self.remove(item)
+            self.insert(item, x_1, y_1, x_2, y_2)
+
+    def renumber(self, mapping):
+        # ids changed to mapping[id], -1 for removed ones
+        kept = mapping >= 0
+        count = int(kept.sum())
+        for name in ('_ranges', '_present'):
+            array = getattr(self, name)
+            array[:count] = array[:len(mapping)][kept]
+            array[count:] = 0
+        self._pack()
+
+    def _pack(self):
+        # rebuild the table from the ranges of all items, emptying the lists
+        self._packed[:] = self._present
+        items = np.flatnonzero(self._present)
+        ranges = self._ranges[items].astype(np.int64)
+        width = ranges[:, 2] - ranges[:, 0] + 1
+        counts = width * (ranges[:, 3] - ranges[:, 1] + 1)
+        entry = np.repeat(np.arange(len(items)), counts)
+        offset = np.arange(len(entry)) - np.repeat(np.cumsum(counts) - counts,
+                                                   counts)
+        cell_x = ranges[entry, 0] + offset % width[entry]
+        cell_y = ranges[entry, 1] + offset // width[entry]
+        keys = self._key(cell_x, cell_y)
+        order = np.argsort(keys, kind = 'stable')
+        self._keys = keys[order]
+        self._ids = items[entry[order]]
+        self._cells = {}
+        self._loose = 0
+        self._stale = False
+
+    def candidates(self, x1, y1, x2, y2):
+        # items whose bounding box may overlap that of the given segment,
+        # as an array of ids
+        if self._stale or self._loose > max(1024, len(self._keys) // 4):
+            self._pack()
+        min_x, min_y, max_x, max_y = self._range(x1, y1, x2, y2)
+        found = []
+        # the cells of one column have consecutive keys
+        columns = np.arange(min_x, max_x + 1)
+        first = np.searchsorted(self._keys, self._key(columns, min_y))
+        last = np.searchsorted(self._keys, self._key(columns, max_y),
+                               side = 'right')
+        for start, stop in zip(first.tolist(), last.tolist()):
+            if start < stop:
+                found.append(self._ids[start:stop])
+        if found:
+            found = [np.concatenate(found)]
+            found[0] = found[0][self._packed[found[0]]]
+        if self._cells:
+            for key in self._keys_of((min_x, min_y, max_x, max_y)):
+                bucket = self._cells.get(key)
+                if bucket:
+                    found.append(np.array(bucket, dtype = np.int64))
+        if not found:
+            return np.zeros(0, dtype = np.int64)
+        return np.unique(np.concatenate(found))
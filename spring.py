@@ -1,16 +1,34 @@
 from geometry import distance
 
 class Spring:
-    def __init__(self, p1, p2, length, settings):
+    __slots__ = ('_p1', '_p2', '_length', '_settings', '_force',
+                 '_actual_length', '_dirty', '_index')
+
+    def __init__(self, p1, p2, length, settings, index = None):
         self._p1 = p1
         self._p2 = p2
         self._length = length
         self._settings = settings
+        self._index = index
 
-        self._p1.springs.append(self)
-        self._p2.springs.append(self)
+        self._p1.attach_spring(self, p2)
+        self._p2.attach_spring(self, p1)
 
         self._force = 0
+        # actual length is cached until an end moves or changes its radius,
+        # the force until the next update_force after that
+        self._actual_length = None
+        self._dirty = True
+
+    # id in the simulator's EdgeIndex, which renumbers springs when it
+    # closes up removed ones
+    @property
+    def index(self):
+        return self._index
+
+    @index.setter
+    def index(self, index):
+        self._index = index
 
     @property
     def particle1(self):
@@ -27,6 +45,7 @@ class Spring:
     @settings.setter
     def settings(self, new_settings):
         self._settings = new_settings
+        self.invalidate()
 
     @property
     def length(self):
@@ -34,7 +53,10 @@ class Spring:
 
     @property
     def actual_length(self):
-        return distance(self._p1, self._p2) - self._p1.radius - self._p2.radius
+        if self._actual_length is None:
+            self._actual_length = distance(self._p1, self._p2) - \
+                                  self._p1.radius - self._p2.radius
+        return self._actual_length
 
     @property
     def elongation(self):
@@ -44,14 +66,32 @@ class Spring:
     def force(self):
         return self._force
 
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def invalidate(self):
+        self._actual_length = None
+        self._dirty = True
+
     def update_force(self):
-        if self.actual_length < self.length:
-            self._force = (1 / self.actual_length - 1 / self.length) * \
+        # no-op unless an end moved or changed its radius since the last call
+        if not self._dirty:
+            return
+        actual_length = self.actual_length
+        length = self.length
+        if actual_length < length:
+            self._force = (1 / actual_length - 1 / length) * \
                           self._settings.spring_default_stiffness * \
-                          self.length * self.length / 2
+                          length * length / 2
         else:
             self._force = self._settings.spring_default_stiffness * \
-                          (self.length - self.actual_length)
+                          (length - actual_length)
+        self._dirty = False
+
+    def detach(self):
+        self._p1.detach_spring(self)
+        self._p2.detach_spring(self)
 
     def other_end(self, particle):
         if self._p1 == particle:
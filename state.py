@@ -0,0 +1,66 @@
+import numpy as np
+
+class SimulatorState:
+    """ Particle and spring state of a simulator as plain arrays. """
+    # particles are numbered by their position in SpringSimulator.particles;
+    # springs are kept in creation order, which is also the order they are
+    # attached to each particle in, so a restored simulator sums spring
+    # forces in the same order and continues exactly like the saved one
+    def __init__(self, x, y, molten, movable, melting_timeout, springs,
+                 rest_length, time):
+        self._x = np.asarray(x, dtype = np.float64)
+        self._y = np.asarray(y, dtype = np.float64)
+        self._molten = np.asarray(molten, dtype = bool)
+        self._movable = np.asarray(movable, dtype = bool)
+        self._melting_timeout = np.asarray(melting_timeout, dtype = np.int64)
+        self._springs = np.asarray(springs, dtype = np.int64).reshape(-1, 2)
+        self._rest_length = np.asarray(rest_length, dtype = np.float64)
+        self._time = int(time)
+
+    def freeze(self):
+        # make the arrays read-only, so the state can be shared
+        for array in (self._x, self._y, self._molten, self._movable,
+                      self._melting_timeout, self._springs,
+                      self._rest_length):
+            array.flags.writeable = False
+
+    @property
+    def particle_count(self):
+        return len(self._x)
+
+    @property
+    def spring_count(self):
+        return len(self._springs)
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    @property
+    def molten(self):
+        return self._molten
+
+    @property
+    def movable(self):
+        return self._movable
+
+    @property
+    def melting_timeout(self):
+        return self._melting_timeout
+
+    @property
+    def springs(self):
+        # (particle, particle) pairs of positions in the particle arrays
+        return self._springs
+
+    @property
+    def rest_length(self):
+        return self._rest_length
+
+    @property
+    def time(self):
+        return self._time
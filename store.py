@@ -0,0 +1,707 @@
+import numpy as np
+
+from multiprocessing import shared_memory
+
+from geometry import Point, distance
+
+class ParticleStore:
+    """ Structure-of-arrays storage for particles and springs. """
+    # particle state is kept in arrays indexed by particle id, springs in an
+    # edge list indexed by spring id; StoredParticle/StoredSpring are thin
+    # views over them, made when first asked for, so batched kernels can
+    # work on the arrays directly. Spring ids follow creation order; the
+    # slots of removed springs are taken back by compact()
+    _PARTICLE_ARRAYS = ('_x', '_y', '_dx', '_dy', '_molten', '_movable',
+                        '_melting_timeout')
+    _SPRING_ARRAYS = ('_edges', '_rest_length', '_force', '_actual_length',
+                      '_dirty', '_alive')
+    def __init__(self, capacity = 1024, shared = False, settings = None):
+        capacity = max(capacity, 1)
+        # the settings particle radii and spring forces of the views use
+        self._settings = settings
+        # with shared set, arrays live in multiprocessing.shared_memory
+        # blocks which worker processes can attach to by name
+        self._shared = shared
+        self._blocks = {}
+        self._retired = []
+
+        self._particle_count = 0
+        self._x = self._allocate('_x', capacity, np.float64)
+        self._y = self._allocate('_y', capacity, np.float64)
+        self._dx = self._allocate('_dx', capacity, np.float64)
+        self._dy = self._allocate('_dy', capacity, np.float64)
+        self._molten = self._allocate('_molten', capacity, bool)
+        self._movable = self._allocate('_movable', capacity, bool)
+        self._melting_timeout = self._allocate('_melting_timeout', capacity,
+                                               np.int64)
+        # ids of the springs at each particle and of the particles at their
+        # other ends, in attachment order (which is id order) up to degree;
+        # only read here, so never shared
+        self._degree = np.zeros(capacity, dtype = np.int32)
+        self._incident = np.zeros((capacity, 8), dtype = np.int32)
+        self._adjacent = np.zeros((capacity, 8), dtype = np.int32)
+        self._particle_views = []
+
+        self._edge_count = 0
+        self._spring_count = 0
+        self._edges = self._allocate('_edges', (capacity, 2), np.int64)
+        self._rest_length = self._allocate('_rest_length', capacity,
+                                           np.float64)
+        self._force = self._allocate('_force', capacity, np.float64)
+        # cached actual lengths (NaN when stale) and stale force flags
+        self._actual_length = self._allocate('_actual_length', capacity,
+                                             np.float64, np.nan)
+        self._dirty = self._allocate('_dirty', capacity, bool, True)
+        self._alive = self._allocate('_alive', capacity, bool)
+        self._spring_views = []
+
+        # bumped on every spring addition/removal to invalidate adjacency
+        self._topology_version = 0
+        self._adjacency = None
+        self._adjacency_version = -1
+        self._triangles = None
+        self._triangles_version = -1
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        # move the arrays to private memory and release the shared blocks,
+        # the store stays usable but is no longer shared
+        for name in list(self._blocks):
+            setattr(self, name, getattr(self, name).copy())
+            self._free(self._blocks.pop(name))
+        retired = self._retired
+        self._retired = []
+        for block in retired:
+            self._close_block(block)
+        self._shared = False
+
+    def share(self):
+        # move the arrays to shared memory, the inverse of close()
+        if self._shared:
+            return
+        self._shared = True
+        for name in self._PARTICLE_ARRAYS + self._SPRING_ARRAYS:
+            array = getattr(self, name)
+            shared = self._allocate(name, array.shape, array.dtype)
+            shared[...] = array
+            setattr(self, name, shared)
+
+    def _free(self, block):
+        block.unlink()
+        self._close_block(block)
+
+    def _close_block(self, block):
+        try:
+            block.close()
+        except BufferError:
+            # still viewed by some array, tried again on close()
+            self._retired.append(block)
+
+    def _allocate(self, name, shape, dtype, fill = 0):
+        if not self._shared:
+            return np.full(shape, fill, dtype = dtype)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        block = shared_memory.SharedMemory(create = True, size = max(size, 1))
+        # frombuffer keeps the block exported, so it cannot be unmapped
+        # under a live array
+        array = np.frombuffer(block.buf, dtype = dtype,
+                              count = int(np.prod(shape))).reshape(shape)
+        array.fill(fill)
+        self._blocks[name] = block
+        return array
+
+    def _grow(self, name, size, fill = 0):
+        array = getattr(self, name)
+        if size <= len(array):
+            return array
+        capacity = max(size, 2 * len(array))
+        block = self._blocks.pop(name, None)
+        grown = self._allocate(name, (capacity,) + array.shape[1:],
+                               array.dtype, fill)
+        grown[:len(array)] = array
+        if block is not None:
+            self._free(block)
+        return grown
+
+    def _reserve_particles(self, size):
+        if size > len(self._x):
+            for name in self._PARTICLE_ARRAYS:
+                setattr(self, name, self._grow(name, size))
+        if size > len(self._degree):
+            capacity = max(size, 2 * len(self._degree))
+            degree = np.zeros(capacity, dtype = np.int32)
+            degree[:len(self._degree)] = self._degree
+            self._degree = degree
+            self._incident = self._resize_rows(self._incident, capacity)
+            self._adjacent = self._resize_rows(self._adjacent, capacity)
+
+    @staticmethod
+    def _resize_rows(table, rows, width = None):
+        width = table.shape[1] if width is None else width
+        resized = np.zeros((rows, width), dtype = table.dtype)
+        resized[:len(table), :table.shape[1]] = table
+        return resized
+
+    def _widen(self, width):
+        # room for width springs at every particle
+        if width > self._incident.shape[1]:
+            width = max(width, 2 * self._incident.shape[1])
+            rows = len(self._incident)
+            self._incident = self._resize_rows(self._incident, rows, width)
+            self._adjacent = self._resize_rows(self._adjacent, rows, width)
+
+    def _reserve_springs(self, size):
+        if size > len(self._edges):
+            for name in ('_edges', '_rest_length', '_force', '_alive'):
+                setattr(self, name, self._grow(name, size))
+            self._actual_length = self._grow('_actual_length', size, np.nan)
+            self._dirty = self._grow('_dirty', size, True)
+
+    def reserve(self, particles, springs):
+        # make room for this many particles and springs in total up front,
+        # for bulk construction
+        self._reserve_particles(particles)
+        self._reserve_springs(springs)
+
+    @property
+    def shared(self):
+        return self._shared
+
+    def shared_arrays(self):
+        # name -> (block name, shape, dtype) of every shared array
+        return {name.lstrip('_'): (block.name, getattr(self, name).shape,
+                                   getattr(self, name).dtype.str)
+                for name, block in self._blocks.items()}
+
+    @property
+    def particle_count(self):
+        return self._particle_count
+
+    @property
+    def spring_count(self):
+        return self._spring_count
+
+    @property
+    def edge_count(self):
+        # includes removed springs until the store is compacted
+        return self._edge_count
+
+    @property
+    def topology_version(self):
+        return self._topology_version
+
+    @property
+    def x(self):
+        return self._x[:self._particle_count]
+
+    @property
+    def y(self):
+        return self._y[:self._particle_count]
+
+    @property
+    def dx(self):
+        return self._dx[:self._particle_count]
+
+    @property
+    def dy(self):
+        return self._dy[:self._particle_count]
+
+    @property
+    def molten(self):
+        return self._molten[:self._particle_count]
+
+    @property
+    def movable(self):
+        return self._movable[:self._particle_count]
+
+    @property
+    def melting_timeout(self):
+        return self._melting_timeout[:self._particle_count]
+
+    @property
+    def edges(self):
+        return self._edges[:self._edge_count]
+
+    @property
+    def rest_length(self):
+        return self._rest_length[:self._edge_count]
+
+    @property
+    def force(self):
+        return self._force[:self._edge_count]
+
+    @property
+    def actual_length(self):
+        return self._actual_length[:self._edge_count]
+
+    @property
+    def dirty(self):
+        return self._dirty[:self._edge_count]
+
+    @property
+    def alive(self):
+        return self._alive[:self._edge_count]
+
+    @property
+    def settings(self):
+        return self._settings
+
+    @settings.setter
+    def settings(self, new_settings):
+        # forces are redone with the new ones on the next update
+        self._settings = new_settings
+        self.actual_length[:] = np.nan
+        self.dirty[:] = True
+
+    @property
+    def particles(self):
+        return StoredParticles(self)
+
+    def particle(self, index):
+        view = self._particle_views[index]
+        if view is None:
+            view = StoredParticle(self, int(index))
+            self._particle_views[index] = view
+        return view
+
+    def spring(self, index):
+        view = self._spring_views[index]
+        if view is None:
+            view = StoredSpring(self, int(index))
+            self._spring_views[index] = view
+        return view
+
+    def incident(self, index):
+        # ids of the springs at a particle, in attachment order
+        return self._incident[index, :self._degree[index]]
+
+    def adjacent(self, index):
+        # ids of the particles at the other ends of those springs
+        return self._adjacent[index, :self._degree[index]]
+
+    def springs_at(self, particles):
+        # ids of the springs at any of the given particles, each once
+        particles = np.asarray(particles, dtype = np.int64)
+        attached = np.arange(self._incident.shape[1]) < \
+                   self._degree[particles, None]
+        return np.unique(self._incident[particles][attached]).astype(np.int64)
+
+    def invalidate_springs(self, index):
+        springs = self.incident(index)
+        self._actual_length[springs] = np.nan
+        self._dirty[springs] = True
+
+    def radii(self, settings):
+        return np.where(self.molten, settings.molten_particle_default_radius,
+                        settings.particle_default_radius)
+
+    def add_particle(self, x, y):
+        return self.add_particles([x], [y])
+
+    def add_particles(self, x, y):
+        # returns the id of the first one, the others follow it
+        first = self._particle_count
+        count = len(x)
+        self._reserve_particles(first + count)
+        added = slice(first, first + count)
+        self._x[added] = x
+        self._y[added] = y
+        self._dx[added] = 0
+        self._dy[added] = 0
+        self._molten[added] = False
+        self._movable[added] = False
+        self._melting_timeout[added] = 0
+        self._degree[added] = 0
+        self._particle_views.extend([None] * count)
+        self._particle_count += count
+        return first
+
+    def add_spring(self, i, j, length):
+        index = self._edge_count
+        self._reserve_springs(index + 1)
+        self._edges[index] = (i, j)
+        self._rest_length[index] = length
+        self._force[index] = 0
+        self._actual_length[index] = np.nan
+        self._dirty[index] = True
+        self._alive[index] = True
+        self._spring_views.append(None)
+        self._attach(i, index, j)
+        self._attach(j, index, i)
+        self._edge_count += 1
+        self._spring_count += 1
+        self._topology_version += 1
+        return index
+
+    def add_springs(self, ends, lengths):
+        # bulk add_spring; returns the id of the first one, the others
+        # follow it
+        ends = np.asarray(ends, dtype = np.int64).reshape(-1, 2)
+        first = self._edge_count
+        count = len(ends)
+        self._reserve_springs(first + count)
+        added = slice(first, first + count)
+        self._edges[added] = ends
+        self._rest_length[added] = lengths
+        self._force[added] = 0
+        self._actual_length[added] = np.nan
+        self._dirty[added] = True
+        self._alive[added] = True
+        self._spring_views.extend([None] * count)
+
+        # new ids are above all attached ones, so each particle gets its
+        # new springs appended in id order
+        springs = np.arange(first, first + count)
+        owners = np.concatenate((ends[:, 0], ends[:, 1]))
+        others = np.concatenate((ends[:, 1], ends[:, 0]))
+        springs = np.concatenate((springs, springs))
+        order = np.lexsort((springs, owners))
+        owners = owners[order]
+        counts = np.bincount(owners, minlength = self._particle_count)
+        starts = np.cumsum(counts) - counts
+        slots = self._degree[owners] + np.arange(len(owners)) - starts[owners]
+        if len(slots):
+            self._widen(int(slots.max()) + 1)
+        self._incident[owners, slots] = springs[order]
+        self._adjacent[owners, slots] = others[order]
+        self._degree[:self._particle_count] += counts.astype(np.int32)
+
+        self._edge_count += count
+        self._spring_count += count
+        self._topology_version += 1
+        return first
+
+    def _attach(self, particle, spring, other):
+        degree = self._degree[particle]
+        self._widen(degree + 1)
+        self._incident[particle, degree] = spring
+        self._adjacent[particle, degree] = other
+        self._degree[particle] = degree + 1
+
+    def _detach(self, particle, spring):
+        degree = self._degree[particle]
+        incident = self._incident[particle]
+        adjacent = self._adjacent[particle]
+        slot = int(np.flatnonzero(incident[:degree] == spring)[0])
+        incident[slot:degree - 1] = incident[slot + 1:degree]
+        adjacent[slot:degree - 1] = adjacent[slot + 1:degree]
+        self._degree[particle] = degree - 1
+
+    def remove_spring(self, index):
+        if self._alive[index]:
+            self._alive[index] = False
+            self._detach(self._edges[index, 0], index)
+            self._detach(self._edges[index, 1], index)
+            self._spring_views[index] = None
+            self._spring_count -= 1
+            self._topology_version += 1
+
+    def compact(self):
+        # move the alive springs down over the slots of removed ones,
+        # keeping their order; returns the new id of each old one (-1 for
+        # removed ones), or None if no spring was removed
+        if self._spring_count == self._edge_count:
+            return None
+        kept = np.flatnonzero(self.alive)
+        mapping = np.full(self._edge_count, -1, dtype = np.int64)
+        mapping[kept] = np.arange(len(kept))
+        for name in self._SPRING_ARRAYS:
+            array = getattr(self, name)
+            array[:len(kept)] = array[kept]
+        self._alive[len(kept):self._edge_count] = False
+
+        incident = self._incident[:self._particle_count]
+        attached = np.arange(incident.shape[1]) < \
+                   self._degree[:self._particle_count, None]
+        incident[attached] = mapping[incident[attached]]
+        views = [self._spring_views[index] for index in kept.tolist()]
+        for index, view in enumerate(views):
+            if view is not None:
+                view._index = index
+        self._spring_views = views
+
+        self._edge_count = len(kept)
+        self._topology_version += 1
+        return mapping
+
+    def new_particle(self, x = 0, y = 0):
+        return self.particle(self.add_particle(x, y))
+
+    def new_spring(self, p1, p2, length):
+        return self.spring(self.add_spring(p1.index, p2.index, length))
+
+    def adjacency(self):
+        # CSR adjacency over alive springs: neighbours of particle i are
+        # neighbours[indptr[i]:indptr[i + 1]], connected by spring_ids[...]
+        if self._adjacency_version != self._topology_version:
+            spring_ids = np.flatnonzero(self.alive)
+            ends = self._edges[spring_ids]
+            sources = np.concatenate((ends[:, 0], ends[:, 1]))
+            targets = np.concatenate((ends[:, 1], ends[:, 0]))
+            order = np.argsort(sources, kind = 'stable')
+            indptr = np.zeros(self._particle_count + 1, dtype = np.int64)
+            np.cumsum(np.bincount(sources, minlength = self._particle_count),
+                      out = indptr[1:])
+            self._adjacency = (indptr, targets[order],
+                               np.concatenate((spring_ids, spring_ids))[order])
+            self._adjacency_version = self._topology_version
+        return self._adjacency
+
+    def triangles(self):
+        # all spring triangles (i, j, k) with i < j < k
+        if self._triangles_version != self._topology_version:
+            indptr, neighbours, _ = self.adjacency()
+            ends = np.sort(self.edges[self.alive], axis = 1)
+            first = ends[:, 0]
+            second = ends[:, 1]
+            # candidate third corners: every neighbour of the first end
+            degrees = indptr[first + 1] - indptr[first]
+            edge = np.repeat(np.arange(len(ends)), degrees)
+            slots = np.repeat(indptr[first] - (np.cumsum(degrees) - degrees),
+                              degrees) + np.arange(degrees.sum())
+            third = neighbours[slots]
+            keep = third > second[edge]
+            edge = edge[keep]
+            third = third[keep]
+            # ... which must also be connected to the second end
+            keys = np.sort(first * self._particle_count + second)
+            wanted = second[edge] * self._particle_count + third
+            found = np.searchsorted(keys, wanted)
+            found[found == len(keys)] = 0
+            closed = keys[found] == wanted if len(keys) else \
+                     np.zeros(0, dtype = bool)
+            self._triangles = np.column_stack((first[edge[closed]],
+                                               second[edge[closed]],
+                                               third[closed]))
+            self._triangles_version = self._topology_version
+        return self._triangles
+
+class StoredParticles:
+    """ The particles of a ParticleStore as a sequence of views. """
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return self._store.particle_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._store.particle(i)
+                    for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("particle index out of range")
+        return self._store.particle(index)
+
+    def __iter__(self):
+        particle = self._store.particle
+        for index in range(len(self)):
+            yield particle(index)
+
+class StoredParticle:
+    """ A particle of a ParticleStore, which holds all its state. """
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def point(self):
+        return Point(float(self._store._x[self._index]),
+                     float(self._store._y[self._index]))
+
+    @property
+    def x(self):
+        return float(self._store._x[self._index])
+
+    @property
+    def y(self):
+        return float(self._store._y[self._index])
+
+    @property
+    def radius(self):
+        settings = self._store.settings
+        return (settings.molten_particle_default_radius if self.molten
+                else settings.particle_default_radius)
+
+    @property
+    def displacement(self):
+        return Point(float(self._store._dx[self._index]),
+                     float(self._store._dy[self._index]))
+
+    @displacement.setter
+    def displacement(self, vector):
+        self._store._dx[self._index] = vector.x
+        self._store._dy[self._index] = vector.y
+
+    def apply_displacement(self):
+        if self._store._dx[self._index] or self._store._dy[self._index]:
+            self._store._x[self._index] += self._store._dx[self._index]
+            self._store._y[self._index] += self._store._dy[self._index]
+            self.invalidate_springs()
+
+    def invalidate_springs(self):
+        self._store.invalidate_springs(self._index)
+
+    @property
+    def molten(self):
+        return bool(self._store._molten[self._index])
+
+    @molten.setter
+    def molten(self, is_molten):
+        if self._store._molten[self._index] != is_molten:
+            self._store._molten[self._index] = is_molten
+            self.invalidate_springs()
+        if not is_molten:
+            self.melting_timeout = -1
+
+    @property
+    def melting_timeout(self):
+        return int(self._store._melting_timeout[self._index])
+
+    @melting_timeout.setter
+    def melting_timeout(self, timeout):
+        self._store._melting_timeout[self._index] = timeout
+
+    @property
+    def movable(self):
+        return bool(self._store._movable[self._index])
+
+    @movable.setter
+    def movable(self, is_movable):
+        self._store._movable[self._index] = is_movable
+
+    @property
+    def springs(self):
+        spring = self._store.spring
+        return [spring(index)
+                for index in self._store.incident(self._index).tolist()]
+
+    @property
+    def neighbours(self):
+        particle = self._store.particle
+        return [particle(index)
+                for index in self._store.adjacent(self._index).tolist()]
+
+    # (spring, particle at its other end) pairs
+    @property
+    def links(self):
+        store = self._store
+        return [(store.spring(spring), store.particle(neighbour))
+                for spring, neighbour in
+                zip(store.incident(self._index).tolist(),
+                    store.adjacent(self._index).tolist())]
+
+    @property
+    def settings(self):
+        return self._store.settings
+
+class StoredSpring:
+    """ A spring of a ParticleStore, which holds all its state. """
+    # once removed, the spring keeps its ends, rest length and force and
+    # loses its id, which compact() may give to another spring
+    __slots__ = ('_store', '_index', '_removed')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+        self._removed = None
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def particle1(self):
+        if self._removed is not None:
+            return self._removed[0]
+        return self._store.particle(self._store._edges[self._index, 0])
+
+    @property
+    def particle2(self):
+        if self._removed is not None:
+            return self._removed[1]
+        return self._store.particle(self._store._edges[self._index, 1])
+
+    @property
+    def settings(self):
+        return self._store.settings
+
+    @property
+    def length(self):
+        if self._removed is not None:
+            return self._removed[2]
+        return float(self._store._rest_length[self._index])
+
+    @property
+    def actual_length(self):
+        if self._removed is None:
+            actual_length = self._store._actual_length[self._index]
+            if not np.isnan(actual_length):
+                return float(actual_length)
+        p1 = self.particle1
+        p2 = self.particle2
+        actual_length = distance(p1, p2) - p1.radius - p2.radius
+        if self._removed is None:
+            self._store._actual_length[self._index] = actual_length
+        return actual_length
+
+    @property
+    def elongation(self):
+        return self.actual_length / self.length
+
+    @property
+    def force(self):
+        if self._removed is not None:
+            return self._removed[3]
+        return float(self._store._force[self._index])
+
+    @property
+    def dirty(self):
+        return self._removed is None and \
+               bool(self._store._dirty[self._index])
+
+    def invalidate(self):
+        if self._removed is None:
+            self._store._actual_length[self._index] = np.nan
+            self._store._dirty[self._index] = True
+
+    def update_force(self):
+        # no-op unless an end moved or changed its radius since the last call
+        if not self.dirty:
+            return
+        actual_length = self.actual_length
+        length = self.length
+        stiffness = self._store.settings.spring_default_stiffness
+        if actual_length < length:
+            force = (1 / actual_length - 1 / length) * \
+                    stiffness * length * length / 2
+        else:
+            force = stiffness * (length - actual_length)
+        self._store._force[self._index] = force
+        self._store._dirty[self._index] = False
+
+    def detach(self):
+        if self._removed is None:
+            removed = (self.particle1, self.particle2, self.length, self.force)
+            self._store.remove_spring(self._index)
+            self._removed = removed
+            self._index = None
+
+    def other_end(self, particle):
+        p1 = self.particle1
+        p2 = self.particle2
+        if p1 == particle:
+            return p2
+        elif p2 == particle:
+            return p1
+        else:
+            return None
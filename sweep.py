@@ -0,0 +1,141 @@
+import contextlib
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+
+from PIL import Image
+
+# settings the initial field depends on: the lattice interval, the heater
+# index cell size and the storage layout; runs differing only in other
+# settings start from the same field
+GEOMETRY_SETTINGS = ('particle_default_radius', 'spring_default_length',
+                     'heater_size', 'backend')
+
+# initial fields by geometry key, built in the sweeping process and
+# inherited by the forked run processes
+_fields = {}
+
+def parse_grid(specs):
+    # ['name=1,2', ...] -> {'name': [1, 2], ...}
+    grid = {}
+    for spec in specs:
+        name, values = spec.split('=', 1)
+        grid[name.strip()] = [_parse_value(value)
+                              for value in values.split(',')]
+    return grid
+
+def _parse_value(value):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    return value
+
+def sweep_runs(settings_patterns = (), grid = None):
+    # (settings file, overrides, settings) for every settings file matching
+    # the patterns, defaults if there are none, and every grid combination
+    filenames = []
+    for pattern in settings_patterns:
+        filenames.extend(sorted(glob.glob(pattern)))
+    if not filenames:
+        filenames = [None]
+    grid = grid or {}
+    names = list(grid)
+    runs = []
+    for filename in filenames:
+        for values in itertools.product(*(grid[name] for name in names)):
+            settings = SimulatorSettings(filename) if filename \
+                       else SimulatorSettings()
+            overrides = dict(zip(names, values))
+            for name, value in overrides.items():
+                if not hasattr(settings, name):
+                    raise ValueError("Unknown setting %s" % name)
+                setattr(settings, name, value)
+            # runs are spread over processes already
+            settings.relaxation_processes = 1
+            runs.append((filename, overrides, settings))
+    return runs
+
+def geometry_key(settings):
+    return tuple(getattr(settings, name) for name in GEOMETRY_SETTINGS)
+
+def _build_field(image, settings):
+    simulator = SpringSimulator(settings)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_from_image(image)
+    return simulator
+
+def _run(task):
+    index, image_filename, points, filename, overrides, settings = task
+    key = geometry_key(settings)
+    start = time.perf_counter()
+    simulator = _fields.get(key)
+    if simulator is None:
+        # not forked from the sweeping process, build the field here
+        simulator = _build_field(Image.open(image_filename), settings)
+    simulator.settings = settings
+    setup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.run_linear_passes(points)
+    run_time = time.perf_counter() - start
+
+    return {
+        'run': index,
+        'settings': filename,
+        'overrides': overrides,
+        'geometry': dict(zip(GEOMETRY_SETTINGS, key)),
+        'particles': len(simulator.particles),
+        'springs': len(simulator.edges),
+        'time': simulator.time,
+        'setup_seconds': setup_time,
+        'run_seconds': run_time,
+        'relaxation': simulator.last_relaxation,
+    }
+
+def run_sweep(image_filename, points, runs, output, processes = None):
+    # run the passes for every (settings file, overrides, settings) of runs
+    # over a process pool, writing one JSON record per run to output
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        context = multiprocessing.get_context()
+
+    _fields.clear()
+    build_times = {}
+    if context.get_start_method() == 'fork':
+        # every run process is forked afresh from here and starts from a
+        # copy-on-write image of its field, so each one is built only once
+        image = Image.open(image_filename)
+        image.load()
+        for _, _, settings in runs:
+            key = geometry_key(settings)
+            if not key in _fields:
+                start = time.perf_counter()
+                _fields[key] = _build_field(image, settings)
+                build_times[key] = time.perf_counter() - start
+
+    tasks = [(index, image_filename, points, filename, overrides, settings)
+             for index, (filename, overrides, settings) in enumerate(runs)]
+    records = []
+    with context.Pool(processes, maxtasksperchild = 1) as pool:
+        for record in pool.imap(_run, tasks):
+            key = geometry_key(runs[record['run']][2])
+            record['build_seconds'] = build_times.get(key)
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+            records.append(record)
+    _fields.clear()
+    return records
@@ -0,0 +1,51 @@
+import contextlib
+import os
+
+import numpy as np
+import pytest
+
+import backends
+from geometry import Point
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+
+# the reference backend is the source of truth: one pass on every other
+# backend has to put the particles where it does
+
+def _run_pass(backend):
+    settings = SimulatorSettings()
+    settings.backend = backend
+    settings.relaxation_iteration_limit = 300
+    settings.molten_particle_cooldown_time = 5
+    simulator = SpringSimulator(settings)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(40, 40), 25)
+        simulator.run_linear_passes([Point(10, 40), Point(70, 40)])
+    positions = np.array([(particle.x, particle.y)
+                          for particle in simulator.particles])
+    springs = sorted((spring.particle1.index, spring.particle2.index)
+                     for spring in simulator.edges)
+    simulator.close()
+    return positions, springs
+
+@pytest.fixture(scope = 'module')
+def reference():
+    return _run_pass('reference')
+
+@pytest.mark.parametrize('backend', [
+    'numpy',
+    pytest.param('numba', marks = pytest.mark.skipif(
+        backends.numba is None, reason = 'numba is not installed'))])
+def test_pass_matches_reference(reference, backend):
+    positions, springs = _run_pass(backend)
+    assert springs == reference[1]
+    assert np.abs(positions - reference[0]).max() < 1e-9
+
+def test_jit_loops_match_reference(reference, monkeypatch):
+    # the loops of the numba backend, run by the interpreter when numba
+    # is not installed
+    monkeypatch.setattr(backends, 'numba', backends.numba or object())
+    positions, springs = _run_pass('numba')
+    assert springs == reference[1]
+    assert np.abs(positions - reference[0]).max() < 1e-9
@@ -0,0 +1,66 @@
+from cooldown import CooldownScheduler
+
+# molten particles come off the queue in timeout order, ties by index, and
+# a particle heated again is only due at its latest timeout
+
+class _Particle:
+    def __init__(self, index, molten = False, movable = False,
+                 melting_timeout = 0):
+        self.index = index
+        self.molten = molten
+        self.movable = movable
+        self.melting_timeout = melting_timeout
+
+def test_due_in_timeout_order():
+    scheduler = CooldownScheduler()
+    particles = [_Particle(index) for index in range(4)]
+    for particle, timeout in zip(particles, (7, 3, 7, 5)):
+        scheduler.heat(particle, timeout)
+    assert len(scheduler) == 4
+    assert scheduler.due(2) == []
+    assert scheduler.due(5) == [particles[1], particles[3]]
+    # equal timeouts come in index order
+    assert scheduler.due(10) == [particles[0], particles[2]]
+    assert len(scheduler) == 0
+
+def test_heating_again_skips_the_old_entry():
+    scheduler = CooldownScheduler()
+    particle = _Particle(0)
+    other = _Particle(1)
+    scheduler.heat(particle, 4)
+    scheduler.heat(other, 6)
+    scheduler.heat(particle, 8)
+    assert scheduler.due(6) == [other]
+    assert len(scheduler) == 1
+    assert scheduler.due(8) == [particle]
+    # heated to an earlier timeout, the later entry is the stale one
+    scheduler.heat(particle, 12)
+    scheduler.heat(particle, 10)
+    assert scheduler.due(10) == [particle]
+    assert scheduler.due(12) == []
+
+def test_no_timeout_waits_for_the_final_cooldown():
+    scheduler = CooldownScheduler()
+    held = _Particle(0)
+    timed = _Particle(1)
+    scheduler.heat(held, 0)
+    scheduler.heat(timed, 3)
+    assert scheduler.due(100) == [timed]
+    assert scheduler.molten() == [held]
+    assert len(scheduler) == 0 and scheduler.due(200) == []
+
+def test_rebuild_from_flags():
+    particles = [_Particle(0, molten = True, movable = True,
+                           melting_timeout = 9),
+                 _Particle(1, movable = True),
+                 _Particle(2),
+                 _Particle(3, molten = True, melting_timeout = 4)]
+    scheduler = CooldownScheduler()
+    scheduler.heat(particles[2], 1)
+    scheduler.rebuild(particles)
+    assert len(scheduler) == 2
+    # molten particles are movable too
+    assert scheduler.movable() == [particles[0], particles[1], particles[3]]
+    scheduler.settle(particles[1])
+    assert scheduler.movable() == [particles[0], particles[3]]
+    assert scheduler.due(10) == [particles[3], particles[0]]
@@ -0,0 +1,85 @@
+import math
+
+import numpy as np
+
+from geometry import Point, Line, distance, segments_intersect, lines, \
+                     squared_distances, distances, line_distances, \
+                     segments_intersect_batch
+
+def _segments(count, seed):
+    # endpoints on a small integer grid, so collinear, touching and
+    # zero-length segments are frequent, followed by random real ones
+    random = np.random.default_rng(seed)
+    grid = random.integers(0, 4, size = (count, 8)).astype(float)
+    real = random.uniform(-10, 10, size = (count, 8))
+    special = np.array([
+        (0, 0, 4, 0, 1, 0, 3, 0),      # collinear, overlapping
+        (0, 0, 2, 0, 2, 0, 4, 0),      # collinear, touching at an end
+        (0, 0, 0, 4, 0, 1, 0, 3),      # vertical, overlapping
+        (0, 0, 2, 2, 2, 2, 4, 0),      # touching at an end
+        (0, 0, 2, 2, 1, 1, 3, 0),      # one end on the other segment
+        (1, 1, 1, 1, 0, 0, 2, 2),      # zero length, on the other one
+        (1, 1, 1, 1, 1, 1, 1, 1),      # both zero length
+        (0, 0, 2, 2, 0, 2, 2, 0),      # crossing
+        (0, 0, 1, 0, 0, 1, 1, 1)])     # parallel
+    return np.vstack((special, grid, real))
+
+def test_segments_intersect_batch_matches_scalar():
+    segments = _segments(2000, 1)
+    batch = segments_intersect_batch(*segments.T)
+    for row, crossed in zip(segments.tolist(), batch.tolist()):
+        points = [Point(x, y) for x, y in zip(row[::2], row[1::2])]
+        assert segments_intersect(*points) == crossed, row
+
+def test_segments_intersect_batch_broadcasts_all_pairs():
+    segments = _segments(30, 2)
+    first = segments[:, :4]
+    second = segments[:, 4:]
+    batch = segments_intersect_batch(
+        *(first[:, None, i] for i in range(4)),
+        *(second[None, :, i] for i in range(4)))
+    assert batch.shape == (len(first), len(second))
+    for i, j in [(0, 0), (3, 7), (12, 25), (38, 1)]:
+        points = [Point(x, y) for x, y in
+                  zip(np.r_[first[i], second[j]][::2],
+                      np.r_[first[i], second[j]][1::2])]
+        assert segments_intersect(*points) == batch[i, j]
+
+def test_lines_match_scalar():
+    segments = _segments(500, 3)
+    a, b, c = lines(*segments[:, :4].T)
+    for row, coefficients in zip(segments[:, :4].tolist(),
+                                 zip(a.tolist(), b.tolist(), c.tolist())):
+        line = Line(Point(row[0], row[1]), Point(row[2], row[3]))
+        assert (line.a, line.b, line.c) == coefficients
+
+def test_distances_match_scalar():
+    points = _segments(500, 4)[:, :4]
+    batch = distances(*points.T)
+    assert np.allclose(squared_distances(*points.T), batch * batch)
+    for row, value in zip(points.tolist(), batch.tolist()):
+        assert distance(Point(row[0], row[1]),
+                        Point(row[2], row[3])) == value
+
+def test_line_distances_match_scalar():
+    segments = _segments(500, 5)
+    # lines through the first two points, measured from the third
+    batch = line_distances(segments[:, 4], segments[:, 5],
+                           *segments[:, :4].T)
+    for row, value in zip(segments.tolist(), batch.tolist()):
+        line = Line(Point(row[0], row[1]), Point(row[2], row[3]))
+        assert Point(row[4], row[5]).distance_to_line(line) == value
+
+def test_distance_to_line_is_euclidean():
+    # lines away from the origin: dividing by c as well, as before, gave
+    # 10 / sqrt(101) and 5 / sqrt(26)
+    vertical = Line(Point(10, 0), Point(10, 1))
+    assert Point(0, 10).distance_to_line(vertical) == 10
+    horizontal = Line(Point(0, 5), Point(1, 5))
+    assert Point(0, 0).distance_to_line(horizontal) == 5
+    slanted = Line(Point(10, 0), Point(0, 10))
+    assert math.isclose(Point(0, 0).distance_to_line(slanted),
+                        10 / math.sqrt(2))
+    assert math.isclose(
+        float(line_distances(0.0, 0.0, 10.0, 0.0, 0.0, 10.0)),
+        10 / math.sqrt(2))
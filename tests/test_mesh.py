@@ -0,0 +1,60 @@
+import contextlib
+import os
+
+import numpy as np
+import pytest
+
+import simulator as simulation
+from geometry import Point
+from mesh import HalfEdgeMesh
+from settings import SimulatorSettings
+
+# with the half-edge mesh the removal checks give the answers and cycles
+# of the BFS, so a pass ends exactly as without it; the mesh kept up to
+# date through the pass has the faces a fresh one would have
+
+def _run_pass(backend, planar_mesh):
+    settings = SimulatorSettings()
+    settings.backend = backend
+    settings.relaxation_iteration_limit = 300
+    settings.molten_particle_cooldown_time = 5
+    simulator = simulation.SpringSimulator(settings,
+                                           planar_mesh = planar_mesh)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(40, 40), 25)
+        simulator.run_linear_passes([Point(10, 40), Point(70, 44)])
+    return simulator
+
+def _faces(mesh):
+    return {frozenset((u.index, v.index) for u, v in half_edges)
+            for half_edges in mesh.faces.values()}
+
+@pytest.mark.parametrize('backend', ['reference', 'numpy'])
+def test_mesh_matches_brute_force(backend):
+    simulator = _run_pass(backend, True)
+    plain = _run_pass(backend, False)
+    assert [(spring.particle1.index, spring.particle2.index)
+            for spring in simulator.edges] == \
+           [(spring.particle1.index, spring.particle2.index)
+            for spring in plain.edges]
+    assert np.array_equal(
+        [(particle.x, particle.y) for particle in simulator.particles],
+        [(particle.x, particle.y) for particle in plain.particles])
+
+    mesh = simulator.mesh
+    assert _faces(mesh) == _faces(HalfEdgeMesh(simulator.particles))
+    for min_cycle_length, max_cycle_length in ((4, 4), (4, 6), (3, 8)):
+        for spring in simulator.edges:
+            on_mesh = []
+            searched = []
+            answer = simulation._spring_can_be_removed(
+                spring, min_cycle_length, max_cycle_length, searched)
+            assert simulation._spring_can_be_removed_on_mesh(
+                mesh, spring, min_cycle_length, max_cycle_length,
+                on_mesh) == answer
+            if not answer[0] and answer[1]:
+                # the cycle the fix is looked for in
+                assert on_mesh == searched
+    simulator.close()
+    plain.close()
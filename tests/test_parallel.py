@@ -0,0 +1,32 @@
+import contextlib
+import os
+
+import numpy as np
+
+from geometry import Point
+from parallel import ParallelRelaxation
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+
+# the worker processes compute the same forces and moves as the serial
+# kernel, so a pass ends with the particles in the same places
+
+def _positions(processes):
+    settings = SimulatorSettings()
+    settings.backend = 'numpy'
+    settings.relaxation_processes = processes
+    settings.relaxation_iteration_limit = 200
+    simulator = SpringSimulator(settings)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(40, 40), 35)
+        simulator.run_linear_passes([Point(10, 40), Point(70, 42)])
+    positions = np.array([(particle.x, particle.y)
+                          for particle in simulator.particles])
+    simulator.close()
+    return positions
+
+def test_parallel_relaxation_matches_serial(monkeypatch):
+    # a region this small would otherwise stay serial
+    monkeypatch.setattr(ParallelRelaxation, 'MIN_PARTICLES', 0)
+    assert np.array_equal(_positions(2), _positions(1))
@@ -0,0 +1,40 @@
+import contextlib
+import os
+
+import numpy as np
+
+from geometry import Point
+from planner import PassPlanner
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+
+# the time budget of a search stops passes through the tick callback, so
+# a recorder set on the simulator goes on recording
+
+class _Counter:
+    def __init__(self):
+        self.records = 0
+
+    def record(self, simulator):
+        self.records += 1
+
+def test_time_budget_leaves_the_recorder_alone():
+    settings = SimulatorSettings()
+    settings.backend = 'numpy'
+    simulator = SpringSimulator(settings)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(40, 40), 25)
+    recorder = _Counter()
+    simulator.recorder = recorder
+    angles = np.linspace(0, 2 * np.pi, 40, endpoint = False)
+    outline = np.column_stack((40 + 20 * np.cos(angles),
+                               40 + 20 * np.sin(angles)))
+    planner = PassPlanner(simulator, outline, beam_width = 1,
+                          max_passes = 1, time_budget = 0.2)
+    planner.search()
+    assert planner.evaluated < len(planner.candidates)
+    assert recorder.records > 0
+    assert simulator.recorder is recorder
+    assert simulator.tick_callback is None
+    simulator.close()
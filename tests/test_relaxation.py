@@ -0,0 +1,94 @@
+import contextlib
+import math
+import os
+
+import numpy as np
+import pytest
+
+from geometry import Point
+from relaxation import Fire
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+
+# FIRE has to stop where steepest descent does: at a small residual force,
+# with the particles in the same places
+
+def _residual(particle):
+    # length of the summed spring forces on the particle
+    x_force = 0
+    y_force = 0
+    for spring, neighbour in particle.links:
+        delta_x = neighbour.x - particle.x
+        delta_y = neighbour.y - particle.y
+        delta_length = math.hypot(delta_x, delta_y)
+        if delta_length < 1e-5:
+            continue
+        x_force -= delta_x / delta_length * spring.force
+        y_force -= delta_y / delta_length * spring.force
+    return math.hypot(x_force, y_force)
+
+def _relax(method, backend):
+    # one heater tick in the middle of a circle, relaxed by method
+    settings = SimulatorSettings()
+    settings.backend = backend
+    settings.relaxation_method = method
+    settings.relaxation_convergence_limit = 1e-5
+    settings.relaxation_iteration_limit = 10000
+    simulator = SpringSimulator(settings)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(30, 30), 30)
+        simulator.run_pass(Point(30, 30), Point(31, 30))
+    statistics = simulator.last_relaxation
+    positions = np.array([(particle.x, particle.y)
+                          for particle in simulator.particles])
+    residual = max(_residual(particle) for particle in simulator.particles
+                   if particle.movable)
+    simulator.close()
+    return statistics, positions, residual
+
+def test_first_step_is_steepest_descent():
+    fire = Fire(2)
+    x_displacement, y_displacement = fire.step([1, 0.5], [0, 0], [10, 10])
+    assert np.allclose(x_displacement, [1, 0.5])
+    assert np.allclose(y_displacement, [0, 0])
+    assert fire.dt == 1
+
+def test_dt_stays_above_minimum():
+    fire = Fire(1, dt_min = 0.1)
+    for step in range(20):
+        # the force turns around every step, so every step is uphill
+        fire.step([(-1) ** step], [0], [10])
+    assert fire.dt == pytest.approx(0.1)
+
+@pytest.mark.parametrize('backend', ['reference', 'numpy'])
+def test_fire_matches_steepest_descent(backend):
+    steepest, steepest_positions, steepest_residual = \
+        _relax('steepest', backend)
+    fire, fire_positions, fire_residual = _relax('fire', backend)
+    assert steepest['converged'] and fire['converged']
+    assert fire['iterations'] < steepest['iterations']
+    assert fire_residual < 1e-4
+    assert fire_residual < 10 * max(steepest_residual, 1e-5)
+    assert np.abs(fire_positions - steepest_positions).max() < 0.01
+
+@pytest.mark.parametrize('backend', ['reference', 'numpy'])
+def test_relax_heat_sees_flags_set_from_outside(backend):
+    settings = SimulatorSettings()
+    settings.backend = backend
+    simulator = SpringSimulator(settings)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(30, 30), 30)
+    # nudge a particle and let it go back
+    particle = min(simulator.particles, key = lambda particle:
+                   math.hypot(particle.x - 30, particle.y - 30))
+    start = (particle.x, particle.y)
+    particle.displacement = Point(1, 0)
+    particle.apply_displacement()
+    particle.movable = True
+    statistics = simulator.relax_heat()
+    assert statistics['movable'] == 1
+    assert math.hypot(particle.x - start[0], particle.y - start[1]) < 0.5
+    assert not particle.movable
+    simulator.close()
@@ -0,0 +1,70 @@
+import asyncio
+import concurrent.futures
+import json
+
+from PIL import Image, ImageDraw
+
+from service import SimulationService, serve_lines
+from snapshot import read_snapshot
+
+# commands go in and replies come out as JSON lines, one reply per
+# command; a pass also sends progress events first
+
+class _Lines:
+    def __init__(self, lines):
+        self._lines = [line.encode() + b'\n' for line in lines]
+
+    async def readline(self):
+        return self._lines.pop(0) if self._lines else b''
+
+def _serve(lines):
+    output = []
+    service = SimulationService(concurrent.futures.ThreadPoolExecutor(1))
+    try:
+        asyncio.run(serve_lines(service, _Lines(lines), output.append))
+    finally:
+        service.close()
+    return [json.loads(line) for line in b''.join(output).splitlines()]
+
+def test_json_lines_protocol(tmp_path, capsys):
+    mask = Image.new('L', (60, 60), 0)
+    ImageDraw.Draw(mask).rectangle((10, 10, 50, 50), fill = 255)
+    mask.save(tmp_path / 'mask.png')
+    snapshot = tmp_path / 'a.snap'
+    messages = _serve([
+        json.dumps({'id': 1, 'command': 'init', 'session': 'a',
+                    'input': str(tmp_path / 'mask.png')}),
+        json.dumps({'id': 2, 'command': 'pass', 'session': 'a',
+                    'points': [5, 30, 55, 30], 'every': 5}),
+        json.dumps({'id': 3, 'command': 'snapshot', 'session': 'a',
+                    'output': str(snapshot)}),
+        json.dumps({'id': 4, 'command': 'pass', 'session': 'b',
+                    'points': [5, 30, 55, 30]}),
+        json.dumps({'id': 5, 'command': 'melt'}),
+        'not json'])
+    replies = {message['id']: message for message in messages
+               if 'event' not in message}
+    events = [message for message in messages if 'event' in message]
+
+    assert replies[1]['ok'] and replies[1]['result']['session'] == 'a'
+    particles = replies[1]['result']['particles']
+    assert particles > 0
+    assert replies[2]['ok'] and replies[2]['result']['time'] > 0
+    assert events and all(event['id'] == 2 for event in events)
+    assert events[-1]['tick'] == events[-1]['ticks']
+    # every progress event comes before the reply to its pass
+    assert max(messages.index(event) for event in events) < \
+           messages.index(replies[2])
+
+    assert replies[3]['ok']
+    assert replies[3]['result']['time'] == replies[2]['result']['time']
+    state, _ = read_snapshot(str(snapshot))
+    assert state.particle_count == particles
+    assert state.time == replies[2]['result']['time']
+
+    assert replies[4] == {'id': 4, 'ok': False, 'error': 'Unknown session b'}
+    assert replies[5] == {'id': 5, 'ok': False,
+                          'error': 'Unknown command melt'}
+    assert not replies[None]['ok']
+    # the simulator prints nothing into the replies
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,42 @@
+from settings import SimulatorSettings
+
+# settings saved to a file and read back are exactly the ones saved
+
+def test_save_and_load_keep_the_values(tmp_path):
+    settings = SimulatorSettings()
+    settings.relaxation_convergence_limit = 1e-7 / 3
+    settings.relaxation_active_set = True
+    settings.relaxation_freeze_iterations = 7
+    settings.relaxation_wake_threshold = 2 / 3 * 1e-3
+    settings.relaxation_processes = 3
+    settings.relaxation_method = 'fire'
+    settings.heater_coalesce = True
+    settings.heater_coalesce_fraction = 1 / 3
+    settings.heater_coalesce_ticks = 6
+    settings.backend = 'numpy'
+    filename = str(tmp_path / 'settings.cfg')
+    settings.save_to_file(filename)
+    assert vars(SimulatorSettings(filename)) == vars(settings)
+
+def test_older_files_keep_the_defaults(tmp_path):
+    # files from before the optional keys only have the original ones
+    filename = tmp_path / 'old.cfg'
+    filename.write_text('[particle]\ndefaultradius = 1.50\n'
+                        'moltendefaultradius = 2.00\ncooldowntime = 15\n'
+                        '[spring]\ndefaultstiffness = 0.020\n'
+                        'defaultlength = 5.50\nconnectionthreshold = 1.20\n'
+                        'disconnectionthreshold = 1.60\n'
+                        '[relaxation]\niterationlimit = 500\n'
+                        'convergencelimit = 0.001\n'
+                        '[heater]\nspeed = 2.00\nsize = 20.00\n')
+    settings = SimulatorSettings(str(filename))
+    defaults = SimulatorSettings()
+    assert settings.particle_default_radius == 1.5
+    assert settings.molten_particle_cooldown_time == 15
+    assert settings.relaxation_iteration_limit == 500
+    for name in ('relaxation_active_set', 'relaxation_freeze_iterations',
+                 'relaxation_wake_threshold', 'relaxation_processes',
+                 'relaxation_method', 'heater_coalesce',
+                 'heater_coalesce_fraction', 'heater_coalesce_ticks',
+                 'backend'):
+        assert getattr(settings, name) == getattr(defaults, name)
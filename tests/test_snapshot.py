@@ -0,0 +1,44 @@
+import contextlib
+import os
+
+import numpy as np
+
+from geometry import Point
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+from snapshot import is_snapshot, read_snapshot, write_snapshot
+
+# a snapshot file gives back the state and settings it was written from
+
+def test_snapshot_round_trip(tmp_path):
+    settings = SimulatorSettings()
+    settings.backend = 'numpy'
+    settings.relaxation_iteration_limit = 300
+    settings.heater_coalesce_fraction = 1 / 3
+    simulator = SpringSimulator(settings)
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(40, 40), 25)
+        # stop while particles are still molten
+        simulator.run_pass(Point(10, 40), Point(40, 40))
+    state = simulator.save_state()
+    filename = str(tmp_path / 'state.snap')
+    write_snapshot(filename, state, settings)
+    assert is_snapshot(filename)
+    assert not is_snapshot(str(tmp_path / 'missing.snap'))
+
+    loaded, loaded_settings = read_snapshot(filename)
+    assert loaded.time == state.time
+    for name in ('x', 'y', 'molten', 'movable', 'melting_timeout',
+                 'springs', 'rest_length'):
+        assert np.array_equal(getattr(loaded, name), getattr(state, name))
+    assert loaded.molten.any()
+    assert vars(loaded_settings) == vars(settings)
+
+    # and without settings
+    filename = str(tmp_path / 'bare.snap')
+    write_snapshot(filename, state)
+    loaded, loaded_settings = read_snapshot(filename)
+    assert loaded_settings is None
+    assert np.array_equal(loaded.springs, state.springs)
+    simulator.close()
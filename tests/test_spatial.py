@@ -0,0 +1,52 @@
+import numpy as np
+
+from spatial import SegmentGrid
+
+def _overlapping(grid, segments, query):
+    # ids of the segments whose cell ranges overlap that of query
+    found = set()
+    query_range = grid._range(*query)
+    for item, segment in segments.items():
+        cell_range = grid._range(*segment)
+        if cell_range[0] <= query_range[2] and query_range[0] <= cell_range[2] \
+           and cell_range[1] <= query_range[3] and \
+           query_range[1] <= cell_range[3]:
+            found.add(item)
+    return found
+
+def test_segment_grid_matches_brute_force():
+    generator = np.random.default_rng(1)
+    grid = SegmentGrid(2.0)
+    starts = generator.uniform(0, 40, (300, 2))
+    ends = np.hstack((starts, starts + generator.uniform(-3, 3, (300, 2))))
+    segments = {item: tuple(ends[item]) for item in range(200)}
+    grid.extend(range(200), *ends[:200].T)
+    # the first query builds the table from the bulk added ones
+    grid.candidates(0, 0, 1, 1)
+    # moved and added ones go to the per-cell lists
+    for item in range(0, 200, 3):
+        segments[item] = tuple(ends[item] + 1.5)
+        grid.move(item, *segments[item])
+    for item in range(200, 300):
+        segments[item] = tuple(ends[item])
+        grid.insert(item, *segments[item])
+    for item in range(1, 300, 7):
+        del segments[item]
+        grid.remove(item)
+    assert len(grid) == len(segments)
+
+    queries = generator.uniform(0, 40, (50, 4))
+    for query in queries:
+        assert set(grid.candidates(*query).tolist()) == \
+               _overlapping(grid, segments, query)
+
+    # close up the removed ids
+    mapping = np.full(300, -1)
+    kept = sorted(segments)
+    mapping[kept] = np.arange(len(kept))
+    grid.renumber(mapping)
+    segments = {int(mapping[item]): segment
+                for item, segment in segments.items()}
+    for query in queries:
+        assert set(grid.candidates(*query).tolist()) == \
+               _overlapping(grid, segments, query)
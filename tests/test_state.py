@@ -0,0 +1,78 @@
+import contextlib
+import os
+
+import numpy as np
+import pytest
+
+from geometry import Point
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+
+# a simulator loaded from a saved state has the same particles and springs
+# and goes on exactly like the one it was saved from
+
+def _simulator(backend):
+    settings = SimulatorSettings()
+    settings.backend = backend
+    settings.relaxation_iteration_limit = 300
+    settings.molten_particle_cooldown_time = 5
+    return SpringSimulator(settings)
+
+def _quietly(function, *arguments):
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        return function(*arguments)
+
+def _springs(simulator):
+    return [(spring.particle1.index, spring.particle2.index, spring.length)
+            for spring in simulator.edges]
+
+@pytest.mark.parametrize('backend', ['reference', 'numpy'])
+def test_load_state_round_trip(backend):
+    simulator = _simulator(backend)
+    _quietly(simulator.initialize_circle, Point(40, 40), 25)
+    # stop while particles are still molten
+    _quietly(simulator.run_pass, Point(10, 40), Point(40, 40))
+    state = simulator.save_state()
+
+    loaded = _simulator(backend)
+    loaded.load_state(state)
+    assert loaded.time == simulator.time
+    assert _springs(loaded) == _springs(simulator)
+    for particle, copy in zip(simulator.particles, loaded.particles):
+        assert (copy.x, copy.y) == (particle.x, particle.y)
+        assert copy.molten == particle.molten
+        assert copy.movable == particle.movable
+        assert copy.melting_timeout == particle.melting_timeout
+
+    for sim in (simulator, loaded):
+        _quietly(sim.run_linear_passes, [Point(40, 40), Point(70, 40)])
+    assert _springs(loaded) == _springs(simulator)
+    assert np.array_equal(
+        [(particle.x, particle.y) for particle in loaded.particles],
+        [(particle.x, particle.y) for particle in simulator.particles])
+    simulator.close()
+    loaded.close()
+
+@pytest.mark.parametrize('backend', ['reference', 'numpy'])
+def test_clone_leaves_the_original_alone(backend):
+    simulator = _simulator(backend)
+    _quietly(simulator.initialize_circle, Point(40, 40), 25)
+    positions = [(particle.x, particle.y) for particle in simulator.particles]
+    springs = _springs(simulator)
+
+    clone = simulator.clone()
+    clone.settings.heater_size = 2 * simulator.settings.heater_size
+    _quietly(clone.run_linear_passes, [Point(10, 40), Point(70, 40)])
+    assert clone.time > simulator.time
+    assert _springs(clone) != springs
+
+    assert simulator.settings.heater_size == SimulatorSettings().heater_size
+    assert simulator.time == 0
+    assert _springs(simulator) == springs
+    assert [(particle.x, particle.y)
+            for particle in simulator.particles] == positions
+    assert not any(particle.molten or particle.movable
+                   for particle in simulator.particles)
+    simulator.close()
+    clone.close()
@@ -0,0 +1,41 @@
+import numpy as np
+
+from settings import SimulatorSettings
+from store import ParticleStore
+
+def _chain(count):
+    # count particles on a line, each connected to the next one
+    store = ParticleStore(settings = SimulatorSettings())
+    store.add_particles(np.arange(count, dtype = np.float64), np.zeros(count))
+    store.add_springs([(i, i + 1) for i in range(count - 1)],
+                      np.ones(count - 1))
+    return store
+
+def test_views_follow_the_arrays():
+    store = _chain(3)
+    particle = store.particle(1)
+    assert particle is store.particles[1]
+    assert [spring.index for spring in particle.springs] == [0, 1]
+    assert [neighbour.index for neighbour in particle.neighbours] == [0, 2]
+    particle.molten = True
+    assert store.molten.tolist() == [False, True, False]
+    assert store.dirty.all()
+
+def test_compact_takes_back_removed_slots():
+    store = _chain(5)
+    removed = store.spring(1)
+    kept = store.spring(3)
+    removed.detach()
+    assert store.edge_count == 4 and store.spring_count == 3
+
+    assert store.compact().tolist() == [0, -1, 1, 2]
+    assert store.edge_count == store.spring_count == 3
+    assert store.edges.tolist() == [[0, 1], [2, 3], [3, 4]]
+    assert kept.index == 2 and kept.particle1.index == 3
+    assert [spring.index for spring in store.particle(3).springs] == [1, 2]
+    # a removed spring keeps its ends
+    assert removed.index is None
+    assert (removed.particle1.index, removed.particle2.index) == (1, 2)
+
+    assert store.add_spring(1, 2, 1.0) == 3
+    assert store.compact() is None
@@ -0,0 +1,68 @@
+import contextlib
+import os
+
+import numpy as np
+import pytest
+
+from geometry import Point
+from settings import SimulatorSettings
+from simulator import SpringSimulator
+from trajectory import Trajectory, TrajectoryWriter
+
+# every recorded tick can be rebuilt from the trajectory file, from
+# keyframes and the deltas after them
+
+class _Recorder(TrajectoryWriter):
+    # keeps the state of every recorded tick to compare with
+    def __init__(self, filename, keyframe_interval):
+        TrajectoryWriter.__init__(self, filename, keyframe_interval)
+        self.states = []
+
+    def record(self, simulator):
+        TrajectoryWriter.record(self, simulator)
+        self.states.append(simulator.save_state())
+
+def _springs(state):
+    return sorted((min(i, j), max(i, j), length) for (i, j), length
+                  in zip(state.springs.tolist(), state.rest_length.tolist()))
+
+@pytest.mark.parametrize('backend', ['reference', 'numpy'])
+def test_trajectory_round_trip(backend, tmp_path):
+    settings = SimulatorSettings()
+    settings.backend = backend
+    settings.relaxation_iteration_limit = 300
+    settings.molten_particle_cooldown_time = 5
+    simulator = SpringSimulator(settings)
+    filename = str(tmp_path / 'run.traj')
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        simulator.initialize_circle(Point(40, 40), 25)
+        recorder = _Recorder(filename, 7)
+        simulator.recorder = recorder
+        simulator.run_linear_passes([Point(10, 40), Point(70, 44)])
+    recorder.close()
+    simulator.close()
+
+    trajectory = Trajectory(filename)
+    assert len(trajectory) == recorder.records == len(recorder.states)
+    assert trajectory.keyframe_interval == 7
+    assert trajectory.times == [state.time for state in recorder.states]
+    # springs changed during the pass, so the deltas carry some
+    assert _springs(recorder.states[0]) != _springs(recorder.states[-1])
+    for index, state in enumerate(recorder.states):
+        rebuilt = trajectory.state(index)
+        assert rebuilt.time == state.time
+        for name in ('x', 'y', 'molten', 'movable', 'melting_timeout'):
+            assert np.array_equal(getattr(rebuilt, name),
+                                  getattr(state, name))
+        assert _springs(rebuilt) == _springs(state)
+    assert trajectory.state_at(recorder.states[10].time).time == \
+           recorder.states[10].time
+
+    # a file cut off mid-record reads up to the last whole one
+    with open(filename, 'rb') as complete:
+        data = complete.read()
+    cut = str(tmp_path / 'cut.traj')
+    with open(cut, 'wb') as truncated:
+        truncated.write(data[:-10])
+    assert len(Trajectory(cut)) == len(trajectory) - 1
@@ -0,0 +1,224 @@
+import bisect
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from state import SimulatorState
+
+# append-only trajectory layout:
+#   magic, format version (uint32), keyframe interval (uint32), then one
+#   record per recorded tick, each a fixed header followed by raw arrays;
+# a keyframe (b'K') holds the full state, a delta (b'D') only the particles
+# whose position or heat state changed since the previous record and the
+# springs added and removed in between
+MAGIC = b'SPRTRAJ\0'
+VERSION = 1
+_PREAMBLE = struct.Struct('<8sII')
+# kind, time, then keyframe: particles, springs, 0
+#                 delta: changed particles, added springs, removed springs
+_RECORD = struct.Struct('<1s7xqqqq')
+
+def _particle_arrays(simulator):
+    # copies of the particle columns, read off the store arrays when the
+    # simulator has one
+    store = simulator.store
+    if store is not None:
+        return (store.x.copy(), store.y.copy(), store.molten.copy(),
+                store.movable.copy(), store.melting_timeout.copy())
+    particles = simulator.particles
+    return (np.array([particle.x for particle in particles], np.float64),
+            np.array([particle.y for particle in particles], np.float64),
+            np.array([particle.molten for particle in particles], bool),
+            np.array([particle.movable for particle in particles], bool),
+            np.array([particle.melting_timeout for particle in particles],
+                     np.int64))
+
+def _spring_arrays(springs):
+    # particle ids are positions in simulator.particles
+    pairs = np.array([(spring.particle1.index, spring.particle2.index)
+                      for spring in springs], np.int64).reshape(-1, 2)
+    lengths = np.array([spring.length for spring in springs], np.float64)
+    return pairs, lengths
+
+class TrajectoryWriter:
+    """ Records every tick of a simulator run to a trajectory file. """
+    # records are encoded on the simulation thread and written to disk on
+    # a background one; set as SpringSimulator.recorder to record each tick
+    def __init__(self, filename, keyframe_interval = 50):
+        self._keyframe_interval = max(int(keyframe_interval), 1)
+        self._file = open(filename, 'wb')
+        self._file.write(_PREAMBLE.pack(MAGIC, VERSION,
+                                        self._keyframe_interval))
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target = self._write, daemon = True)
+        self._thread.start()
+        self._records = 0
+        self._particles = None
+        self._previous = None
+
+    @property
+    def records(self):
+        return self._records
+
+    def _write(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            self._file.write(chunk)
+
+    def record(self, simulator):
+        # encodes the current state; the simulator is left as it is
+        arrays = _particle_arrays(simulator)
+        if self._records % self._keyframe_interval == 0 or \
+           self._particles != len(arrays[0]):
+            chunk = self._keyframe(simulator, arrays)
+        else:
+            chunk = self._delta(simulator, arrays)
+        self._queue.put(chunk)
+        self._previous = arrays
+        self._records += 1
+
+    def _keyframe(self, simulator, arrays):
+        self._particles = len(arrays[0])
+        store = simulator.store
+        if store is not None:
+            # spring slots are never reused, so these are in creation order
+            alive = store.alive
+            pairs = store.edges[alive]
+            lengths = store.rest_length[alive]
+        else:
+            pairs, lengths = _spring_arrays(list(simulator.edges))
+        header = _RECORD.pack(b'K', simulator.time, self._particles,
+                              len(pairs), 0)
+        return b''.join([header] + [array.tobytes() for array in arrays] +
+                        [pairs.tobytes(), lengths.tobytes()])
+
+    def _delta(self, simulator, arrays):
+        changed = np.zeros(self._particles, bool)
+        for current, previous in zip(arrays, self._previous):
+            changed |= current != previous
+        changed = np.flatnonzero(changed).astype(np.int64)
+        # the simulator logs the springs added and removed since the last
+        # record itself
+        added = list(simulator.tick_added_springs.values())
+        lengths = np.array([length for _, length in added], np.float64)
+        added = np.array([pair for pair, _ in added],
+                         np.int64).reshape(-1, 2)
+        removed = np.array(list(simulator.tick_removed_springs.values()),
+                           np.int64).reshape(-1, 2)
+        header = _RECORD.pack(b'D', simulator.time, len(changed), len(added),
+                              len(removed))
+        return b''.join([header, changed.tobytes()] +
+                        [array[changed].tobytes() for array in arrays] +
+                        [added.tobytes(), lengths.tobytes(),
+                         removed.tobytes()])
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+class Trajectory:
+    """ Reads a trajectory file, rebuilding the state of any tick. """
+    # the file is memory mapped, so only the records needed for a state
+    # are read in
+    def __init__(self, filename):
+        if os.path.getsize(filename) < _PREAMBLE.size:
+            raise ValueError("%s is not a trajectory file" % filename)
+        self._data = np.memmap(filename, dtype = np.uint8, mode = 'r')
+        magic, version, self._keyframe_interval = \
+            _PREAMBLE.unpack_from(self._data)
+        if magic != MAGIC:
+            raise ValueError("%s is not a trajectory file" % filename)
+        if version > VERSION:
+            raise ValueError("Trajectory %s has unsupported version %d" %
+                             (filename, version))
+        # (kind, time, counts, payload offset) of every record; the
+        # particle count of a delta is that of its keyframe
+        self._records = []
+        self._keyframes = []
+        offset = _PREAMBLE.size
+        particles = 0
+        while offset + _RECORD.size <= len(self._data):
+            kind, time, *counts = _RECORD.unpack_from(self._data, offset)
+            offset += _RECORD.size
+            if kind == b'K':
+                particles = counts[0]
+                self._keyframes.append(len(self._records))
+                size = particles * 26 + counts[1] * 24
+            else:
+                size = counts[0] * 34 + counts[1] * 24 + counts[2] * 16
+            if offset + size > len(self._data):
+                # cut off mid-record, the writer did not finish
+                break
+            self._records.append((kind, time, counts, offset))
+            offset += size
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def keyframe_interval(self):
+        return self._keyframe_interval
+
+    @property
+    def times(self):
+        return [record[1] for record in self._records]
+
+    def _arrays(self, offset, layout):
+        arrays = []
+        for dtype, count, columns in layout:
+            array = np.frombuffer(self._data, dtype, count * columns, offset)
+            arrays.append(array.reshape(-1, 2) if columns == 2 else array)
+            offset += array.nbytes
+        return arrays
+
+    def state(self, record):
+        # the state after the given record (an index into times), rebuilt
+        # from the nearest keyframe at or before it
+        keyframe = self._keyframes[
+            bisect.bisect_right(self._keyframes, record) - 1]
+        _, time, (particles, springs, _), offset = self._records[keyframe]
+        x, y, molten, movable, timeout, pairs, lengths = self._arrays(
+            offset, [(np.float64, particles, 1), (np.float64, particles, 1),
+                     (bool, particles, 1), (bool, particles, 1),
+                     (np.int64, particles, 1), (np.int64, springs, 2),
+                     (np.float64, springs, 1)])
+        columns = [array.copy() for array in (x, y, molten, movable, timeout)]
+        # unordered particle pair -> (pair, rest length), in creation order
+        edges = {}
+        for (i, j), length in zip(pairs.tolist(), lengths.tolist()):
+            edges[(min(i, j), max(i, j))] = ((i, j), length)
+
+        for index in range(keyframe + 1, record + 1):
+            _, time, (changed, added, removed), offset = self._records[index]
+            indices, x, y, molten, movable, timeout, \
+                added_pairs, added_lengths, removed_pairs = self._arrays(
+                    offset, [(np.int64, changed, 1), (np.float64, changed, 1),
+                             (np.float64, changed, 1), (bool, changed, 1),
+                             (bool, changed, 1), (np.int64, changed, 1),
+                             (np.int64, added, 2), (np.float64, added, 1),
+                             (np.int64, removed, 2)])
+            for column, values in zip(columns,
+                                      (x, y, molten, movable, timeout)):
+                column[indices] = values
+            for i, j in removed_pairs.tolist():
+                edges.pop((min(i, j), max(i, j)), None)
+            for (i, j), length in zip(added_pairs.tolist(),
+                                      added_lengths.tolist()):
+                edges[(min(i, j), max(i, j))] = ((i, j), length)
+
+        return SimulatorState(*columns,
+                              [pair for pair, _ in edges.values()],
+                              [length for _, length in edges.values()], time)
+
+    def state_at(self, time):
+        # the state of the last record at or before the simulator time
+        index = bisect.bisect_right(self.times, time) - 1
+        if index < 0:
+            raise ValueError("No record at or before time %d" % time)
+        return self.state(index)